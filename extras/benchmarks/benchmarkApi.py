@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# Load test for the plugin's API (on_api_get and on_api_command).
+#
+# Mounts WhosPrintingPlugin with stand-in user manager, settings, event bus
+# and plugin manager, fills the user manager with a synthetic population and
+# drives the API from many concurrent clients, then reports the throughput
+# and p50/p99 latency for each request.
+#
+# Run from the OctoPrint virtualenv (needs flask and octoprint importable):
+#     python extras/benchmarks/benchmarkApi.py --users 5000 --clients 16 --seconds 20
+import argparse
+import bisect
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import flask
+
+from octoprint_whosprinting import WhosPrintingPlugin
+from octoprint_whosprinting.readerDrivers import NULL_READER
+
+SYLLABLES = ["an", "bel", "cor", "da", "el", "fin", "gar", "hol", "is", "jon", "ka", "lee", "mo", "nor",
+			 "os", "pat", "quin", "ros", "sam", "tor", "ul", "vic", "wen", "xan", "yor", "zed"]
+
+# The default request mix, relative weights.
+DEFAULT_MIX = "get_whos_printing=20,get_whos_printing_304=20,list=5,list_search=10,PrintStarted=2,PrintFinished=1,PrintFailed=1"
+
+class stubUser():
+	def __init__(self, name, settings):
+		self._name = name
+		self._settings = settings
+
+	def get_name(self):
+		return self._name
+
+	def get_all_settings(self):
+		return self._settings
+
+	def get_setting(self, key):
+		return self._settings.get(key)
+
+	def asDict(self):
+		return dict(name=self._name, active=True, admin=False, roles=["user"], apikey=None, settings=self._settings)
+
+class stubUserManager():
+	def __init__(self, users):
+		self._users = dict((user.get_name(), user) for user in users)
+
+	def getAllUsers(self):
+		return [user.asDict() for user in self._users.values()]
+
+	def findUser(self, username=None, apikey=None):
+		if username is None:
+			return None
+		return self._users.get(username)
+
+# Plugin settings from the plugin's defaults, plus any overrides.
+class stubSettings():
+	def __init__(self, defaults, overrides=None):
+		self._values = dict(defaults)
+		self._values.update(overrides or dict())
+
+	def get(self, path, **kwargs):
+		return self._values.get(path[0])
+
+	def get_int(self, path, **kwargs):
+		value = self.get(path)
+		return int(value) if value is not None else None
+
+	def get_float(self, path, **kwargs):
+		value = self.get(path)
+		return float(value) if value is not None else None
+
+	def get_boolean(self, path, **kwargs):
+		return bool(self.get(path))
+
+	def set(self, path, value, **kwargs):
+		self._values[path[0]] = value
+
+	def global_get(self, path, **kwargs):
+		return None
+
+# A printer that isn't connected.
+class stubPrinter():
+	def get_current_connection(self):
+		return ("Closed", None, None, None)
+
+	def get_state_id(self):
+		return "CLOSED"
+
+class countingEventBus():
+	def __init__(self):
+		self.fired = 0
+
+	def fire(self, event, payload=None):
+		self.fired += 1
+
+class countingPluginManager():
+	def __init__(self):
+		self.messages = 0
+
+	def send_plugin_message(self, identifier, data):
+		self.messages += 1
+
+def generate_users(count, seed=None):
+	generator = random.Random(seed)
+	users = []
+	names = set()
+	while len(users) < count:
+		first = "".join(generator.choice(SYLLABLES) for i in range(generator.randint(1, 3)))
+		last = "".join(generator.choice(SYLLABLES) for i in range(generator.randint(2, 3)))
+		name = "{0}.{1}".format(first, last)
+		if name in names:
+			name = "{0}{1}".format(name, len(users))
+		names.add(name)
+
+		settings = dict(
+			displayName="{0} {1}".format(first.capitalize(), last.capitalize()),
+			emailAddress="{0}@example.com".format(name),
+			phoneNumber="07{0:09d}".format(generator.randint(0, 999999999)),
+			twitter="@{0}".format(first) if generator.random() < 0.3 else None,
+			tinamous="@{0}".format(name) if generator.random() < 0.2 else None,
+			slack="@{0}".format(first) if generator.random() < 0.5 else None,
+			printInPrivate=generator.random() < 0.1,
+			keyfobId="{0:08x}".format(generator.getrandbits(32)) if generator.random() < 0.8 else None,
+		)
+		users.append(stubUser(name, settings))
+	return users
+
+# Mounts the plugin. No reader is opened unless settings picks one, the
+# benchmark host's serial ports are left alone.
+def create_plugin(users, data_folder, settings=None):
+	logger = logging.getLogger("benchmark.whosprinting")
+	logger.propagate = False
+	logger.addHandler(logging.NullHandler())
+
+	plugin = WhosPrintingPlugin()
+	plugin._identifier = "whosprinting"
+	plugin._plugin_version = "benchmark"
+	plugin._logger = logger
+	plugin._data_folder = data_folder
+	plugin._basefolder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "octoprint_whosprinting")
+	overrides = dict(rfidReaderType=NULL_READER)
+	overrides.update(settings or dict())
+	plugin._settings = stubSettings(plugin.get_settings_defaults(), overrides)
+	plugin._user_manager = stubUserManager(users)
+	plugin._printer = stubPrinter()
+	plugin._event_bus = countingEventBus()
+	plugin._plugin_manager = countingPluginManager()
+	plugin.initialize()
+	plugin.on_after_startup()
+	# on_after_startup logs at debug, keep the benchmark to the API.
+	logger.setLevel(logging.WARNING)
+	return plugin
+
+def parse_mix(text):
+	mix = []
+	for part in text.split(","):
+		name, weight = part.split("=")
+		mix.append((name.strip(), float(weight)))
+	return mix
+
+class apiClient():
+	def __init__(self, app, plugin, users, seed):
+		self._app = app
+		self._plugin = plugin
+		self._users = users
+		self._random = random.Random(seed)
+		self._etag = None
+
+	def get(self, etag=None, **values):
+		headers = {"If-None-Match": etag} if etag else {}
+		with self._app.test_request_context("/api/plugin/whosprinting", query_string=values, headers=headers):
+			return self._plugin.on_api_get(flask.request)
+
+	def command(self, command, data):
+		with self._app.test_request_context("/api/plugin/whosprinting", method="POST"):
+			return self._plugin.on_api_command(command, data)
+
+	def run(self, name):
+		if name == "get_whos_printing":
+			response = self.get(command="get_whos_printing")
+			self._etag = response.headers.get("ETag")
+		elif name == "get_whos_printing_304":
+			if self._etag is None:
+				self._etag = self.get(command="get_whos_printing").headers.get("ETag")
+			self.get(command="get_whos_printing", etag=self._etag)
+		elif name == "list":
+			self.get(command="list", offset=str(self._random.randint(0, 200)), limit="50")
+		elif name == "list_search":
+			self.get(command="list", q=self._random.choice(SYLLABLES), limit="20")
+		elif name == "PrintStarted":
+			self.command("PrintStarted", dict(username=self._random.choice(self._users).get_name()))
+		elif name == "PrintFinished":
+			self.command("PrintFinished", dict())
+		elif name == "PrintFailed":
+			self.command("PrintFailed", dict(reason="Model Moved"))
+		else:
+			raise ValueError("Unknown request: {0}".format(name))
+
+# Pick a name from the mix, cumulative is the running total of the weights.
+def pick(generator, names, cumulative):
+	return names[bisect.bisect_right(cumulative, generator.random() * cumulative[-1])]
+
+def percentile(values, fraction):
+	if not values:
+		return None
+	index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+	return values[index]
+
+def main():
+	parser = argparse.ArgumentParser(description="Load test the Who's Printing API.")
+	parser.add_argument("--users", type=int, default=1000, help="Size of the synthetic user population.")
+	parser.add_argument("--clients", type=int, default=8, help="Concurrent clients.")
+	parser.add_argument("--seconds", type=float, default=10.0, help="How long to run for.")
+	parser.add_argument("--mix", default=DEFAULT_MIX, help="Request weights, e.g. list=1,get_whos_printing=10")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+	args = parser.parse_args()
+
+	users = generate_users(args.users, args.seed)
+	data_folder = tempfile.mkdtemp(prefix="whosprinting-benchmark-")
+	plugin = create_plugin(users, data_folder)
+	app = flask.Flask(__name__)
+
+	mix = parse_mix(args.mix)
+	names = [name for name, weight in mix]
+	cumulative = []
+	for name, weight in mix:
+		cumulative.append(weight + (cumulative[-1] if cumulative else 0))
+	latencies = dict((name, []) for name in names)
+	errors = dict((name, 0) for name in names)
+	lock = threading.Lock()
+	deadline = time.time() + args.seconds
+
+	def client(index):
+		api = apiClient(app, plugin, users, args.seed + index)
+		generator = random.Random(args.seed * 1000 + index)
+		timings = dict((name, []) for name in names)
+		failed = dict((name, 0) for name in names)
+		while time.time() < deadline:
+			name = pick(generator, names, cumulative)
+			started = time.time()
+			try:
+				api.run(name)
+			except Exception:
+				failed[name] += 1
+				continue
+			timings[name].append(time.time() - started)
+		with lock:
+			for name in names:
+				latencies[name].extend(timings[name])
+				errors[name] += failed[name]
+
+	threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+	started = time.time()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	elapsed = time.time() - started
+
+	plugin.on_shutdown()
+	shutil.rmtree(data_folder, ignore_errors=True)
+
+	results = dict(users=args.users, clients=args.clients, seconds=elapsed, requests=dict())
+	total = 0
+	for name in names:
+		values = sorted(latencies[name])
+		total += len(values)
+		results["requests"][name] = dict(
+			count=len(values),
+			errors=errors[name],
+			perSecond=len(values) / elapsed,
+			p50Ms=percentile(values, 0.5) * 1000 if values else None,
+			p99Ms=percentile(values, 0.99) * 1000 if values else None,
+		)
+	results["perSecond"] = total / elapsed
+	results["pluginMessages"] = plugin._plugin_manager.messages
+	results["events"] = plugin._event_bus.fired
+
+	if args.json:
+		print(json.dumps(results, indent=2))
+		return
+
+	print("{0} users, {1} clients, {2:.1f}s: {3:.0f} requests/s".format(args.users, args.clients, elapsed, results["perSecond"]))
+	for name in names:
+		request = results["requests"][name]
+		if not request["count"]:
+			print("  {0:<24} no requests ({1} errors)".format(name, request["errors"]))
+			continue
+		print("  {0:<24} {1:>8.0f}/s  p50 {2:>7.2f}ms  p99 {3:>7.2f}ms  errors {4}".format(
+			name, request["perSecond"], request["p50Ms"], request["p99Ms"], request["errors"]))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# Benchmarks the reader path (microRWDHiTag2Reader polled by tagReaderEngine
+# on the readerPool) against the emulated reader on a pty.
+#
+# Reports:
+#   - swipe to RfidTagSeen latency percentiles over a timeline of swipes,
+#     apart for swipes made with the engine polling at its idle rate and at
+#     its active rate (within --active-period of the previous swipe)
+#   - serial bytes per second between the plugin and the reader
+#   - system calls per poll made by the reader (pyserial and the driver)
+#   - CPU used by the reader path per hour of idle polling
+#
+# The emulator runs in its own process so its CPU isn't counted.
+# Run from the OctoPrint virtualenv (needs pyserial and the plugin's imports):
+#     python extras/benchmarks/benchmarkReader.py --swipes 50 --idle-seconds 60
+import argparse
+import contextlib
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import select
+import sys
+import termios
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from microRWDEmulator import microRWDEmulator, ctsSimulator, ctsSimulatingPort, generate_timeline, parse_timeline, open_pty
+from octoprint_whosprinting.microRWDHiTag2Reader import microRWDHiTag2Reader
+from octoprint_whosprinting.readerPool import readerPool
+from octoprint_whosprinting.tagReaderEngine import tagReaderEngine
+
+# Counts the system calls made on the reader's thread while polling: reads,
+# writes, selects, ioctls (modem lines, queue sizes), flushes and sleeps.
+class syscallCounter():
+	FUNCTIONS = ((os, "read"), (os, "write"), (select, "select"), (fcntl, "ioctl"),
+				 (termios, "tcflush"), (termios, "tcdrain"), (time, "sleep"))
+
+	def __init__(self):
+		self._local = threading.local()
+		self.calls = 0
+		self.polls = 0
+
+	# Wrap the functions pyserial and the driver call, for the whole process.
+	def install(self):
+		for module, name in self.FUNCTIONS:
+			setattr(module, name, self._wrap(getattr(module, name)))
+
+	def _wrap(self, function):
+		def counted(*args, **kwargs):
+			self.add()
+			return function(*args, **kwargs)
+		return counted
+
+	# Count the calls the current thread makes in the block as one poll.
+	@contextlib.contextmanager
+	def poll(self):
+		self._local.counting = True
+		try:
+			yield
+		finally:
+			self._local.counting = False
+			self.polls += 1
+
+	def add(self, calls=1):
+		if getattr(self._local, "counting", False):
+			self.calls += calls
+
+	def per_poll(self):
+		return float(self.calls) / self.polls if self.polls else None
+
+# The simulated CTS line and flow control, counting the calls that are a
+# system call each on a real port.
+class countedCtsSimulatingPort(ctsSimulatingPort):
+	def __init__(self, port, cts, syscalls):
+		ctsSimulatingPort.__init__(self, port, cts)
+		self._syscalls = syscalls
+
+	def getCTS(self):
+		self._syscalls.add()
+		return ctsSimulatingPort.getCTS(self)
+
+	# pyserial writes with os.write, then selects until it's taken unless
+	# the write doesn't block.
+	def write(self, data):
+		self._syscalls.add(2 if getattr(self._port, "write_timeout", None) else 1)
+		return ctsSimulatingPort.write(self, data)
+
+	@property
+	def out_waiting(self):
+		self._syscalls.add()
+		return ctsSimulatingPort.out_waiting.fget(self)
+
+# The reader as the plugin uses it, with the port given CTS by the simulator.
+class emulatedMicroRWDHiTag2Reader(microRWDHiTag2Reader):
+	def __init__(self, logger, cts, syscalls):
+		microRWDHiTag2Reader.__init__(self, logger)
+		self._cts = cts
+		self._syscalls = syscalls
+
+	def open(self, port):
+		microRWDHiTag2Reader.open(self, port)
+		self.serial_port = countedCtsSimulatingPort(self.serial_port, self._cts, self._syscalls)
+
+	def tryTag(self):
+		with self._syscalls.poll():
+			return microRWDHiTag2Reader.tryTag(self)
+
+def run_emulator(connection, swipes, latency, jitter, noise, seed, linger):
+	master_fd, slave_path, slave_fd = open_pty()
+	emulator = microRWDEmulator(parse_timeline(swipes), latency, jitter, noise, seed)
+	emulator.started = time.time()
+	connection.send((slave_path, emulator.started))
+	try:
+		emulator.serve(master_fd, linger=linger)
+		connection.send(emulator.get_stats())
+		# Keep the pty open until the engine has stopped.
+		connection.recv()
+	finally:
+		os.close(slave_fd)
+		os.close(master_fd)
+
+def percentile(values, fraction):
+	if not values:
+		return None
+	values = sorted(values)
+	index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+	return values[index]
+
+def cpu_seconds():
+	times = os.times()
+	return times[0] + times[1]
+
+# Run the engine against an emulator following swipes.
+# Returns (tag events as (time, tag), emulator stats, emulator start time, elapsed seconds, cpu seconds, syscalls, engine stats).
+def run(swipes, args, linger):
+	cts = ctsSimulator(args.cts_period, args.cts_window)
+	parent, child = multiprocessing.Pipe()
+	process = multiprocessing.Process(target=run_emulator, args=(child, swipes, args.latency, args.jitter, args.noise, args.seed, linger))
+	process.start()
+	port, started = parent.recv()
+
+	logger = logging.getLogger("benchmark")
+	events = []
+	lock = threading.Lock()
+
+	def on_tag_seen(tag):
+		now = time.time()
+		with lock:
+			events.append((now, tag))
+
+	syscalls = syscallCounter()
+	syscalls.install()
+	pool = readerPool(logger, 1)
+	engine = tagReaderEngine(logger, emulatedMicroRWDHiTag2Reader(logger, cts, syscalls), port, on_tag_seen,
+							 active_period=args.active_period)
+	cpu_started = cpu_seconds()
+	wall_started = time.time()
+	engine.start(pool)
+
+	stats = parent.recv()
+	elapsed = time.time() - wall_started
+	cpu = cpu_seconds() - cpu_started
+	engine_stats = engine.get_stats()
+	engine.stop()
+	pool.shutdown()
+	parent.send("done")
+	process.join()
+	return events, stats, started, elapsed, cpu, syscalls, engine_stats
+
+# Latencies of the swipes seen, split into "idle" and "active" by whether
+# the swipe came more than active_period after the end of the one before.
+# Returns (latencies by kind, swipes missed).
+def swipe_latencies(swipes, events, started, active_period):
+	latencies = dict(idle=[], active=[])
+	missed = 0
+	previous_end = None
+	for swipe in sorted(swipes, key=lambda swipe: swipe["at"]):
+		at = started + swipe["at"]
+		kind = "active" if previous_end is not None and at - previous_end <= active_period else "idle"
+		previous_end = at + swipe.get("hold", 0.5)
+		seen = [event_time for event_time, tag in events if tag == swipe["tag"] and event_time >= at]
+		if seen:
+			latencies[kind].append(seen[0] - at)
+		else:
+			missed += 1
+	return latencies, missed
+
+def latency_percentiles(latencies):
+	return dict((name, percentile(latencies, fraction) * 1000 if latencies else None)
+				for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)))
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the Who's Printing reader path against an emulated Micro RWD HiTag2 reader.")
+	parser.add_argument("--timeline", help="JSON list of swipes: {\"at\", \"hold\", \"tag\"}")
+	parser.add_argument("--swipes", type=int, default=20, help="Swipes to generate if no timeline is given.")
+	parser.add_argument("--interval", type=float, default=8.0, help="Seconds between generated swipes, longer than --active-period for swipes at the idle poll rate.")
+	parser.add_argument("--hold", type=float, default=0.5, help="Seconds each generated swipe is held.")
+	parser.add_argument("--active-period", type=float, default=5.0, help="Seconds the engine keeps polling at the active rate after a tag.")
+	parser.add_argument("--idle-seconds", type=float, default=30.0, help="Seconds of idle polling to measure CPU over (0 to skip).")
+	parser.add_argument("--latency", type=float, default=0.0, help="Emulated reply delay (seconds).")
+	parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- added to the reply delay (seconds).")
+	parser.add_argument("--noise", type=float, default=0.0, help="Chance of each reply byte being corrupted.")
+	parser.add_argument("--cts-period", type=float, default=0.03, help="Seconds between reader send windows.")
+	parser.add_argument("--cts-window", type=float, default=0.01, help="Length of the reader send window (seconds).")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.ERROR)
+
+	if args.timeline:
+		with open(args.timeline, "r") as f:
+			swipes = json.load(f)
+	else:
+		swipes = generate_timeline(args.swipes, args.interval, args.hold, seed=args.seed)
+
+	events, stats, started, elapsed, cpu, syscalls, engine_stats = run(swipes, args, linger=1.0)
+	latencies, missed = swipe_latencies(swipes, events, started, args.active_period)
+	all_latencies = latencies["idle"] + latencies["active"]
+	results = dict(
+		swipes=len(swipes),
+		missed=missed,
+		latencyMs=latency_percentiles(all_latencies),
+		idleStartLatencyMs=dict(latency_percentiles(latencies["idle"]), swipes=len(latencies["idle"])),
+		activeStartLatencyMs=dict(latency_percentiles(latencies["active"]), swipes=len(latencies["active"])),
+		serialBytesPerSecond=(stats["bytesIn"] + stats["bytesOut"]) / elapsed,
+		commandsPerSecond=stats["commands"] / elapsed,
+		syscallsPerPoll=syscalls.per_poll(),
+		engineLatencyMeanMs=engine_stats["latencyMeanMs"],
+		engineLatencyMaxMs=engine_stats["latencyMaxMs"],
+	)
+
+	if args.idle_seconds:
+		idle = [dict(at=args.idle_seconds, hold=0, tag="00000000")]
+		_, idle_stats, _, idle_elapsed, idle_cpu, idle_syscalls, _ = run(idle, args, linger=0)
+		results["idleCpuSecondsPerHour"] = idle_cpu / idle_elapsed * 3600
+		results["idleSerialBytesPerSecond"] = (idle_stats["bytesIn"] + idle_stats["bytesOut"]) / idle_elapsed
+		results["idlePollsPerSecond"] = idle_syscalls.polls / idle_elapsed
+		results["idleSyscallsPerPoll"] = idle_syscalls.per_poll()
+
+	if args.json:
+		print(json.dumps(results, indent=2))
+		return
+
+	print("Swipes: {0} ({1} missed)".format(results["swipes"], results["missed"]))
+	for name, key in (("", "latencyMs"), (" (idle start)", "idleStartLatencyMs"), (" (active start)", "activeStartLatencyMs")):
+		latency = results[key]
+		if latency["p50"] is not None:
+			print("Swipe to event latency{0}: p50 {p50:.1f}ms  p90 {p90:.1f}ms  p99 {p99:.1f}ms  max {max:.1f}ms".format(name, **latency))
+	if all_latencies:
+		print("Latency reported by the engine: mean {0:.1f}ms  max {1:.1f}ms (swipe to event mean {2:.1f}ms)".format(
+			results["engineLatencyMeanMs"] or 0, results["engineLatencyMaxMs"], sum(all_latencies) / len(all_latencies) * 1000))
+	print("Serial: {0:.0f} bytes/s, {1:.1f} commands/s, {2:.1f} syscalls per poll".format(
+		results["serialBytesPerSecond"], results["commandsPerSecond"], results["syscallsPerPoll"] or 0))
+	if "idleCpuSecondsPerHour" in results:
+		print("Idle: {0:.1f} CPU seconds per hour, {1:.0f} serial bytes/s, {2:.1f} polls/s, {3:.1f} syscalls per poll".format(
+			results["idleCpuSecondsPerHour"], results["idleSerialBytesPerSecond"], results["idlePollsPerSecond"], results["idleSyscallsPerPoll"] or 0))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Compares finding the user for a swipe with the user index against the
+# walk over every user the plugin used to do, for several user populations.
+#
+# Times lookups of assigned keyfobs (hits) and of unknown keyfobs (misses),
+# which must not cause the index to be rebuilt, and one index rebuild.
+#
+# Run from the OctoPrint virtualenv:
+#     python extras/benchmarks/benchmarkUserIndex.py --users 100,10000,100000
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from benchmarkApi import generate_users, stubUserManager
+from octoprint_whosprinting.userIndex import userIndex
+
+# The lookup before the index: fetch every user and compare their keyfob.
+def linear_scan(user_manager, tagId):
+	for user in user_manager.getAllUsers():
+		user_settings = user["settings"]
+		if user_settings.get("keyfobId") == tagId:
+			return user["name"]
+	return None
+
+# Seconds per call of find(tagId) over the tags, repeated until at least
+# min_seconds have passed.
+def time_lookups(find, tags, min_seconds):
+	calls = 0
+	started = time.time()
+	while True:
+		for tagId in tags:
+			find(tagId)
+		calls += len(tags)
+		elapsed = time.time() - started
+		if elapsed >= min_seconds:
+			return elapsed / calls
+
+def format_time(seconds):
+	if seconds >= 0.001:
+		return "{0:.2f}ms".format(seconds * 1000)
+	return "{0:.2f}us".format(seconds * 1000000)
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the user index against a linear scan of the users")
+	parser.add_argument("--users", default="100,10000,100000", help="comma separated user populations")
+	parser.add_argument("--lookups", type=int, default=200, help="distinct tags looked up per population")
+	parser.add_argument("--seconds", type=float, default=1.0, help="minimum time to spend on each measurement")
+	parser.add_argument("--seed", type=int, default=1)
+	args = parser.parse_args()
+
+	logger = logging.getLogger("benchmark.userIndex")
+	logger.addHandler(logging.NullHandler())
+	logger.propagate = False
+
+	print("{0:>8} {1:>10} {2:>12} {3:>12} {4:>12} {5:>12} {6:>10}".format(
+		"users", "rebuild", "index hit", "index miss", "scan hit", "scan miss", "speedup"))
+
+	for count in [int(value) for value in args.users.split(",")]:
+		users = generate_users(count, seed=args.seed)
+		user_manager = stubUserManager(users)
+		generator = random.Random(args.seed)
+
+		assigned = [user.get_setting("keyfobId") for user in users if user.get_setting("keyfobId")]
+		hits = [generator.choice(assigned) for i in range(args.lookups)]
+		misses = ["unknown{0:08x}".format(i) for i in range(args.lookups)]
+
+		index = userIndex(logger, user_manager)
+		started = time.time()
+		index.rebuild()
+		rebuild = time.time() - started
+		built_at = index._built_at
+
+		index_hit = time_lookups(index.find_username, hits, args.seconds)
+		index_miss = time_lookups(index.find_username, misses, args.seconds)
+		if index._built_at != built_at:
+			print("FAIL: the index was rebuilt during lookups")
+			sys.exit(1)
+
+		# The scan is slow with many users, fewer lookups still give a stable time.
+		scan_tags = max(1, args.lookups * 100 // count)
+		scan_hit = time_lookups(lambda tagId: linear_scan(user_manager, tagId), hits[:scan_tags], args.seconds)
+		scan_miss = time_lookups(lambda tagId: linear_scan(user_manager, tagId), misses[:scan_tags], args.seconds)
+
+		print("{0:>8} {1:>10} {2:>12} {3:>12} {4:>12} {5:>12} {6:>9.0f}x".format(
+			count, format_time(rebuild), format_time(index_hit), format_time(index_miss),
+			format_time(scan_hit), format_time(scan_miss), scan_miss / index_miss))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# Software emulation of an IB Technology Micro RWD HiTag2 reader on a Linux
+# pseudo-terminal, so the reader code can be exercised without the hardware.
+#
+# Answers the "v" (version) command with a status byte and the "U" (tag query)
+# command with 0xD6 + the 4 byte tag id while a tag is presented, or 0xC0.
+# Tags are presented following a timeline of swipes, replies can be delayed
+# and corrupted with line noise.
+#
+# A pty has no modem lines so CTS can't be carried over it. The reader's CTS
+# timing (a send window every period) is simulated from the wall clock by
+# ctsSimulator, wrap the port the reader opens in ctsSimulatingPort to use it.
+#
+# Run on its own to get a pty to point a reader at:
+#     python microRWDEmulator.py --timeline swipes.json
+# where swipes.json is a list of {"at": <seconds>, "hold": <seconds>, "tag": "<8 hex digits>"}
+import argparse
+import binascii
+import json
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+COMMAND_VERSION = 0x76
+COMMAND_READ_TAG = 0x55
+STATUS_TAG_PRESENT = 0xD6
+STATUS_NO_TAG = 0xC0
+# Any non-zero status is accepted as the version by the plugin.
+STATUS_VERSION = 0x80
+
+# The reader is ready for a command (CTS active) for window seconds at the
+# start of every period seconds, counted from the unix epoch so separate
+# processes agree on it.
+class ctsSimulator():
+	def __init__(self, period=0.03, window=0.01):
+		self.period = period
+		self.window = window
+
+	def is_active(self, now=None):
+		if now is None:
+			now = time.time()
+		return (now % self.period) < self.window
+
+	# Seconds until CTS next goes active (0 if it is now).
+	def time_until_active(self, now=None):
+		if now is None:
+			now = time.time()
+		phase = now % self.period
+		if phase < self.window:
+			return 0.0
+		return self.period - phase
+
+# Wraps the pyserial port opened on the pty to add the reader's CTS line.
+# As with RTS/CTS flow control in the kernel, writes return at once and the
+# data is held (counted by out_waiting) until CTS is active, then sent by a
+# thread standing in for the kernel.
+class ctsSimulatingPort():
+	def __init__(self, port, cts):
+		self._port = port
+		self._cts = cts
+		self._condition = threading.Condition()
+		self._pending = bytearray()
+		self._closed = False
+		sender = threading.Thread(target=self._send)
+		sender.daemon = True
+		sender.start()
+
+	def getCTS(self):
+		return self._cts.is_active()
+
+	def write(self, data):
+		with self._condition:
+			self._pending.extend(data)
+			self._condition.notify()
+		return len(data)
+
+	@property
+	def out_waiting(self):
+		with self._condition:
+			return len(self._pending)
+
+	def reset_output_buffer(self):
+		with self._condition:
+			del self._pending[:]
+		self._port.reset_output_buffer()
+
+	def close(self):
+		with self._condition:
+			self._closed = True
+			self._condition.notify()
+		self._port.close()
+
+	def _send(self):
+		while True:
+			with self._condition:
+				while not self._pending and not self._closed:
+					self._condition.wait()
+				if self._closed:
+					return
+			delay = self._cts.time_until_active()
+			if delay:
+				time.sleep(delay)
+			with self._condition:
+				data = bytes(self._pending)
+				del self._pending[:]
+			if data:
+				self._port.write(data)
+
+	def __getattr__(self, name):
+		return getattr(self._port, name)
+
+# Swipes as (start, end, tag bytes), times relative to the emulator starting.
+def load_timeline(path):
+	with open(path, "r") as f:
+		return parse_timeline(json.load(f))
+
+def parse_timeline(swipes):
+	timeline = []
+	for swipe in swipes:
+		tag = bytearray(binascii.unhexlify(swipe["tag"]))
+		if len(tag) != 4:
+			raise ValueError("Tag ids are 4 bytes (8 hex digits): {0}".format(swipe["tag"]))
+		timeline.append((float(swipe["at"]), float(swipe["at"]) + float(swipe.get("hold", 0.5)), tag))
+	timeline.sort(key=lambda swipe: swipe[0])
+	return timeline
+
+# Evenly spaced swipes of random tags.
+def generate_timeline(count, interval=2.0, hold=0.5, start=1.0, seed=None):
+	generator = random.Random(seed)
+	swipes = []
+	for i in range(count):
+		tag = "{0:08x}".format(generator.getrandbits(32))
+		swipes.append(dict(at=start + i * interval, hold=hold, tag=tag))
+	return swipes
+
+class microRWDEmulator():
+	# latency/jitter: delay before each reply (seconds).
+	# noise: chance of each reply byte being corrupted, and of a stray byte
+	# being added to a reply.
+	def __init__(self, timeline=None, latency=0.0, jitter=0.0, noise=0.0, seed=None):
+		self._timeline = timeline or []
+		self._latency = latency
+		self._jitter = jitter
+		self._noise = noise
+		self._random = random.Random(seed)
+		self._pending = bytearray()
+		self.started = None
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.commands = 0
+
+	# The tag presented at t seconds after starting, None if there isn't one.
+	def tag_at(self, t):
+		for start, end, tag in self._timeline:
+			if start > t:
+				break
+			if t < end:
+				return tag
+		return None
+
+	def finished(self, t):
+		return not self._timeline or t > self._timeline[-1][1]
+
+	# Feed bytes received from the host, returns the replies to send.
+	def receive(self, data, now=None):
+		if now is None:
+			now = time.time()
+		if self.started is None:
+			self.started = now
+
+		self.bytes_in += len(data)
+		self._pending.extend(data)
+		replies = []
+		while self._pending:
+			command = self._pending[0]
+			if command == COMMAND_VERSION:
+				# "v" is followed by a parameter byte.
+				if len(self._pending) < 2:
+					break
+				del self._pending[:2]
+				replies.append(self._add_noise(bytearray([STATUS_VERSION])))
+			elif command == COMMAND_READ_TAG:
+				del self._pending[:1]
+				tag = self.tag_at(now - self.started)
+				if tag is None:
+					replies.append(self._add_noise(bytearray([STATUS_NO_TAG])))
+				else:
+					replies.append(self._add_noise(bytearray([STATUS_TAG_PRESENT]) + tag))
+			else:
+				# Unknown command, the reader ignores it.
+				del self._pending[:1]
+				continue
+			self.commands += 1
+		return replies
+
+	def reply_delay(self):
+		if not self._jitter:
+			return self._latency
+		return max(self._latency + self._random.uniform(-self._jitter, self._jitter), 0)
+
+	def _add_noise(self, reply):
+		if not self._noise:
+			return reply
+		for i in range(len(reply)):
+			if self._random.random() < self._noise:
+				reply[i] = self._random.getrandbits(8)
+		if self._random.random() < self._noise:
+			reply.append(self._random.getrandbits(8))
+		return reply
+
+	# Serve the host on the pty master fd until the timeline has finished
+	# (plus linger seconds), or forever if run_forever.
+	def serve(self, master_fd, linger=1.0, run_forever=False):
+		if self.started is None:
+			self.started = time.time()
+		while True:
+			now = time.time()
+			if not run_forever and self.finished(now - self.started - linger):
+				return
+
+			readable, _, _ = select.select([master_fd], [], [], 0.1)
+			if not readable:
+				continue
+			try:
+				data = os.read(master_fd, 64)
+			except OSError:
+				# The host closed the port.
+				return
+
+			for reply in self.receive(bytearray(data)):
+				delay = self.reply_delay()
+				if delay:
+					time.sleep(delay)
+				os.write(master_fd, bytes(reply))
+				self.bytes_out += len(reply)
+
+	def get_stats(self):
+		return dict(bytesIn=self.bytes_in, bytesOut=self.bytes_out, commands=self.commands)
+
+# Open a raw pty pair, returns (master fd, slave path, slave fd).
+# Keep the slave fd open until done so the master doesn't see a hang up
+# between the host opening and closing the port.
+def open_pty():
+	master_fd, slave_fd = os.openpty()
+	tty.setraw(slave_fd)
+	return master_fd, os.ttyname(slave_fd), slave_fd
+
+def main():
+	parser = argparse.ArgumentParser(description="Emulate a Micro RWD HiTag2 reader on a pseudo-terminal.")
+	parser.add_argument("--timeline", help="JSON list of swipes: {\"at\", \"hold\", \"tag\"}")
+	parser.add_argument("--swipes", type=int, default=10, help="Swipes to generate if no timeline is given.")
+	parser.add_argument("--interval", type=float, default=2.0, help="Seconds between generated swipes.")
+	parser.add_argument("--latency", type=float, default=0.0, help="Reply delay (seconds).")
+	parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- added to the reply delay (seconds).")
+	parser.add_argument("--noise", type=float, default=0.0, help="Chance of each reply byte being corrupted.")
+	parser.add_argument("--seed", type=int, default=None)
+	args = parser.parse_args()
+
+	if args.timeline:
+		timeline = load_timeline(args.timeline)
+	else:
+		timeline = parse_timeline(generate_timeline(args.swipes, args.interval, seed=args.seed))
+
+	master_fd, slave_path, slave_fd = open_pty()
+	print("Emulated reader on {0} (CTS must be simulated, see ctsSimulatingPort)".format(slave_path))
+	emulator = microRWDEmulator(timeline, args.latency, args.jitter, args.noise, args.seed)
+	try:
+		emulator.serve(master_fd, run_forever=True)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		os.close(slave_fd)
+		os.close(master_fd)
+		print(json.dumps(emulator.get_stats()))
+
+if __name__ == "__main__":
+	main()
@@ -4,6 +4,9 @@ from __future__ import absolute_import
 import flask
 import logging
 import logging.handlers
+import os
+import sqlite3
+import threading
 import time
 
 from octoprint.events import eventManager, Events
@@ -11,8 +14,22 @@ from octoprint.util import RepeatedTimer
 
 import octoprint.plugin
 
-from .microRWDHiTag2Reader import microRWDHiTag2Reader
+from .eventDispatcher import eventDispatcher
+from .keyfobEnrollment import enrollmentQueue, parse_keyfobs, validate_keyfobs, save_keyfobs, filebasedUserManagerShim
+from .longPoll import waitForChangeHandler, snapshot_etag, etag_matches
+from .metrics import metricsRegistry
 from .nullTagReader import nullTagReader
+from .portDetector import portDetector, is_auto_port, parse_usb_id
+from .printerStation import printerStation, DEFAULT_STATION_ID
+from .readerDrivers import readerDriverRegistry, builtin_reader_names
+from .readerPool import readerPool
+from .sessionJournal import sessionJournal, SOURCE_RFID, SOURCE_UI, OUTCOME_FINISHED, OUTCOME_FAILED, OUTCOME_SUPERSEDED, OUTCOME_INTERRUPTED
+from .sharedStore import sharedStore, sessionConflictError
+from .sessionState import invalidTransitionError, EVENT_START, EVENT_FINISH, EVENT_FAIL, EVENT_INTERRUPT, STATE_PRINTING
+from .tagReaderEngine import tagReaderEngine
+from .tagResolvers import tagResolverChain, localTagResolver, sharedTagResolver, httpTagResolver
+from .usageStatistics import usageStatistics
+from .userIndex import userIndex
 
 
 class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
@@ -23,23 +40,102 @@ class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
                          octoprint.plugin.SimpleApiPlugin,
                          octoprint.plugin.EventHandlerPlugin):
 
+	API_GET_COMMANDS = ["list", "stations", "get_whos_printing", "history", "stats", "leaderboard",
+						"dispatch_status", "keyfob_duplicates", "reader_status", "metrics", "enrollment_status"]
+
+	# Printer states (get_state_id) while OctoPrint is opening or looking for
+	# the printer's port, no port is probed for a reader then.
+	PRINTER_CONNECTING_STATES = ("OPEN_SERIAL", "DETECT_SERIAL", "DETECT_BAUDRATE", "CONNECTING")
+
 	def initialize(self):
 		self._logger.setLevel(logging.DEBUG)
 		self._logger.info("Who's Printing Plugin [%s] initialized..." % self._identifier)
-		# The username of the person that is printing.
-		self._whos_printing = ""
-		self._check_tags_timer = None
-		self._last_tag = None
-		self._rfidReader = nullTagReader(self._logger)
+		# The printers (and their readers) being monitored, by station id.
+		# Each station tracks who's printing on it.
+		self._stations = dict()
+		self._default_station_id = DEFAULT_STATION_ID
+		self._stations[DEFAULT_STATION_ID] = printerStation(DEFAULT_STATION_ID, "Printer")
+		self._station_order = [DEFAULT_STATION_ID]
+		# Timings and counters served by the metrics command.
+		# Created up front so nothing is allocated as they are updated.
+		self._metrics = metricsRegistry()
+		self._api_get_seconds = dict((command, self._metrics.histogram("api_seconds", "Time taken to handle API requests.", method="GET", command=command))
+									 for command in self.API_GET_COMMANDS + ["unknown"])
+		self._api_command_seconds = dict((command, self._metrics.histogram("api_seconds", "Time taken to handle API requests.", method="POST", command=command))
+										 for command in list(self.get_api_commands().keys()) + ["unknown"])
+		self._tag_lookup_seconds = self._metrics.histogram("tag_lookup_seconds", "Time taken to find the user for a tag.")
+		self._tag_lookups_known = self._metrics.counter("tag_lookups_total", "Tags looked up by whether a user was found.", result="known")
+		self._tag_lookups_unknown = self._metrics.counter("tag_lookups_total", "Tags looked up by whether a user was found.", result="unknown")
+		self._plugin_message_seconds = self._metrics.histogram("plugin_message_seconds", "Time taken to send a plugin message to the UI's.")
+		# Reader drivers are only imported when a station uses them.
+		self._reader_drivers = readerDriverRegistry(self._logger)
+		# Finds readers set to AUTO, remembering the port each was found on.
+		self._port_detector = portDetector(self._logger, os.path.join(self.get_plugin_data_folder(), "reader_ports.json"))
+		# All the readers are serviced by one bounded pool of threads.
+		self._reader_pool = readerPool(self._logger, self._settings.get_int(["maxReaderThreads"]) or 4)
+		# Plugin messages and tag handling are run from here so the readers
+		# and the event bus aren't held up by slow subscribers.
+		self._dispatcher = eventDispatcher(self._logger, metrics=self._metrics)
+		self._dispatcher.start()
+		# Keyfobs and who's printing shared with other instances on this host, if set up.
+		self._shared_store = self.create_shared_store()
+		# Rebuilt on the dispatcher, never on an API request or the swipe path.
+		self._user_index = userIndex(self._logger, self._user_manager,
+									 submit=lambda rebuild: self._dispatcher.submit_coalesced("userIndex", rebuild),
+									 on_rebuilt=self._shared_store.publish_tags if self._shared_store else None,
+									 users_file=self.get_users_file())
+		# Keyfob changes are made one batch (or swipe) at a time.
+		self._enrollment_lock = threading.Lock()
+		self._enrollment = enrollmentQueue()
+		self._tag_resolver = self.create_tag_resolver()
+		# Every print session is recorded here, any left open
+		# are from before a restart so can't still be running.
+		self._session_journal = sessionJournal(self._logger, os.path.join(self.get_plugin_data_folder(), "sessions.db"))
+		self._session_journal.end_open_sessions()
+		self._compact_history_timer = None
+		# Per user totals, kept up to date as sessions end.
+		self._usage_statistics = usageStatistics(self._logger, os.path.join(self.get_plugin_data_folder(), "statistics.json"))
+		self._usage_statistics.load(self._session_journal)
+		self._checkpoint_statistics_timer = None
+		self._refresh_user_index_timer = None
 
 	# Startup complete we can not get to the settings.
 	def on_after_startup(self):
 		self._logger.info("Who's Printing Plugin on_after_startup")
+		# Build the user index in the background rather than holding up
+		# startup, lookups before it's done wait for it. Then rebuild it
+		# when OctoPrint reports users changed.
+		self._user_index.invalidate()
+		self._user_index.watch_user_manager()
 		self.initialize_rfid_tag_reader()
+		# Keep the history bounded, checked daily.
+		self._compact_history_timer = RepeatedTimer(24 * 60 * 60, self.compact_history, run_first=True, daemon=True)
+		self._compact_history_timer.start()
+		self._checkpoint_statistics_timer = RepeatedTimer(60, self._usage_statistics.checkpoint, daemon=True)
+		self._checkpoint_statistics_timer.start()
+		# Picks up user changes nobody was told about (OctoPrint doesn't report
+		# user settings changes, e.g. a keyfob set on the user's settings):
+		# rebuilds when the users file has changed, or the index is an hour
+		# old, otherwise it's just a stat.
+		self._refresh_user_index_timer = RepeatedTimer(60, self._user_index.rebuild_if_older, daemon=True)
+		self._refresh_user_index_timer.start()
 
 	def on_shutdown(self):
-		self._check_tags_timer = None
-		self._rfidReader.close()
+		self._user_index.unwatch_user_manager()
+		self.stop_tag_reader_engines()
+		self._reader_pool.shutdown()
+		self._dispatcher.stop()
+		if self._compact_history_timer:
+			self._compact_history_timer.cancel()
+		if self._checkpoint_statistics_timer:
+			self._checkpoint_statistics_timer.cancel()
+		if self._refresh_user_index_timer:
+			self._refresh_user_index_timer.cancel()
+		self._usage_statistics.checkpoint()
+		self._session_journal.close()
+		if self._shared_store:
+			self._shared_store.release_instance_sessions()
+			self._shared_store.close()
 		self._logger.info("Who's Printing on_shutdown completed.")
 
 	##~~ SettingsPlugin mixin
@@ -53,15 +149,61 @@ class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
 			showPhoneNumber=False,
 			canRegister=True,
 			rfidReaderType="Micro RWD HiTag2",
-			readerOptions=["None", "Micro RWD HiTag2"],
+			# USB serial adapters (hex VID:PID) the reader may be on, AUTO only
+			# looks for the reader on ports with one of these. The FTDI FT232R
+			# is the adapter on the reader's USB modules.
+			rfidUsbIds=["0403:6001"],
+			# Replaced with every installed driver when the settings are loaded.
+			readerOptions=builtin_reader_names(),
+			# Member directory to look up tags that aren't assigned to a user here.
+			# May contain {tagId}, should return {"username": "..."} or 404.
 			tinamous_url="",
+			# Longest to wait for the directory (seconds) and how long to cache
+			# known/unknown tags (seconds).
+			tagDirectoryTimeout=1.0,
+			tagDirectoryCacheTtl=300,
+			tagDirectoryNegativeCacheTtl=60,
+			# List of dict(id, name, rfidReaderType, rfidComPort), one per printer.
+			# When empty a single "default" station uses rfidReaderType and rfidComPort.
+			stations=[],
+			# Most threads used to service the readers.
+			maxReaderThreads=4,
+			# A tag is raised once read this many polls in a row within the window
+			# (seconds), and removed after this many polls in a row without it.
+			tagArrivalReads=2,
+			tagArrivalWindow=0.5,
+			tagDepartureReads=2,
+			# Print session history is kept for this many days, up to this many sessions.
+			historyRetentionDays=730,
+			historyMaxSessions=100000,
+			# Most sessions the tab keeps in the browser's history list, older
+			# pages are fetched as it's scrolled until it holds this many.
+			historyDisplayLimit=200,
+			# SQLite file shared by the OctoPrint instances on this host for their
+			# keyfobs and who's printing. Empty to not share. Needs a restart.
+			sharedStorePath="",
 		)
 
+	def on_settings_load(self):
+		data = octoprint.plugin.SettingsPlugin.on_settings_load(self)
+		data["readerOptions"] = self._reader_drivers.names()
+		return data
+
 	def on_settings_save(self, data):
 		self._logger.info("on_settings_save")
+		# Not a setting, found from the installed drivers.
+		data.pop("readerOptions", None)
 		octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
-		# Handle posisble port or RFID reader changed
+		# Users may have been edited alongside the settings.
+		self._user_index.invalidate()
+		self._tag_resolver = self.create_tag_resolver()
+		# Handle posisble port, RFID reader or stations changed
 		self.initialize_rfid_tag_reader()
+		# Show email/phone settings change the details served.
+		for station in list(self._stations.values()):
+			username = station.whos_printing
+			if username:
+				station.session.refresh(username, self.get_user_details(username))
 
 	def get_template_configs(self):
 		return [
@@ -104,44 +246,177 @@ class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
 		)
 
 	# API GET command
-	# GET: http://localhost:5000/api/plugin/whosprinting?command=<command>&apikey=<key>
+	# GET: http://localhost:5000/api/plugin/whosprinting?command=<command>&station=<id>&apikey=<key>
+	# station is optional for the station specific commands, the first station is used if not given.
 	# commands:
 	#   list: Lists the users who can be assigned as printing.
-	#   get_whos_printing: Returns the current user details for the user that is printing.
+	#         Optional: q=<search>, match=prefix|substring, offset=<n>, limit=<n>
+	#         to search names/display names and page through the results.
+	#   stations: Lists the stations (printers) and their readers.
+	#   get_whos_printing: Returns the current user details for the user that is printing
+	#                      and the session state (idle/printing/finished/failed).
+	#                      Served with an ETag of the station, state epoch and version (the same as the
+	#                      wait route's), an If-None-Match listing it gives a 304.
+	#                      The version restarts from 0 with a new epoch when OctoPrint restarts.
+	#                      To wait for a change see the /plugin/whosprinting/wait route below.
+	#   history: Pages through the recorded print sessions (with the user's displayName), newest first.
+	#            Optional: user=<username>, station=<id>, since/until=<unix time>,
+	#            before=<nextBefore from the previous page>, limit=<n>
+	#   stats: Returns the usage statistics (sessions, successes, failures by reason,
+	#          total/mean duration in seconds, not counting interrupted sessions) for
+	#          user=<username>, or every user.
+	#   leaderboard: Returns the top users, optional by=sessions|successes|failures|
+	#                totalDuration|meanDuration|failureRate and limit=<n>
+	#   dispatch_status: Returns the dispatch queue depth, coalesced/dropped counts and lag.
+	#   metrics: Returns the timing histograms and counters (tag polling, serial round trips,
+	#            tag lookups, API requests, plugin messages). As JSON, or with
+	#            format=prometheus in the Prometheus text format for scraping.
+	#   keyfob_duplicates: Lists keyfob ids that are assigned to more than one user.
+	#   enrollment_status: Returns whether the station is in enrollment mode and the users waiting.
+	#   reader_status: Returns the tag reader state (connecting/ready/faulted), last error,
+	#                  retry count and polling and serial timing statistics.
+	#                  For every station keyed by id, or just the one given.
 	def on_api_get(self, request):
+		started = time.time()
+		try:
+			return self.handle_api_get(request)
+		finally:
+			histogram = self._api_get_seconds.get(request.values.get("command"), self._api_get_seconds["unknown"])
+			histogram.observe(time.time() - started)
+
+	def handle_api_get(self, request):
 		# self._logger.info("API Request args: {}".format(request.values.to_dict))
 
 		command = request.values.get("command", ".")
 		# self._logger.info("GET Command: {}".format(command))
 
 		if command == "list":
-			self._logger.info("Building users list.")
-			matched_users = []
-
-			# returned as a dictionary, can't get at role.
-			users = self._user_manager.getAllUsers()
-			for user in users:
-				# for list, show only the name rather than
-				# dump all the users identity info.
-				matched_users.append(user["name"])
-
-			return flask.jsonify(users=matched_users)
+			try:
+				offset = max(int(request.values.get("offset", 0)), 0)
+				limit = request.values.get("limit")
+				if limit is not None:
+					limit = min(max(int(limit), 1), 100)
+			except ValueError:
+				return flask.make_response("offset and limit must be numbers", 400)
+
+			# for list, show only the name (and display name) rather than
+			# dump all the users identity info.
+			total, matched_users = self._user_index.search(request.values.get("q"),
+															request.values.get("match", "prefix"),
+															offset, limit)
+
+			return flask.jsonify(users=[user["name"] for user in matched_users],
+								 results=matched_users,
+								 total=total,
+								 offset=offset,
+								 limit=limit)
+
+		elif command == "stations":
+			return flask.jsonify(stations=[station.as_dict() for station in self.get_stations()])
 
 		elif command == "get_whos_printing":
-			# get the user who is currently printing.
-			if self._whos_printing == "":
-				self._logger.info("Nobody's printing")
-				return
+			station = self.get_station(request.values.get("station"))
+			if station is None:
+				return flask.make_response("Unknown station", 404)
 
-			self._logger.info("Who's printing: {0}".format(self._whos_printing))
-			user = self._user_manager.findUser(self._whos_printing)
-			if user == None:
-				self._logger.info("Failed to find user: {0}".format(self._whos_printing))
-				return
-
-			settings = self.get_whos_printing_details(user)
+			# get the user who is currently printing.
+			# Served from the snapshot, this is polled by kiosks so
+			# no user manager calls or logging here.
+			snapshot = station.snapshot
+			etag = snapshot_etag(station.id, snapshot)
+			if etag_matches(request.headers.get("If-None-Match"), etag):
+				response = flask.make_response("", 304)
+			else:
+				response = flask.jsonify(user=snapshot.details, epoch=snapshot.epoch, version=snapshot.version, state=snapshot.state, station=station.id)
+			response.headers["ETag"] = etag
+			response.headers["Cache-Control"] = "no-cache"
+			return response
+
+		elif command == "history":
+			try:
+				since = request.values.get("since")
+				until = request.values.get("until")
+				before = request.values.get("before")
+				limit = min(max(int(request.values.get("limit", 50)), 1), 500)
+				sessions, next_before = self._session_journal.query(
+					username=request.values.get("user"),
+					station=request.values.get("station"),
+					since=float(since) if since else None,
+					until=float(until) if until else None,
+					before=int(before) if before else None,
+					limit=limit)
+			except ValueError:
+				return flask.make_response("since, until, before and limit must be numbers", 400)
+
+			for session in sessions:
+				session["displayName"] = self._user_index.get_display_name(session["username"])
+			return flask.jsonify(sessions=sessions, nextBefore=next_before)
+
+		elif command == "stats":
+			username = request.values.get("user")
+			if username:
+				return flask.jsonify(user=self._usage_statistics.get_user(username))
+			return flask.jsonify(users=self._usage_statistics.get_all())
+
+		elif command == "leaderboard":
+			try:
+				limit = min(max(int(request.values.get("limit", 10)), 1), 100)
+				leaders = self._usage_statistics.leaderboard(request.values.get("by", "sessions"), limit)
+			except ValueError as e:
+				return flask.make_response(str(e), 400)
+			return flask.jsonify(leaderboard=leaders)
+
+		elif command == "metrics":
+			if request.values.get("format") == "prometheus":
+				response = flask.make_response(self._metrics.as_prometheus())
+				response.headers["Content-Type"] = "text/plain; version=0.0.4"
+				return response
+			return flask.jsonify(**self._metrics.as_dict())
+
+		elif command == "dispatch_status":
+			return flask.jsonify(**self._dispatcher.get_stats())
+
+		elif command == "keyfob_duplicates":
+			return flask.jsonify(duplicates=self._user_index.get_duplicates())
+
+		elif command == "enrollment_status":
+			station = self.get_station(request.values.get("station"))
+			if station is None:
+				return flask.make_response("Unknown station", 404)
+			return flask.jsonify(station=station.id, **self._enrollment.get_status(station.id))
+
+		elif command == "reader_status":
+			statuses = dict()
+			for station in self.get_stations():
+				if station.engine:
+					statuses[station.id] = station.engine.get_status()
+				else:
+					statuses[station.id] = dict(state="stopped")
+
+			station_id = request.values.get("station")
+			if station_id:
+				if station_id not in statuses:
+					return flask.make_response("Unknown station", 404)
+				return flask.jsonify(**statuses[station_id])
+			return flask.jsonify(stations=statuses, threads=self._reader_pool.worker_count())
+
+	# Long poll route for kiosk displays
+	# GET: http://localhost:5000/plugin/whosprinting/wait?station=<id>&epoch=<epoch>&version=<version>&timeout=<seconds>&apikey=<key>
+	# Blocks until the station's who's printing epoch/version differs from the one given (or
+	# the timeout expires) and returns the same user/epoch/version as get_whos_printing.
+	# Waiting is done on the Tornado IOLoop rather than the Flask API which
+	# would hold up the whole server while a client waits.
+	def route_hook(self, server_routes, *args, **kwargs):
+		return [
+			(r"/wait", waitForChangeHandler, dict(get_station=self.get_station, is_valid_api_key=self.is_valid_api_key))
+		]
 
-			return flask.jsonify(user=settings)
+	def is_valid_api_key(self, apikey):
+		if not apikey:
+			return False
+		if apikey == self._settings.global_get(["api", "key"]):
+			return True
+		return self._user_manager.findUser(apikey=apikey) is not None
 
 	# API POST command options
 	def get_api_commands(self):
@@ -153,31 +428,75 @@ class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
 			PrintFinished=[],
 			PrintFailed=["reason"],
 			FakeTag=[],
+			EnrollKeyfobs=[],
+			StartEnrollment=["usernames"],
+			StopEnrollment=[],
 		)
 
 	# API POST command
+	# All commands take an optional "station" id, the first station is used if not given.
+	# PrintFinished/PrintFailed return 409 if nobody is printing on the station.
+	# PrintStarted returns 409 if the user is printing on another station (or instance).
+	# EnrollKeyfobs: Assigns keyfobs to many users with one save of the users.
+	#                keyfobs=[{username, keyfobId}] (or {username: keyfobId}), or csv="username,keyfobId\n..."
+	#                Optional dryRun=true to only validate. Nothing is saved if any entry is
+	#                invalid (unknown user, duplicates, keyfob already someone else's), 400 lists the errors.
+	# StartEnrollment: usernames=[...], the next swipes on the station are assigned to these users in order.
+	# StopEnrollment: Leave enrollment mode, returns the users still waiting.
 	def on_api_command(self, command, data):
+		started = time.time()
+		try:
+			return self.handle_api_command(command, data)
+		finally:
+			histogram = self._api_command_seconds.get(command, self._api_command_seconds["unknown"])
+			histogram.observe(time.time() - started)
+
+	def handle_api_command(self, command, data):
 		self._logger.info("On api POST Data: {}".format(data))
 
-		if command == "PrintStarted":
-			# data contains: username
-			self.set_whos_printing_print_started(data)
-		elif command == "PrintFinished":
-			# data expected to be empty
-			self.set_whos_printing_print_finished(data)
-		elif command == "PrintFailed":
-			# data expected to be empty
-			self.set_whos_printing_print_failed(data)
-		elif command == "FakeTag":
-			payload = dict(keyfobId="123789852")
+		station = self.get_station(data.pop("station", None))
+		if station is None:
+			return flask.make_response("Unknown station", 404)
+
+		try:
+			if command == "PrintStarted":
+				# data contains: username
+				self.set_whos_printing_print_started(station, data)
+			elif command == "PrintFinished":
+				# data expected to be empty
+				self.set_whos_printing_print_finished(station, data)
+			elif command == "PrintFailed":
+				# data expected to be empty
+				self.set_whos_printing_print_failed(station, data)
+		except invalidTransitionError as e:
+			# e.g. finished when nobody is printing (or somebody else already ended it).
+			self._logger.info("Ignoring {0} on {1}: {2}".format(command, station.id, e))
+			return flask.make_response(str(e), 409)
+		except sessionConflictError as e:
+			self._logger.info("Ignoring {0} on {1}: {2}".format(command, station.id, e))
+			return flask.make_response(str(e), 409)
+
+		if command == "EnrollKeyfobs":
+			return self.enroll_keyfobs(data)
+		elif command == "StartEnrollment":
+			return self.start_enrollment(station, data["usernames"])
+		elif command == "StopEnrollment":
+			waiting = self._enrollment.stop(station.id)
+			self._logger.info("Enrollment on {0} stopped, {1} users waiting".format(station.id, len(waiting)))
+			return flask.jsonify(station=station.id, waiting=waiting)
+
+		if command == "FakeTag":
+			payload = dict(keyfobId="123789852", station=station.id)
 			pluginData = dict(eventEvent="UnknownRfidTagSeen", eventPayload=payload)
-			self._plugin_manager.send_plugin_message(self._identifier, pluginData)
+			self.send_plugin_message(pluginData)
 
 	# EventHandler Plugin
 	def on_event(self, event, payload):
 		# Custom event raised by Who's Printing RFIX Dat
+		# Handled on the dispatcher so the event bus isn't held up by user lookups.
+		# Swipes are never dropped however busy the dispatcher is.
 		if event == "RfidTagSeen":
-			self.handle_rfid_tag_seen_event(payload)
+			self._dispatcher.submit_required(self.handle_rfid_tag_seen_event, payload)
 
 	##########################################
 	# Implementation
@@ -187,9 +506,19 @@ class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
 		tagId = payload["tagId"]
 		self._logger.info("RFID Tag Seen: " + tagId)
 
+		station = self.get_station(payload.get("station"))
+		if station is None:
+			self._logger.info("Tag seen on unknown station: {0}".format(payload.get("station")))
+			return
+
 		# Raise the plugin message for an RfidTagSeen.
 		pluginData = dict(eventEvent="RfidTagSeen", eventPayload=payload)
-		self._plugin_manager.send_plugin_message(self._identifier, pluginData)
+		self.send_plugin_message(pluginData)
+
+		# While enrolling swipes are assigned to the waiting users rather than starting prints.
+		if self._enrollment.is_active(station.id):
+			self.enroll_swiped_keyfob(station, tagId)
+			return
 
 		# Find the user this tag belongs to
 		user = self.find_user_from_tag(tagId)
@@ -197,7 +526,7 @@ class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
 		if (user == None):
 			self._logger.info("Did not find a user for the tag.")
 			pluginData = dict(eventEvent="UnknownRfidTagSeen", eventPayload=payload)
-			self._plugin_manager.send_plugin_message(self._identifier, pluginData)
+			self.send_plugin_message(pluginData)
 			return
 
 		useRfidReader = self._settings.get(['useRfidReader'])
@@ -207,96 +536,165 @@ class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
 
 		# User was found so handle a known user swipping the RFID
 		data = dict(username=user["name"])
-		self.set_whos_printing_print_started(data)
+		try:
+			self.set_whos_printing_print_started(station, data, SOURCE_RFID)
+		except sessionConflictError as e:
+			self._logger.info("Not starting a print on {0}: {1}".format(station.id, e))
+			payload = dict(username=e.username, printingOn=e.station, station=station.id)
+			self.send_plugin_message(dict(eventEvent="UserPrintingElsewhere", eventPayload=payload))
+			return
 		self._logger.info("raising print started from Rfid tag Swipe")
 
 	# Indicate that a user is printing as set from the Who's Printing Tab
 	# data contains: name, path, origin,file, username
-	def set_whos_printing_print_started(self, data):
-
-		# TODO: If somebody is currently printing and a new tag seen...
-		# Either the last persons print was finished and they didn't
-		# get flagged as finished and a new printer has come along
-		# Or somebody tagged whena print was under way (e.g to register).
-		# Assume it's a new printer...
-
-		if self._whos_printing:
-			self._logger.error("Somebody is already printing, we need to mark that as finished first")
-
-		# Store the user that is currently printing.
-		self._whos_printing = data["username"]
-		self._logger.info("Set who's printing to: {0}".format(self._whos_printing))
-		self.fire_whos_printing()
-		self.fire_printer_event(Events.PRINT_STARTED, data)
+	# The session state changes, history and events all happen in the
+	# session's transition so concurrent swipes and clicks are applied
+	# (and their events fired) one at a time.
+	# Raises sessionConflictError if the user is printing elsewhere.
+	def set_whos_printing_print_started(self, station, data, source=SOURCE_UI):
+		username = data["username"]
+		# Looked up before the transition to keep the user manager out of the session lock.
+		details = self.get_user_details(username)
+		if self._shared_store:
+			self._shared_store.claim_session(username, station.id)
+
+		def started(previous, snapshot):
+			# TODO: If somebody is currently printing and a new tag seen...
+			# Either the last persons print was finished and they didn't
+			# get flagged as finished and a new printer has come along
+			# Or somebody tagged whena print was under way (e.g to register).
+			# Assume it's a new printer...
+			if previous.state == STATE_PRINTING:
+				self._logger.error("Somebody is already printing, we need to mark that as finished first")
+			# Swiping again while printing keeps the user's claim.
+			self.end_session(station, OUTCOME_SUPERSEDED, release=previous.username != username)
+
+			# Store the user that is currently printing.
+			station.session_id = self._session_journal.session_started(station.id, username, source)
+			self._logger.info("Set who's printing on {0} to: {1}".format(station.id, username))
+			self.fire_whos_printing(station, snapshot)
+			self.fire_printer_event(station, Events.PRINT_STARTED, data, username)
+
+		return station.session.transition(EVENT_START, started, username=username, details=details, source=source)
 
 	# Indicate that a users print has finished (successfully) as set from the Who's Printing Tab
 	# data contains: name, path, origin,file
-	def set_whos_printing_print_finished(self, data):
-		self.fire_printer_event(Events.PRINT_DONE, data)
-		self._whos_printing = ""
-		self.fire_whos_printing()
+	# Raises invalidTransitionError if nobody is printing.
+	def set_whos_printing_print_finished(self, station, data):
+		def finished(previous, snapshot):
+			self.fire_printer_event(station, Events.PRINT_DONE, data, previous.username)
+			self.end_session(station, OUTCOME_FINISHED)
+			self.fire_whos_printing(station, snapshot)
+
+		return station.session.transition(EVENT_FINISH, finished)
 
 	# Indicate that a users print has failed :-( as set from the Who's Printing Tab
 	# data contains: name, path, origin,file
-	def set_whos_printing_print_failed(self, data):
-		self.fire_printer_event(Events.PRINT_FAILED, data)
-		self._whos_printing = ""
-		self.fire_whos_printing()
+	# Raises invalidTransitionError if nobody is printing.
+	def set_whos_printing_print_failed(self, station, data):
+		reason = data.get("reason")
+
+		def failed(previous, snapshot):
+			self.fire_printer_event(station, Events.PRINT_FAILED, data, previous.username)
+			self.end_session(station, OUTCOME_FAILED, reason)
+			self.fire_whos_printing(station, snapshot)
+
+		return station.session.transition(EVENT_FAIL, failed, reason=reason)
+
+	# Record the end of the station's current session (if any) in the history.
+	# Called from the session's transitions.
+	# The user is released for printing elsewhere unless release is False.
+	def end_session(self, station, outcome, reason=None, release=True):
+		if station.session_id is None:
+			return None
+		session = self._session_journal.session_ended(station.session_id, outcome, reason)
+		station.session_id = None
+		if session and release and self._shared_store:
+			self._shared_store.release_session(session["username"], station.id)
+		self._usage_statistics.record_session(session)
+		return session
+
+	def compact_history(self):
+		self._session_journal.compact(self._settings.get_int(["historyRetentionDays"]),
+									  self._settings.get_int(["historyMaxSessions"]))
 
 	# Fire a OctoPrint Printing event (if settings allow this).
 	# e.g. PrintDone, PrintStarted, PrintFailed.
 	# On a real install with an actual printer this probably isn't desirable
 	# On a monitoring install it lets other plugins do their thing.
 	# Injected into data is 'username' property with the username
-	# of the user that is printing. This then allows other
+	# of the user that is/was printing. This then allows other
 	# plugins (e.g. email/twitter) to pick this up for notifications.
-	# It is not an official part of the OctoPrint event.
-	def fire_printer_event(self, event, data):
+	# It is not an official part of the OctoPrint event, nor is 'station'.
+	def fire_printer_event(self, station, event, data, username):
 		if self._settings.get(['firePrinterEvents']):
 			self._logger.info("Firing printer event '{0}' for who's printing update".format(event))
 
 			# Inject the username of the user that is/was printing.
-			data["username"] = self._whos_printing
+			data["username"] = username
+			data["station"] = station.id
 			# Setup other properties expected for the printer event
 			# name is the filename, overload it here with the who's printing
 			# to allow timelapse naming based on the user name.
-			data["name"] = self._whos_printing
+			data["name"] = username
 			data["path"] = "."
 			data["origin"] = "local"
 			data["time"] = 60  # HACK: used in PrintDone
 			# Deprecated since 1.3.0
-			data["file"] = "/gcode/" + self._whos_printing + ".gcode"
+			data["file"] = "/gcode/" + username + ".gcode"
 			self._event_bus.fire(event, data)
 		else:
 			self._logger.info("Not firing printer event '{0}' as it's disabled by config".format(event))
 
-	# Fire the Custom OctoPrint wide event "WhosPrinting"
-	def fire_whos_printing(self):
+	# Send a plugin message to the UI's from the dispatcher.
+	# Messages with the same key that haven't been sent yet are replaced,
+	# so only the latest state is sent.
+	def send_plugin_message(self, pluginData, key=None):
+		if key is None:
+			self._dispatcher.submit(self.send_plugin_message_now, pluginData)
+		else:
+			self._dispatcher.submit_coalesced(key, self.send_plugin_message_now, pluginData)
+
+	# Called on the dispatcher thread, timed as this fans out to every UI.
+	def send_plugin_message_now(self, pluginData):
+		started = time.time()
+		self._plugin_manager.send_plugin_message(self._identifier, pluginData)
+		self._plugin_message_seconds.observe(time.time() - started)
+
+	# Fire the Custom OctoPrint wide event "WhosPrinting" for the session snapshot.
+	def fire_whos_printing(self, station, snapshot):
 		eventName = "WhosPrinting"
 
-		# Find the user. _whos_printing may be empty
-		# so we may get a None user if nobody is printing.
-		user = self._user_manager.findUser(self._whos_printing)
-		if user:
-			self._event_bus.fire(eventName, dict(username=self._whos_printing))
+		# The plugin message carries the same details as get_whos_printing
+		# so the UI's don't need to request them.
+		# details is None if nobody is printing (or the user wasn't found).
+		if snapshot.details:
+			self._event_bus.fire(eventName, dict(username=snapshot.username, station=station.id))
 
 			# Send the plugin message as well to update UI's
-			payload = dict(username=self._whos_printing)
+			payload = dict(username=snapshot.username, user=snapshot.details, epoch=snapshot.epoch, version=snapshot.version, station=station.id)
 			pluginData = dict(eventEvent=eventName, eventPayload=payload)
-			self._plugin_manager.send_plugin_message(self._identifier, pluginData)
+			self.send_plugin_message(pluginData, (eventName, station.id))
 		else:
 			# Clear the UI now printing has stopped
-			payload = dict(username="")
+			payload = dict(username="", user=None, epoch=snapshot.epoch, version=snapshot.version, station=station.id)
 			pluginData = dict(eventEvent=eventName, eventPayload=payload)
-			self._plugin_manager.send_plugin_message(self._identifier, pluginData)
+			self.send_plugin_message(pluginData, (eventName, station.id))
 
 	##########################################
 	# User registration / Management / Setings
 	##########################################
 
+	# The details served by get_whos_printing for the user, None if there's no such user.
+	def get_user_details(self, username):
+		user = self._user_manager.findUser(username)
+		if user is None:
+			return None
+		return self.get_whos_printing_details(user)
+
 	def get_whos_printing_details(self, user):
 		user_settings = user.get_all_settings()
-		self._logger.info("User settings from UserManager: {}".format(user_settings))
+		self._logger.debug("User settings from UserManager: {}".format(user_settings))
 
 		email_address = None
 		if self._settings.get(['showEmailAddress']):
@@ -308,10 +706,10 @@ class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
 
 		displayName = user_settings.get("displayName");
 		if displayName == None:
-			displayName = self._whos_printing
+			displayName = user.get_name()
 
 		settings = dict(
-			username=self._whos_printing,
+			username=user.get_name(),
 			displayName=displayName,
 			emailAddress=email_address,
 			phoneNumber=phone_number,
@@ -323,102 +721,296 @@ class WhosPrintingPlugin(octoprint.plugin.StartupPlugin,
 
 		return settings
 
-	def find_user_from_tag(self, tagId):
-		self._logger.info("Getting user for tag {0}".format(tagId))
-
-		users = self._user_manager.getAllUsers()
-		for user in users:
-			user_settings = user["settings"]
-			user_key_fob = user_settings.get("keyfobId")
-			#user_key_fob = user.get_setting("keyfobId")
-			if tagId == user_key_fob:
-				return user
-
-		self._logger.info("No user found for tag")
-		return None
+	# Assign keyfobs to users in bulk, see the EnrollKeyfobs command.
+	def enroll_keyfobs(self, data):
+		try:
+			entries = parse_keyfobs(data)
+		except ValueError as e:
+			return flask.make_response(str(e), 400)
+
+		with self._enrollment_lock:
+			assignments, errors = validate_keyfobs(entries, self._user_manager.getAllUsers())
+			if errors:
+				response = flask.jsonify(enrolled=0, errors=errors)
+				response.status_code = 400
+				return response
+
+			if not data.get("dryRun"):
+				save_keyfobs(self._user_manager, assignments, self._logger)
+				self._user_index.invalidate()
+				self._logger.info("Enrolled {0} keyfobs".format(len(assignments)))
+
+		return flask.jsonify(enrolled=0 if data.get("dryRun") else len(assignments), errors=[])
+
+	def start_enrollment(self, station, usernames):
+		if not isinstance(usernames, list) or not usernames:
+			return flask.make_response("usernames must be a list of users", 400)
+		unknown = [username for username in usernames if self._user_manager.findUser(username) is None]
+		if unknown:
+			return flask.make_response("Unknown users: {0}".format(", ".join(unknown)), 400)
+
+		self._enrollment.start(station.id, usernames)
+		self._logger.info("Enrollment on {0} started for {1} users".format(station.id, len(usernames)))
+		return flask.jsonify(station=station.id, **self._enrollment.get_status(station.id))
+
+	# Called on the dispatcher when a tag is swiped on a station in enrollment mode.
+	# The tag goes to the first waiting user unless it's already someone else's.
+	def enroll_swiped_keyfob(self, station, tagId):
+		with self._enrollment_lock:
+			username = self._enrollment.peek(station.id)
+			if username is None:
+				return
 
-	# RFID Card Reader handling
-	def initialize_rfid_tag_reader(self):
-		self._logger.info("Initializing RFID Tag Reader")
-		# Close the old reader (nullReader if not reader selected).
-		if self._check_tags_timer:
-			self._check_tags_timer = None
+			assignments, errors = validate_keyfobs([(None, username, tagId)], self._user_manager.getAllUsers())
+			if errors:
+				self._logger.info("Not enrolling tag {0} for {1}: {2}".format(tagId, username, errors[0]["error"]))
+				payload = dict(tagId=tagId, username=username, error=errors[0]["error"], station=station.id)
+				self.send_plugin_message(dict(eventEvent="KeyfobEnrollmentRejected", eventPayload=payload))
+				return
 
-		if self._rfidReader:
-			self._rfidReader.close()
+			save_keyfobs(self._user_manager, assignments, self._logger)
+			self._user_index.invalidate()
+			waiting = self._enrollment.enrolled(station.id, username)
 
-		readerType = self._settings.get(['rfidReaderType'])
-		if readerType == "Micro RWD HiTag2":
-			self._logger.info("Initializing Micro RWD HiTag2")
-			self._rfidReader = microRWDHiTag2Reader(self._logger)
-		else:
-			self._logger.info("Using null tag reader")
-			self._rfidReader = nullTagReader(self._logger)
+		self._logger.info("Enrolled tag {0} for {1} on {2}, {3} users waiting".format(tagId, username, station.id, len(waiting)))
+		payload = dict(tagId=tagId, username=username, waiting=waiting, station=station.id)
+		self.send_plugin_message(dict(eventEvent="KeyfobEnrolled", eventPayload=payload))
 
-		if self.try_initialze_tag_reader():
-			return
+	def find_user_from_tag(self, tagId):
+		self._logger.info("Getting user for tag {0}".format(tagId))
 
-		# Failed to initialise reader, try again...
-		self._rfidReader.close()
-		time.sleep(2)
-		if self.try_initialze_tag_reader:
-			return
+		started = time.time()
+		user = None
+		username = self._tag_resolver.resolve(tagId)
+		if username:
+			user = self._user_manager.findUser(username)
+			if user is None:
+				self._logger.info("Tag belongs to {0} who doesn't have an account here".format(username))
+		self._tag_lookup_seconds.observe(time.time() - started)
 
-		self._logger.info("Failed to initialze RFID reader on second attempt.")
-		# Find a way to indicate a fault.
+		if user:
+			self._tag_lookups_known.inc()
+			return user.asDict()
 
+		self._tag_lookups_unknown.inc()
+		self._logger.info("No user found for tag")
+		return None
 
-	def try_initialze_tag_reader(self):
-		try:
-			rfidPort = self._settings.get(['rfidComPort'])
-			if rfidPort:
-				self._logger.info("Opening port: {0} for RFID reader.".format(rfidPort))
-				self._rfidReader.open(rfidPort)
-			else:
-				self._logger.error("No COM port set for RFID reader")
-
-			readerVersion = self._rfidReader.read_version()
-			if readerVersion:
-				self._logger.info("Reader version: {0}".format(readerVersion))
-				# set the timer to check the reader for a tag
-				self.startTimer()
-				return True
-			else:
-				self._logger.error("Failed to read version from RFID Reader.")
-				return False
-		except IOError as e:
-			self._logger.error("Failed to open the serial port.")
-			return False
+	##########################################
+	# Stations
+	##########################################
 
-	def startTimer(self):
-		self._logger.info("Starting timer to read RFID tag")
-		self._check_tags_timer = RepeatedTimer(0.5, self.check_tag, None, None, True)
-		self._check_tags_timer.start()
+	# Returns the station for the id, the first station if no id is given,
+	# None if there is no station with the id.
+	# The file OctoPrint's file based user manager keeps the users in, None
+	# for other user managers.
+	def get_users_file(self):
+		if not filebasedUserManagerShim.supports(self._user_manager):
+			return None
+		path = self._settings.global_get(["accessControl", "userfile"])
+		if path is None:
+			path = os.path.join(self._settings.global_get_basefolder("base"), "users.yaml")
+		return path
+
+	def get_station(self, station_id=None):
+		if not station_id:
+			station_id = self._default_station_id
+		return self._stations.get(station_id)
+
+	def get_stations(self):
+		return [self._stations[station_id] for station_id in self._station_order]
+
+	# The configured stations, or a single default station from the
+	# rfidReaderType and rfidComPort settings if none are configured.
+	def get_stations_config(self):
+		readerType = self._settings.get(['rfidReaderType'])
+		rfidPort = self._settings.get(['rfidComPort'])
+
+		stations = self._settings.get(['stations']) or []
+		if not stations:
+			return [dict(id=DEFAULT_STATION_ID, name="Printer", rfidReaderType=readerType, rfidComPort=rfidPort)]
+
+		configs = []
+		for index, config in enumerate(stations):
+			station_id = str(config.get("id") or "station{0}".format(index + 1))
+			configs.append(dict(
+				id=station_id,
+				name=config.get("name") or station_id,
+				rfidReaderType=config.get("rfidReaderType") or readerType,
+				rfidComPort=config.get("rfidComPort"),
+			))
+		return configs
+
+	# Tags are looked up in the local users first, then the
+	# directory at tinamous_url (if set).
+	def create_tag_resolver(self):
+		resolvers = [localTagResolver(self._user_index)]
+		if self._shared_store:
+			resolvers.append(sharedTagResolver(self._shared_store))
+
+		url = self._settings.get(["tinamous_url"])
+		if url:
+			resolvers.append(httpTagResolver(self._logger, url,
+											 timeout=self._settings.get_float(["tagDirectoryTimeout"]),
+											 ttl=self._settings.get_int(["tagDirectoryCacheTtl"]),
+											 negative_ttl=self._settings.get_int(["tagDirectoryNegativeCacheTtl"])))
+
+		return tagResolverChain(resolvers)
+
+	# Open the store shared with the other instances, None if not set up (or
+	# it can't be opened). Claims left by this instance (e.g. from before a
+	# restart) are dropped like the open sessions in the journal.
+	def create_shared_store(self):
+		path = self._settings.get(["sharedStorePath"])
+		if not path:
+			return None
 
-	def check_tag(self):
 		try:
-			tag = self._rfidReader.seekTag()
+			store = sharedStore(self._logger, path, self.get_plugin_data_folder())
+			store.release_instance_sessions()
+		except sqlite3.Error as e:
+			self._logger.error("Failed to open the shared store {0}, not sharing. Exception: {1}".format(path, e))
+			return None
 
-			# If it's the same tag as before, user has not released the tag
-			# so just ignore it.
-			if tag == self._last_tag:
-				return
+		self._logger.info("Sharing keyfobs and who's printing through {0}".format(path))
+		return store
 
-			if tag:
-				self._logger.info("Got a tag!!!! TagId: {0}".format(tag))
-				# Raise the tag seen event.
-				payload = dict(tagId=tag)
-				self._event_bus.fire("RfidTagSeen", payload)
-				self._last_tag = tag
-			else:
-				# Clear last tag ready for a new one...
-				self._last_tag = None
-				self._logger.info("Tag removed")
-		except IOError as e:
-			self._logger.exception("Error reading tag. Exception: {0}".format(e))
-			#TODO: Disable after too many errors
-		except Exception as e:
-			self._logger.exception("Unhandled error reading tag. Exception: {0}".format(e))
+	# RFID Card Reader handling
+	# The readers are opened by the reader pool so this returns straight
+	# away, the pool keeps retrying until each reader responds.
+	# Stations keep who's printing if they are still configured.
+	def initialize_rfid_tag_reader(self):
+		self._logger.info("Initializing RFID Tag Readers")
+
+		configs = self.get_stations_config()
+		configured_ids = set(config["id"] for config in configs)
+
+		for station_id in list(self._stations.keys()):
+			if station_id not in configured_ids:
+				self._logger.info("Removing station {0}".format(station_id))
+				station = self._stations.pop(station_id)
+				station.session.transition(EVENT_INTERRUPT,
+										   lambda previous, snapshot: self.end_session(station, OUTCOME_INTERRUPTED))
+				if station.engine:
+					station.engine.stop(wait=False)
+					station.engine = None
+				self._port_detector.release(station_id)
+
+		for config in configs:
+			station = self._stations.get(config["id"])
+			if station is None:
+				station = printerStation(config["id"], config["name"])
+				self._stations[station.id] = station
+			station.name = config["name"]
+			self.initialize_station_reader(station, config["rfidReaderType"], config["rfidComPort"])
+
+		self._station_order = [config["id"] for config in configs]
+		self._default_station_id = self._station_order[0]
+
+	def initialize_station_reader(self, station, readerType, rfidPort):
+		metrics = self._metrics.with_labels(station=station.id)
+		reader = self._reader_drivers.create(readerType, metrics=metrics)
+		if reader:
+			self._logger.info("Initializing {0} for {1}".format(readerType, station.id))
+		else:
+			self._logger.info("Using null tag reader for {0}".format(station.id))
+			reader = nullTagReader(self._logger)
+
+		# Signal the old reader (nullReader if not reader selected) to stop,
+		# the new engine waits for it to close the port before opening it.
+		previous = station.engine
+		if previous:
+			previous.stop(wait=False)
+
+		station.reader_type = readerType
+		station.port = rfidPort
+		station.reader = reader
+
+		resolve_port = None
+		if is_auto_port(rfidPort) and not isinstance(reader, nullTagReader):
+			resolve_port = lambda: self.detect_reader_port(station, readerType)
+		else:
+			self._port_detector.release(station.id)
+
+		station.engine = tagReaderEngine(self._logger, reader, rfidPort,
+										 lambda tag: self.on_rfid_tag_seen(station, tag),
+										 on_faulted=lambda status: self.on_rfid_reader_faulted(station, status),
+										 on_recovered=lambda status: self.on_rfid_reader_recovered(station, status),
+										 arrival_reads=self._settings.get_int(["tagArrivalReads"]),
+										 arrival_window=self._settings.get_float(["tagArrivalWindow"]),
+										 departure_reads=self._settings.get_int(["tagDepartureReads"]),
+										 metrics=metrics,
+										 resolve_port=resolve_port)
+		station.engine.start(self._reader_pool, previous)
+
+	# Called by a station's engine (on a reader pool thread) when its port is
+	# AUTO to find the port the reader is on. Skips the printer's port (the
+	# connected and the configured one), ports other stations' readers use,
+	# and doesn't look at all while OctoPrint is connecting to the printer.
+	def detect_reader_port(self, station, readerType):
+		if self._printer.get_state_id() in self.PRINTER_CONNECTING_STATES:
+			raise IOError("Not looking for the RFID reader while the printer is connecting")
+
+		exclude = set()
+		printerPort = self._printer.get_current_connection()[1]
+		if printerPort:
+			exclude.add(printerPort)
+		configuredPort = self._settings.global_get(["serial", "port"])
+		if not is_auto_port(configuredPort):
+			exclude.add(configuredPort)
+		for other in list(self._stations.values()):
+			if other is station:
+				continue
+			if not is_auto_port(other.port):
+				exclude.add(other.port)
+			elif other.engine:
+				# Another AUTO reader that has already been found.
+				status = other.engine.get_status()
+				if status["state"] == tagReaderEngine.STATE_READY:
+					exclude.add(status["port"])
+
+		usb_ids = [usb_id for usb_id in (parse_usb_id(text) for text in self._settings.get(["rfidUsbIds"]) or []) if usb_id]
+
+		# The probing readers don't count towards the station's metrics.
+		return self._port_detector.detect(station.id,
+										  lambda logger: self._reader_drivers.create(readerType, logger=logger),
+										  usb_ids, exclude=exclude)
+
+	def stop_tag_reader_engines(self):
+		engines = [station.engine for station in self._stations.values() if station.engine]
+		for engine in engines:
+			engine.stop(wait=False)
+		for engine in engines:
+			engine.join()
+		for station in self._stations.values():
+			station.engine = None
+
+	# Called from a reader pool thread when a new tag is presented.
+	def on_rfid_tag_seen(self, station, tag):
+		self._logger.info("Got a tag!!!! TagId: {0} on {1}".format(tag, station.id))
+		# Raise the tag seen event.
+		payload = dict(tagId=tag, station=station.id)
+		self._event_bus.fire("RfidTagSeen", payload)
+
+	# Called from the tag reader thread once when the reader has failed too
+	# many times in a row, and once when it starts working again.
+	def on_rfid_reader_faulted(self, station, status):
+		self.fire_rfid_reader_event(station, "RfidReaderFaulted", status)
+
+	def on_rfid_reader_recovered(self, station, status):
+		self.fire_rfid_reader_event(station, "RfidReaderRecovered", status)
+
+	def fire_rfid_reader_event(self, station, eventName, status):
+		payload = dict(
+			station=station.id,
+			port=status["port"],
+			lastError=status["lastError"],
+			retryCount=status["retryCount"],
+			nextProbeSeconds=status["nextProbeSeconds"],
+		)
+		self._event_bus.fire(eventName, payload)
+		pluginData = dict(eventEvent=eventName, eventPayload=payload)
+		self.send_plugin_message(pluginData, ("RfidReader", station.id))
 
 
 
@@ -434,5 +1026,6 @@ def __plugin_load__():
 
 	global __plugin_hooks__
 	__plugin_hooks__ = {
-		"octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information
+		"octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information,
+		"octoprint.server.http.routes": __plugin_implementation__.route_hook
 	}
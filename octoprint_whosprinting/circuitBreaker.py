@@ -0,0 +1,71 @@
+import time
+
+# Circuit breaker for the tag reader.
+# Trips (opens) after failure_threshold consecutive failures. While open
+# requests are refused until the probe time, then a single probe is allowed
+# (half open). A failed probe re-opens the breaker with the probe delay
+# doubled, up to probe_max seconds. A success closes it again.
+class circuitBreaker():
+	CLOSED = "closed"
+	OPEN = "open"
+	HALF_OPEN = "half_open"
+
+	def __init__(self, failure_threshold=5, probe_initial=5.0, probe_max=300.0):
+		self._failure_threshold = failure_threshold
+		self._probe_initial = probe_initial
+		self._probe_max = probe_max
+
+		self.state = self.CLOSED
+		self.consecutive_failures = 0
+		self.trips = 0
+		self._probe_delay = probe_initial
+		self._next_probe = 0
+
+	def is_closed(self):
+		return self.state == self.CLOSED
+
+	# If a request should be attempted now. Moves an open breaker to half open
+	# once the probe time has passed.
+	def allow_request(self):
+		if self.state == self.OPEN:
+			if time.time() < self._next_probe:
+				return False
+			self.state = self.HALF_OPEN
+		return True
+
+	# Seconds until the next probe is allowed, 0 if not open.
+	def time_until_probe(self):
+		if self.state != self.OPEN:
+			return 0
+		return max(0, self._next_probe - time.time())
+
+	# Record a successful request.
+	# Returns True if this closed a tripped breaker (i.e. recovered).
+	def record_success(self):
+		recovered = self.state != self.CLOSED
+		self.state = self.CLOSED
+		self.consecutive_failures = 0
+		self._probe_delay = self._probe_initial
+		return recovered
+
+	# Record a failed request.
+	# Returns True if this failure tripped the breaker.
+	def record_failure(self):
+		self.consecutive_failures += 1
+
+		if self.state == self.HALF_OPEN:
+			# Failed probe, wait longer before the next one.
+			self._probe_delay = min(self._probe_delay * 2, self._probe_max)
+			self._open()
+			return False
+
+		if self.state == self.CLOSED and self.consecutive_failures >= self._failure_threshold:
+			self.trips += 1
+			self._open()
+			return True
+
+		return False
+
+	def _open(self):
+		self.state = self.OPEN
+		self._next_probe = time.time() + self._probe_delay
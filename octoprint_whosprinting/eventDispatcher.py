@@ -0,0 +1,143 @@
+import threading
+import time
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+from .metrics import metricsRegistry
+
+# Runs side effects (user lookups, plugin messages, events) on one worker
+# thread from a queue so the tag readers and the event bus never wait on
+# slow subscribers. Work is run in the order submitted.
+# Only work that can be lost (e.g. plugin messages, the UI's catch up on
+# the next poll) is bounded by max_queued and dropped when that many are
+# waiting. Work submitted with submit_required (tag swipes) is always queued.
+# Coalesced work (e.g. plugin messages) only runs the latest version for
+# each key, submitting again while one is queued replaces it.
+class eventDispatcher():
+	def __init__(self, logger, max_queued=100, metrics=None):
+		self._logger = logger
+		self._queue = queue.Queue()
+		self._max_queued = max_queued
+		# Droppable work waiting in the queue.
+		self._droppable = 0
+		self._lock = threading.Lock()
+		# key -> (function, args) for the coalesced work waiting to run.
+		self._pending = dict()
+		self._thread = None
+
+		self._dispatched = 0
+		self._coalesced = 0
+		self._dropped = 0
+		self._lag_last = None
+		self._lag_total = 0.0
+		self._lag_max = 0.0
+
+		metrics = metrics or metricsRegistry()
+		self._lag_seconds = metrics.histogram("dispatch_lag_seconds", "Time work waited in the dispatch queue.")
+		self._run_seconds = metrics.histogram("dispatch_run_seconds", "Time taken to run dispatched work.")
+		self._coalesced_total = metrics.counter("dispatch_coalesced_total", "Queued work replaced by a newer submission.")
+		self._dropped_total = metrics.counter("dispatch_dropped_total", "Work dropped as the dispatch queue was full.")
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run, name="WhosPrintingDispatcher")
+		self._thread.daemon = True
+		self._thread.start()
+
+	# Stop once the work already queued has been run.
+	def stop(self, timeout=2.0):
+		if not self._thread:
+			return
+		self._queue.put((None, None, None, time.time(), False))
+		if self._thread is not threading.current_thread():
+			self._thread.join(timeout)
+		self._thread = None
+
+	# Queue function(*args) to be run. Returns False if the queue was full
+	# and the work was dropped.
+	def submit(self, function, *args):
+		return self._put((function, args, None, time.time(), True))
+
+	# Queue function(*args) to be run however much is waiting, for work that
+	# mustn't be lost (e.g. handling a tag swipe).
+	def submit_required(self, function, *args):
+		self._queue.put((function, args, None, time.time(), False))
+
+	# Queue function(*args) to be run, replacing any work with the same
+	# key that hasn't run yet.
+	def submit_coalesced(self, key, function, *args):
+		with self._lock:
+			queued = key in self._pending
+			self._pending[key] = (function, args)
+			if queued:
+				self._coalesced += 1
+				self._coalesced_total.inc()
+				return True
+
+		if not self._put((None, None, key, time.time(), True)):
+			with self._lock:
+				self._pending.pop(key, None)
+			return False
+		return True
+
+	def get_stats(self):
+		with self._lock:
+			dispatched = self._dispatched
+			return dict(
+				queueDepth=self._queue.qsize(),
+				dispatched=dispatched,
+				coalesced=self._coalesced,
+				dropped=self._dropped,
+				lagLastMs=(self._lag_last * 1000) if self._lag_last is not None else None,
+				lagMeanMs=(self._lag_total / dispatched * 1000) if dispatched else None,
+				lagMaxMs=self._lag_max * 1000,
+			)
+
+	# Queue droppable work unless max_queued are already waiting.
+	def _put(self, item):
+		with self._lock:
+			full = self._droppable >= self._max_queued
+			if full:
+				self._dropped += 1
+			else:
+				self._droppable += 1
+				self._queue.put(item)
+
+		if full:
+			self._dropped_total.inc()
+			self._logger.warning("Who's Printing dispatch queue is full, dropping work")
+			return False
+		return True
+
+	def _run(self):
+		while True:
+			function, args, key, submitted, droppable = self._queue.get()
+			if droppable:
+				with self._lock:
+					self._droppable -= 1
+			if function is None and key is None:
+				return
+
+			if key is not None:
+				with self._lock:
+					function, args = self._pending.pop(key, (None, None))
+				if function is None:
+					continue
+
+			started = time.time()
+			lag = started - submitted
+			self._lag_seconds.observe(lag)
+			with self._lock:
+				self._dispatched += 1
+				self._lag_last = lag
+				self._lag_total += lag
+				if lag > self._lag_max:
+					self._lag_max = lag
+
+			try:
+				function(*args)
+			except Exception as e:
+				self._logger.exception("Error dispatching Who's Printing work. Exception: {0}".format(e))
+			self._run_seconds.observe(time.time() - started)
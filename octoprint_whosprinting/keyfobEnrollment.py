@@ -0,0 +1,197 @@
+import collections
+import csv
+import threading
+
+try:
+	from octoprint.access.users import FilebasedUserManager
+except ImportError:
+	# OctoPrint before 1.4.
+	try:
+		from octoprint.users import FilebasedUserManager
+	except ImportError:
+		FilebasedUserManager = None
+
+from .userIndex import userIndex
+
+# Bulk assignment of keyfobs to users, e.g. when a class of new members
+# is signed up, and the enrollment mode where the next swipes at a reader
+# are assigned to a queue of users.
+
+# The keyfobs to assign from an EnrollKeyfobs request. data holds either
+# "keyfobs", a list of dict(username, keyfobId) or a dict of username ->
+# keyfobId, or "csv", text with a username,keyfobId line per user (a
+# header line is skipped).
+# Returns a list of (row, username, keyfobId), raises ValueError if the
+# data isn't in either form.
+def parse_keyfobs(data):
+	if data.get("csv") is not None:
+		entries = []
+		for row, line in enumerate(csv.reader(data["csv"].splitlines()), 1):
+			fields = [field.strip() for field in line]
+			if not any(fields):
+				continue
+			if row == 1 and fields[0].lower() == "username":
+				continue
+			if len(fields) != 2:
+				raise ValueError("Line {0}: expected username,keyfobId".format(row))
+			entries.append((row, fields[0], fields[1]))
+		return entries
+
+	keyfobs = data.get("keyfobs")
+	if isinstance(keyfobs, dict):
+		return [(row, username, keyfobId) for row, (username, keyfobId) in enumerate(sorted(keyfobs.items()), 1)]
+	if isinstance(keyfobs, list):
+		entries = []
+		for row, entry in enumerate(keyfobs, 1):
+			if not isinstance(entry, dict):
+				raise ValueError("Entry {0}: expected username and keyfobId".format(row))
+			entries.append((row, entry.get("username"), entry.get("keyfobId")))
+		return entries
+
+	raise ValueError("Expected keyfobs or csv")
+
+# Check the keyfobs against the users (from getAllUsers) in one pass.
+# Rejects unknown users, users or keyfobs given more than once, and
+# keyfobs that belong to somebody else who isn't being given a new one.
+# Returns (assignments as (username, keyfobId), errors as
+# dict(row, username, keyfobId, error)), nothing should be saved if
+# there are any errors.
+def validate_keyfobs(entries, users):
+	usernames = set()
+	owners = dict()
+	for user in users:
+		usernames.add(user["name"])
+		keyfob = userIndex.normalise_tag((user.get("settings") or dict()).get("keyfobId"))
+		if keyfob:
+			owners.setdefault(keyfob, set()).add(user["name"])
+
+	batch_users = set()
+	batch_keyfobs = set()
+	valid = []
+	errors = []
+	for row, username, keyfobId in entries:
+		keyfobId = str(keyfobId).strip() if keyfobId is not None else None
+		keyfob = userIndex.normalise_tag(keyfobId)
+		error = None
+		if not username or not keyfob:
+			error = "Missing username or keyfobId"
+		elif username not in usernames:
+			error = "Unknown user"
+		elif username in batch_users:
+			error = "User given more than once"
+		elif keyfob in batch_keyfobs:
+			error = "Keyfob given more than once"
+		batch_users.add(username)
+		batch_keyfobs.add(keyfob)
+
+		if error:
+			errors.append(dict(row=row, username=username, keyfobId=keyfobId, error=error))
+		else:
+			valid.append((row, username, keyfobId))
+
+	# Keyfobs only move from users who are in the batch (and so get a new one).
+	assignments = []
+	for row, username, keyfobId in valid:
+		others = owners.get(userIndex.normalise_tag(keyfobId), set()) - batch_users
+		if others:
+			errors.append(dict(row=row, username=username, keyfobId=keyfobId,
+							   error="Keyfob belongs to {0}".format(", ".join(sorted(others)))))
+		else:
+			assignments.append((username, keyfobId))
+
+	return assignments, errors
+
+# Set the keyfobId of each user, with a single write of the users file
+# when OctoPrint's own file based user manager is in use. Other user
+# managers are updated a user at a time through changeUserSettings.
+def save_keyfobs(user_manager, assignments, logger):
+	if filebasedUserManagerShim.supports(user_manager):
+		filebasedUserManagerShim.save_settings(user_manager, [(username, dict(keyfobId=keyfobId)) for username, keyfobId in assignments])
+		return
+
+	filebasedUserManagerShim.log_fallback(logger, user_manager)
+	for username, keyfobId in assignments:
+		user_manager.changeUserSettings(username, dict(keyfobId=keyfobId))
+
+# Compatibility shim to change many users' settings with one save.
+# FilebasedUserManager.changeUserSettings writes users.yaml on every call,
+# which takes minutes for a class of new members. For exactly that class
+# (not subclasses or other managers, which may store users differently)
+# the settings are set on the users, the file is written once through its
+# private _save(), and then each user's sessions are told they changed as
+# changeUserSettings does. Needs revisiting if OctoPrint changes these
+# internals, anything missing falls back to changeUserSettings.
+class filebasedUserManagerShim():
+	_fallback_logged = False
+
+	@staticmethod
+	def supports(user_manager):
+		return (FilebasedUserManager is not None
+				and type(user_manager) is FilebasedUserManager
+				and hasattr(user_manager, "_save"))
+
+	# settings is a list of (username, dict of settings to change).
+	@staticmethod
+	def save_settings(user_manager, settings):
+		for username, changes in settings:
+			user = user_manager.findUser(username)
+			for key, value in changes.items():
+				user.set_setting(key, value)
+		user_manager._dirty = True
+		user_manager._save()
+
+		notify = getattr(user_manager, "_trigger_on_user_modified", None)
+		if notify:
+			for username, changes in settings:
+				notify(username)
+
+	# Logged once, the first time a batch is saved a user at a time.
+	@classmethod
+	def log_fallback(cls, logger, user_manager):
+		if cls._fallback_logged:
+			return
+		cls._fallback_logged = True
+		logger.info("{0} isn't OctoPrint's file based user manager, keyfobs are saved a user at a time".format(type(user_manager).__name__))
+
+# The users waiting for a keyfob on each station in enrollment mode.
+# The next swipe on the station is assigned to the first user in its queue.
+class enrollmentQueue():
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._queues = dict()
+
+	def start(self, station_id, usernames):
+		with self._lock:
+			self._queues[station_id] = collections.deque(usernames)
+
+	# Returns the users that were still waiting.
+	def stop(self, station_id):
+		with self._lock:
+			return list(self._queues.pop(station_id, []))
+
+	def is_active(self, station_id):
+		return station_id in self._queues
+
+	# The user the next swipe on the station is for, None if not enrolling.
+	def peek(self, station_id):
+		with self._lock:
+			queue = self._queues.get(station_id)
+			return queue[0] if queue else None
+
+	# Remove the user from the front of the queue once they have their keyfob.
+	# Enrollment ends when nobody is left. Returns the users still waiting.
+	def enrolled(self, station_id, username):
+		with self._lock:
+			queue = self._queues.get(station_id)
+			if not queue:
+				return []
+			if queue[0] == username:
+				queue.popleft()
+			if not queue:
+				del self._queues[station_id]
+			return list(queue)
+
+	def get_status(self, station_id):
+		with self._lock:
+			queue = self._queues.get(station_id)
+			return dict(active=queue is not None, waiting=list(queue or []))
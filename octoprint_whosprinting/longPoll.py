@@ -0,0 +1,122 @@
+import datetime
+import re
+import threading
+
+try:
+	from urllib.parse import quote
+except ImportError:
+	from urllib import quote
+
+import tornado.gen
+import tornado.web
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+# The entity tags listed in an If-None-Match header, "*" included.
+_ENTITY_TAG = re.compile(r'(?:W/)?("[^"]*"|\*)')
+
+# The ETag of a station's snapshot. The same for get_whos_printing and the
+# wait route, so a client can send one it got from either. The station id
+# is quoted to keep the tag valid whatever the id is configured as.
+def snapshot_etag(station_id, snapshot):
+	return '"{0}-{1}-{2}"'.format(quote(station_id.encode("utf-8"), safe=""), snapshot.epoch, snapshot.version)
+
+# Whether an If-None-Match header matches etag: it lists it (weak or not)
+# or is "*". Tags are compared whole.
+def etag_matches(if_none_match, etag):
+	for candidate in _ENTITY_TAG.findall(if_none_match or ""):
+		if candidate == etag or candidate == "*":
+			return True
+	return False
+
+# Holds the latest session snapshot and the futures of the
+# clients waiting for it to change.
+# Waiters are plain futures resolved on their IOLoop so any number of
+# clients can wait without a thread each. publish may be called from any thread.
+class changeNotifier():
+	def __init__(self, snapshot):
+		self._lock = threading.Lock()
+		self._snapshot = snapshot
+		self._waiters = []
+
+	def get_snapshot(self):
+		return self._snapshot
+
+	def waiting_count(self):
+		return len(self._waiters)
+
+	# Returns a future for the next snapshot after epoch/version.
+	# Already resolved if the current snapshot is a different version, or
+	# from a different epoch (the version was seen before a restart).
+	# Without an epoch only the version is compared.
+	def wait(self, version, epoch=None):
+		future = Future()
+		with self._lock:
+			if self._snapshot.version != version or (epoch is not None and self._snapshot.epoch != epoch):
+				future.set_result(self._snapshot)
+				return future
+			self._waiters.append((future, IOLoop.current()))
+		return future
+
+	def cancel(self, future):
+		with self._lock:
+			self._waiters = [waiter for waiter in self._waiters if waiter[0] is not future]
+
+	def publish(self, snapshot):
+		with self._lock:
+			self._snapshot = snapshot
+			waiters = self._waiters
+			self._waiters = []
+
+		for future, io_loop in waiters:
+			io_loop.add_callback(self._resolve, future, snapshot)
+
+	@staticmethod
+	def _resolve(future, snapshot):
+		if not future.done():
+			future.set_result(snapshot)
+
+# GET /plugin/whosprinting/wait?station=<id>&epoch=<last seen epoch>&version=<last seen version>&timeout=<seconds>&apikey=<key>
+# Returns the station's who's printing snapshot as soon as its epoch or
+# version differs from the one given, or the current snapshot when the timeout (default 30s,
+# max 120s) expires. Runs on the Tornado IOLoop so the Flask API isn't tied up.
+class waitForChangeHandler(tornado.web.RequestHandler):
+	def initialize(self, get_station, is_valid_api_key):
+		self._get_station = get_station
+		self._is_valid_api_key = is_valid_api_key
+		self._notifier = None
+		self._future = None
+
+	@tornado.gen.coroutine
+	def get(self):
+		apikey = self.get_argument("apikey", None) or self.request.headers.get("X-Api-Key")
+		if not self._is_valid_api_key(apikey):
+			raise tornado.web.HTTPError(401)
+
+		try:
+			version = int(self.get_argument("version", "-1"))
+			epoch = self.get_argument("epoch", None)
+			timeout = min(max(float(self.get_argument("timeout", "30")), 0), 120)
+		except ValueError:
+			raise tornado.web.HTTPError(400)
+
+		station = self._get_station(self.get_argument("station", None))
+		if station is None:
+			raise tornado.web.HTTPError(404)
+		self._notifier = station.notifier
+
+		self._future = self._notifier.wait(version, epoch)
+		try:
+			snapshot = yield tornado.gen.with_timeout(datetime.timedelta(seconds=timeout), self._future)
+		except tornado.gen.TimeoutError:
+			self._notifier.cancel(self._future)
+			snapshot = self._notifier.get_snapshot()
+		self._future = None
+
+		self.set_header("Cache-Control", "no-cache")
+		self.set_header("ETag", snapshot_etag(station.id, snapshot))
+		self.write(dict(user=snapshot.details, epoch=snapshot.epoch, version=snapshot.version, state=snapshot.state, station=station.id))
+
+	def on_connection_close(self):
+		if self._future:
+			self._notifier.cancel(self._future)
@@ -0,0 +1,140 @@
+import bisect
+import collections
+import threading
+
+# Bucket upper bounds (seconds) for timings, from a serial byte to an HTTP lookup timeout.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Counters and histograms are updated without a lock (and without allocating)
+# so they can stay on in the polling and API paths. Under CPython an update
+# racing with another thread's may very occasionally be lost, which is fine
+# for monitoring. Only creating a metric takes the registry lock, so create
+# them up front rather than per call.
+
+class counter():
+	__slots__ = ("name", "labels", "value")
+
+	def __init__(self, name, labels):
+		self.name = name
+		self.labels = labels
+		self.value = 0
+
+	def inc(self, amount=1):
+		self.value += amount
+
+class histogram():
+	__slots__ = ("name", "labels", "bounds", "counts", "count", "sum")
+
+	def __init__(self, name, labels, buckets):
+		self.name = name
+		self.labels = labels
+		self.bounds = tuple(buckets)
+		# One count per bucket plus one for values above the last bound.
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	# Cumulative (upper bound, count) pairs, the last bound is None (+Inf).
+	def cumulative(self):
+		total = 0
+		result = []
+		for bound, count in zip(self.bounds + (None,), list(self.counts)):
+			total += count
+			result.append((bound, total))
+		return result
+
+# Holds the plugin's metrics, served as JSON or in the Prometheus text format.
+# with_labels returns a view of the same registry that adds labels (e.g. the
+# station) to every metric it creates.
+# Asking for a metric that already exists returns it, so counts survive
+# readers/engines being recreated.
+class metricsRegistry():
+	def __init__(self, prefix="whosprinting", _shared=None, _labels=()):
+		if _shared is None:
+			_shared = (threading.Lock(), collections.OrderedDict(), dict())
+		self._prefix = prefix
+		self._lock, self._metrics, self._descriptions = _shared
+		self._labels = _labels
+
+	def with_labels(self, **labels):
+		merged = dict(self._labels)
+		merged.update(labels)
+		return metricsRegistry(self._prefix, (self._lock, self._metrics, self._descriptions), tuple(sorted(merged.items())))
+
+	def counter(self, name, description, **labels):
+		return self._get_or_create("counter", name, description, labels, lambda full_name, all_labels: counter(full_name, all_labels))
+
+	def histogram(self, name, description, buckets=DEFAULT_BUCKETS, **labels):
+		return self._get_or_create("histogram", name, description, labels, lambda full_name, all_labels: histogram(full_name, all_labels, buckets))
+
+	def _get_or_create(self, kind, name, description, labels, create):
+		full_name = "{0}_{1}".format(self._prefix, name)
+		all_labels = dict(self._labels)
+		all_labels.update(labels)
+		all_labels = tuple(sorted(all_labels.items()))
+		key = (full_name, all_labels)
+		with self._lock:
+			metric = self._metrics.get(key)
+			if metric is None:
+				metric = create(full_name, all_labels)
+				self._metrics[key] = metric
+				self._descriptions.setdefault(full_name, (kind, description))
+			return metric
+
+	def _by_name(self):
+		with self._lock:
+			metrics = list(self._metrics.values())
+			descriptions = dict(self._descriptions)
+
+		by_name = collections.OrderedDict()
+		for metric in metrics:
+			by_name.setdefault(metric.name, []).append(metric)
+		return by_name, descriptions
+
+	def as_dict(self):
+		by_name, descriptions = self._by_name()
+		result = dict()
+		for name, metrics in by_name.items():
+			kind, text = descriptions[name]
+			values = []
+			for metric in metrics:
+				if kind == "counter":
+					values.append(dict(labels=dict(metric.labels), value=metric.value))
+				else:
+					values.append(dict(labels=dict(metric.labels), count=metric.count, sum=metric.sum,
+									   buckets=[dict(le=bound, count=count) for bound, count in metric.cumulative()]))
+			result[name] = dict(type=kind, help=text, values=values)
+		return result
+
+	# Prometheus text exposition format (version 0.0.4).
+	def as_prometheus(self):
+		by_name, descriptions = self._by_name()
+		lines = []
+		for name, metrics in by_name.items():
+			kind, text = descriptions[name]
+			lines.append("# HELP {0} {1}".format(name, text))
+			lines.append("# TYPE {0} {1}".format(name, kind))
+			for metric in metrics:
+				if kind == "counter":
+					lines.append("{0}{1} {2}".format(name, _format_labels(metric.labels), metric.value))
+					continue
+				for bound, count in metric.cumulative():
+					le = "+Inf" if bound is None else repr(float(bound))
+					lines.append("{0}_bucket{1} {2}".format(name, _format_labels(metric.labels + (("le", le),)), count))
+				lines.append("{0}_sum{1} {2!r}".format(name, _format_labels(metric.labels), float(metric.sum)))
+				lines.append("{0}_count{1} {2}".format(name, _format_labels(metric.labels), metric.count))
+		return "\n".join(lines) + "\n"
+
+def _format_labels(labels):
+	if not labels:
+		return ""
+	escaped = []
+	for key, value in labels:
+		value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+		escaped.append('{0}="{1}"'.format(key, value))
+	return "{" + ",".join(escaped) + "}"
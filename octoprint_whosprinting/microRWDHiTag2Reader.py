@@ -1,103 +1,216 @@
 import serial
 import logging
 import logging.handlers
+import threading
+import time
+
+from .metrics import metricsRegistry
+from .microRWDProtocol import microRWDFrameDecoder, microRWDProtocolError, COMMAND_VERSION, COMMAND_READ_TAG, INTER_BYTE_TIMEOUT
+
+# Raised when the reader never drops CTS, which means we can't meet the
+# send window for a command, or never raises it so the command can't be sent.
+class ctsTimeoutError(IOError):
+	pass
+
+# Raised when the reader doesn't answer a tag query within the serial timeout.
+class serialTimeoutError(IOError):
+	pass
 
 # Clever bits taken from https://github.com/Makespace/Badger/blob/master/tagreader4.py
 # For RWD tag reader.
 class microRWDHiTag2Reader():
-	def __init__(self, logger):
+	def __init__(self, logger, cts_timeout=0.5, reply_timeout=0.2, metrics=None):
 		self._logger = logger
 		self.serial_port = None
+		self._decoder = microRWDFrameDecoder()
+		# Longest we will wait for CTS to drop before giving up (seconds).
+		self._cts_timeout = cts_timeout
+		# Longest we will wait for a reply after writing a command, which
+		# includes the command being held for CTS to go active (seconds).
+		self._reply_timeout = reply_timeout
+		self._stats_lock = threading.Lock()
+		self._cts_waits = 0
+		self._cts_wait_total = 0.0
+		self._cts_wait_max = 0.0
+		self._cts_wait_last = None
+		self._cts_timeouts = 0
+		self._serial_timeouts = 0
+		self._frame_errors = 0
+
+		metrics = metrics or metricsRegistry()
+		self._version_seconds = metrics.histogram("serial_transaction_seconds", "Serial command round trip time, from waiting for CTS to the reply.", command="version")
+		self._read_tag_seconds = metrics.histogram("serial_transaction_seconds", "Serial command round trip time, from waiting for CTS to the reply.", command="read_tag")
+		self._serial_timeouts_total = metrics.counter("serial_timeouts_total", "Serial commands the reader didn't answer.")
+		self._cts_timeouts_total = metrics.counter("cts_timeouts_total", "Serial commands abandoned as CTS never dropped.")
+		self._frame_errors_total = metrics.counter("frame_errors_total", "Malformed replies from the reader.")
 
 	def open(self, port):
 		self._logger.info("Opening serial port '{0}' for tag reader".format(port))
 
 		try:
-			self.serial_port = serial.Serial(port, 9600, rtscts=1, timeout=0.2)
-		except IOError as e:
-			self._logger.error("Failed to open the serial port.")
-		except OSError as e:
+			self.serial_port = serial.Serial(port, 9600, rtscts=1, timeout=INTER_BYTE_TIMEOUT)
+			# Writes don't block, the kernel holds the command until CTS goes
+			# active. A command that never went out shows up as a reply timeout.
+			_set_write_timeout(self.serial_port, 0)
+		except (IOError, OSError):
 			self._logger.error("Failed to open the serial port. Has the port changed? Using: {0}".format(port))
+			raise
 
 	def close(self):
+		if self.serial_port is None:
+			return
+
 		try:
 			self._logger.info("Closing serial port for tag reader")
 			self.serial_port.close()
 		except Exception as e:
 			self._logger.exception("Failed to close the serial port. Exception: {0}".format(e))
 			#Sink the exception as it's a close port operation.
+		self.serial_port = None
 
 	def read_version(self):
 		# test the state of the tag reader,
-		# return "None" if no tag present, or tag ID (in binary, four bytes)
+		# return the version/status byte from the reader, None on a timeout.
 
 		# We need to send the command soon after CTS becomes active (within 10mS)
 		# so wait for that moment:
-		while self.serial_port.getCTS():
-			pass  # wait if CTS was already active
+		started = time.time()
+		self.wait_for_cts()
 
 		# Put the quad reader into HITAG2 mode.
-		self.serial_port.write(bytes([ 0x76, 0x01 ])) # v1
-		self.serial_port.flush()
-		response = self.serial_port.read()
-
-		if response == "":
-			self._logger.error ("Warning: Serial timeout getting RFID reader version. Is the reader connected?")
+		self.serial_port.write(COMMAND_VERSION)
+		count = self._decoder.read_reply(self.serial_port, time.time() + self._reply_timeout, 1)
+		self._version_seconds.observe(time.time() - started)
+
+		if count == 0:
+			self.recover_from_timeout()
+			self._record_serial_timeout()
+			self._logger.error("Warning: Serial timeout getting RFID reader version. Is the reader connected?")
 			return None
 
-		value = ord(response)
-
-		self._logger.info("Tag reader version response: " + response.encode('hex'))
-		return value
+		self._logger.info("Tag reader version response: " + self._decoder.dump(count))
+		return self._decoder.status()
 
+	# One tag query, debounced across polls by the tag reader engine.
+	# Raises serialTimeoutError if the reader doesn't answer, so a reader that
+	# has stopped responding counts against the engine's circuit breaker.
 	def tryTag(self):
 		# test the state of the tag reader,
-		# return "None" if no tag present, or tag ID (in binary, four bytes)
+		# return "None" if no tag present, or tag ID (as a hex string of the four bytes)
 
 		# We need to send the command soon after CTS becomes active (within 10mS)
 		# so wait for that moment:
-		while self.serial_port.getCTS():
-			pass  # wait if CTS was already active
+		started = time.time()
+		self.wait_for_cts()
 
 		# Request the ID of the card from the reader.
-		self.serial_port.write("U")
-		self.serial_port.flush()
+		self.serial_port.write(COMMAND_READ_TAG)
 
-		# read response. Expect 5 bytes.
+		# read response.
 		# 1st byte is status code
 		# then 4 bytes representing 0x01234567 style serial number for the card.
-		response = self.serial_port.read()
-		if response == "":
-			self._logger.error("Warning: Serial timeout reading RFID tag")
-			print "Warning: Serial timeout happened"
-			return None
-		if (ord(response) == 0xD6):  # tag present
-			self._logger.info("0xD6 from reader: Tag present :-)")
-			serial_number = self.serial_port.read(4)
-			# Convert to hex for the application to use.
-			self._logger.info("Tag reader read " + serial_number.encode('hex'))
-			return serial_number.encode('hex')
-		if (ord(response) == 0xC0):  # tag not present
-			#self._logger.info("0xC0 from reader: Tag not present")
-			return None
-		print "Warning: Unexpected response from tag reader: " + response.encode('hex')
-		return None
-
-	# Tries to read a tag.
-	# Returns the tag found.
-	def seekTag(self):
-		# Look for a genuine tag reading, and respond to it once for each touch
-		# Debounces both arrival and departure of tag
+		count = self._decoder.read_reply(self.serial_port, time.time() + self._reply_timeout)
+		self._read_tag_seconds.observe(time.time() - started)
+		if count == 0:
+			self.recover_from_timeout()
+			self._record_serial_timeout()
+			raise serialTimeoutError("Serial timeout reading RFID tag. Is the reader connected?")
 
-		tag = self.tryTag()
-
-		if tag == None:
+		try:
+			return self._decoder.decode_tag_reply(count)
+		except microRWDProtocolError as e:
+			with self._stats_lock:
+				self._frame_errors += 1
+			self._frame_errors_total.inc()
+			self._logger.warning("{0}. Frame: {1}".format(e, self._decoder.dump(count)))
+			# Drop the rest of a garbled reply so it isn't read as the next one.
+			_reset_input_buffer(self.serial_port)
 			return None
 
-		# Read it a second time to check
-		# we have a valid tag.
-		tag2 = self.tryTag()
+	# Wait for CTS to drop if it was already active. The write that follows
+	# is held by RTS/CTS flow control until CTS goes active again so it goes
+	# out at the start of the reader's send window.
+	# Sleeps between checks rather than spinning, the sleeps are well under
+	# the 10mS window so the timing is still met.
+	def wait_for_cts(self):
+		started = time.time()
+		deadline = started + self._cts_timeout
+		delay = 0.0002
 
-		if tag2 == tag:
-			self._logger.info("Tag seen: {0}".format(tag.encode('hex')))
-			return tag
+		while self.serial_port.getCTS():
+			now = time.time()
+			if now >= deadline:
+				self._record_cts_wait(now - started, True)
+				raise ctsTimeoutError("CTS did not drop within {0}s. Is the reader connected?".format(self._cts_timeout))
+			time.sleep(delay)
+			delay = min(delay * 2, 0.002)
+
+		self._record_cts_wait(time.time() - started, False)
+
+	# After a reply timeout, drop anything that comes in late so it isn't read
+	# as the reply to the next command. If the command is still waiting to go
+	# out CTS never went active (e.g. reader dead but USB adapter still
+	# there): drop it too so it doesn't go out after we've given up on it.
+	def recover_from_timeout(self):
+		out_waiting = _out_waiting(self.serial_port)
+		unsent = out_waiting() if out_waiting else 0
+		_reset_input_buffer(self.serial_port)
+		if unsent:
+			_reset_output_buffer(self.serial_port)
+			self._record_cts_wait(self._reply_timeout, True)
+			raise ctsTimeoutError("CTS did not go active within {0}s. Is the reader connected?".format(self._reply_timeout))
+
+	def get_stats(self):
+		with self._stats_lock:
+			waits = self._cts_waits
+			return dict(
+				ctsWaits=waits,
+				ctsWaitMeanMs=(self._cts_wait_total / waits * 1000) if waits else None,
+				ctsWaitMaxMs=self._cts_wait_max * 1000,
+				ctsWaitLastMs=(self._cts_wait_last * 1000) if self._cts_wait_last is not None else None,
+				ctsTimeouts=self._cts_timeouts,
+				serialTimeouts=self._serial_timeouts,
+				frameErrors=self._frame_errors,
+			)
+
+	def _record_cts_wait(self, duration, timed_out):
+		with self._stats_lock:
+			self._cts_waits += 1
+			self._cts_wait_total += duration
+			self._cts_wait_last = duration
+			if duration > self._cts_wait_max:
+				self._cts_wait_max = duration
+			if timed_out:
+				self._cts_timeouts += 1
+		if timed_out:
+			self._cts_timeouts_total.inc()
+
+	def _record_serial_timeout(self):
+		with self._stats_lock:
+			self._serial_timeouts += 1
+		self._serial_timeouts_total.inc()
+
+# pyserial 3 calls it write_timeout, older versions writeTimeout (and
+# don't take it as a keyword of the constructor).
+def _set_write_timeout(serial_port, timeout):
+	if hasattr(serial_port, "write_timeout"):
+		serial_port.write_timeout = timeout
+	else:
+		serial_port.writeTimeout = timeout
+
+# pyserial 3 has out_waiting, older versions outWaiting(). Returns a
+# callable giving the bytes still to be sent, None if it can't be told.
+def _out_waiting(serial_port):
+	if hasattr(serial_port, "out_waiting"):
+		return lambda: serial_port.out_waiting
+	return getattr(serial_port, "outWaiting", None)
+
+def _reset_input_buffer(serial_port):
+	reset = getattr(serial_port, "reset_input_buffer", None) or getattr(serial_port, "flushInput", None)
+	if reset:
+		reset()
+
+def _reset_output_buffer(serial_port):
+	reset = getattr(serial_port, "reset_output_buffer", None) or getattr(serial_port, "flushOutput", None)
+	if reset:
+		reset()
@@ -0,0 +1,84 @@
+import binascii
+import time
+
+# Micro RWD HiTag2 reply framing.
+# A tag query ("U") is answered with a status byte, followed by the 4 byte
+# serial number of the tag when one is present.
+COMMAND_VERSION = bytearray([0x76, 0x01])  # v1
+COMMAND_READ_TAG = bytearray([0x55])  # U
+
+STATUS_TAG_PRESENT = 0xD6
+STATUS_NO_TAG = 0xC0
+
+TAG_ID_LENGTH = 4
+FRAME_LENGTH = 1 + TAG_ID_LENGTH
+
+# The read timeout to open the port with (seconds): a gap this long after
+# a reply has started ends it, about 10 byte times at 9600 baud. A "tag
+# present" frame split by the USB adapter is read on past it, see read_reply.
+INTER_BYTE_TIMEOUT = 0.01
+
+# Raised when the reader sends a reply that isn't a valid frame.
+class microRWDProtocolError(IOError):
+	pass
+
+# Reads and decodes reply frames into a single reusable buffer.
+# Not thread safe, each reader owns its own decoder.
+class microRWDFrameDecoder():
+	def __init__(self):
+		self._buffer = bytearray(FRAME_LENGTH)
+		self._view = memoryview(self._buffer)
+
+	# Read up to length bytes from the port in one call, into the frame at offset.
+	# Returns the number of bytes read, 0 on a timeout.
+	def read(self, serial_port, length=FRAME_LENGTH, offset=0):
+		view = self._view[offset:offset + length]
+		readinto = getattr(serial_port, "readinto", None)
+		if readinto:
+			return readinto(view) or 0
+
+		# Older ports without readinto.
+		data = serial_port.read(length)
+		count = len(data)
+		view[:count] = data
+		return count
+
+	# Read a reply of up to length bytes, waiting until deadline (a time.time())
+	# for it to start. Asks for the whole frame at once, the port's read timeout
+	# (INTER_BYTE_TIMEOUT) ends a shorter reply such as the 1 byte "no tag"
+	# one (pyserial's inter_byte_timeout isn't honoured by reads on Linux).
+	# Only a "tag present" reply is read on after a gap, until the deadline.
+	# Returns the number of bytes read, 0 if nothing came before the deadline.
+	def read_reply(self, serial_port, deadline, length=FRAME_LENGTH):
+		count = 0
+		while count < length:
+			read = self.read(serial_port, length - count, count)
+			count += read
+			if count and self._buffer[0] != STATUS_TAG_PRESENT:
+				break
+			if not read and time.time() >= deadline:
+				break
+		return count
+
+	# The status byte of the last frame read.
+	def status(self):
+		return self._buffer[0]
+
+	# Decode the reply to a tag query of count bytes.
+	# Returns the tag id as a lower case hex string, or None if no tag is present.
+	def decode_tag_reply(self, count):
+		status = self._buffer[0]
+
+		if status == STATUS_NO_TAG:
+			return None
+
+		if status == STATUS_TAG_PRESENT:
+			if count < FRAME_LENGTH:
+				raise microRWDProtocolError("Short tag frame from reader, got {0} of {1} bytes".format(count, FRAME_LENGTH))
+			return binascii.hexlify(self._view[1:FRAME_LENGTH]).decode("ascii")
+
+		raise microRWDProtocolError("Unexpected response from tag reader: 0x{0:02x}".format(status))
+
+	# Hex dump of the first count bytes of the last frame, for logging.
+	def dump(self, count):
+		return binascii.hexlify(self._view[:count]).decode("ascii")
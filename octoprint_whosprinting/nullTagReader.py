@@ -16,5 +16,8 @@ class nullTagReader():
 	def read_version(self):
 		return 1
 
-	def seekTag(self):
-		return None
\ No newline at end of file
+	def tryTag(self):
+		return None
+
+	def get_stats(self):
+		return dict()
@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from octoprint.util import atomic_write
+
+AUTO_PORT = "AUTO"
+
+def is_auto_port(port):
+	return not port or str(port).strip().upper() == AUTO_PORT
+
+# "0403:6001" (hex VID:PID) -> (0x0403, 0x6001), None if it isn't one.
+def parse_usb_id(text):
+	try:
+		vid, pid = str(text).strip().split(":")
+		return int(vid, 16), int(pid, 16)
+	except ValueError:
+		return None
+
+# Finds the serial port a reader is on by asking the candidate ports for
+# the reader's version at the same time, giving up at a deadline.
+# Only USB ports with the VID/PID of an adapter the reader is known to use
+# are candidates, asking a printer's port would reset some printers.
+# The port found is remembered by its USB identity (VID/PID/serial number),
+# which survives the device name changing across reboots, and is tried on
+# its own first next time.
+# One detection runs at a time and the port each key found is claimed for
+# it, so two readers never probe or end up on the same port.
+class portDetector():
+	def __init__(self, logger, cache_path, deadline=3.0):
+		self._logger = logger
+		self._cache_path = cache_path
+		self._deadline = deadline
+		self._lock = threading.Lock()
+		self._detect_lock = threading.Lock()
+		# key -> device found for it.
+		self._claims = dict()
+		self._cache = self._load()
+		# Readers probing ports log every failure, which is expected here.
+		self._probe_logger = logging.getLogger(logger.name + ".portDetector")
+		self._probe_logger.setLevel(logging.CRITICAL)
+
+	# Returns the device of the port the reader answers on, raises IOError
+	# if it isn't found. create_reader(logger) returns a new (closed) reader,
+	# key identifies what is being looked for (e.g. the station) in the cache.
+	# usb_ids are the (VID, PID) the reader may be on, other ports are only
+	# probed if the reader was found on them before. Ports in exclude (e.g.
+	# the printer's) and ports claimed for other keys are never probed.
+	def detect(self, key, create_reader, usb_ids, exclude=()):
+		with self._detect_lock:
+			started = time.time()
+			claimed = set(device for claim, device in self._claims.items() if claim != key)
+			ports = [port for port in self._list_ports() if port.device not in exclude and port.device not in claimed]
+
+			remembered = self._find_remembered(key, ports)
+			if remembered is not None:
+				if self._probe(create_reader, remembered.device):
+					self._logger.info("RFID reader found on remembered port {0} in {1:.0f}ms".format(remembered.device, (time.time() - started) * 1000))
+					self._claim(key, remembered)
+					return remembered.device
+
+			usb_ids = set(usb_ids)
+			ports = [port for port in ports if port is not remembered and (port.vid, port.pid) in usb_ids]
+			if not ports:
+				raise IOError("No serial ports with a known RFID reader USB id ({0}) to look for the reader on".format(
+					", ".join("{0:04x}:{1:04x}".format(vid, pid) for vid, pid in sorted(usb_ids)) or "none set"))
+
+			found = self._probe_all(create_reader, ports, started + self._deadline)
+			if found is None:
+				raise IOError("No RFID reader answered on {0}".format(", ".join(port.device for port in ports)))
+
+			self._logger.info("RFID reader found on {0} in {1:.0f}ms".format(found.device, (time.time() - started) * 1000))
+			self._claim(key, found)
+			return found.device
+
+	# key no longer needs the port found for it (e.g. its reader was removed
+	# or given a fixed port).
+	def release(self, key):
+		with self._lock:
+			self._claims.pop(key, None)
+
+	def _claim(self, key, port):
+		with self._lock:
+			self._claims[key] = port.device
+		self._remember(key, port)
+
+	def _list_ports(self):
+		# pyserial is only needed once a reader is looking for its port.
+		from serial.tools import list_ports
+		return list(list_ports.comports())
+
+	# Probe the ports in parallel, returns the first port that answers or
+	# None if none do before the deadline. Probes still running at the
+	# deadline are left to time out and close their ports.
+	def _probe_all(self, create_reader, ports, deadline):
+		answered = []
+		remaining = [len(ports)]
+		done = threading.Condition()
+
+		def probe(port):
+			ok = self._probe(create_reader, port.device)
+			with done:
+				if ok:
+					answered.append(port)
+				remaining[0] -= 1
+				done.notify()
+
+		for port in ports:
+			thread = threading.Thread(target=probe, args=(port,), name="WhosPrintingPortProbe")
+			thread.daemon = True
+			thread.start()
+
+		with done:
+			while not answered and remaining[0]:
+				timeout = deadline - time.time()
+				if timeout <= 0:
+					break
+				done.wait(timeout)
+			return answered[0] if answered else None
+
+	def _probe(self, create_reader, device):
+		reader = create_reader(self._probe_logger)
+		try:
+			reader.open(device)
+			return bool(reader.read_version())
+		except Exception:
+			return False
+		finally:
+			reader.close()
+
+	# The port with the identity remembered for key, None if it's not plugged in.
+	def _find_remembered(self, key, ports):
+		with self._lock:
+			remembered = self._cache.get(key)
+		if not remembered:
+			return None
+
+		if remembered.get("vid") is not None:
+			for port in ports:
+				if (port.vid, port.pid, port.serial_number) == (remembered["vid"], remembered["pid"], remembered.get("serialNumber")):
+					return port
+
+		# Not a USB port (or its identity changed), try the same device.
+		for port in ports:
+			if port.device == remembered.get("device"):
+				return port
+		return None
+
+	def _remember(self, key, port):
+		identity = dict(device=port.device, vid=port.vid, pid=port.pid, serialNumber=port.serial_number)
+		with self._lock:
+			if self._cache.get(key) == identity:
+				return
+			self._cache[key] = identity
+			data = json.dumps(self._cache)
+
+		try:
+			with atomic_write(self._cache_path, "w") as f:
+				f.write(data)
+		except (IOError, OSError) as e:
+			self._logger.error("Failed to save the RFID reader port. Exception: {0}".format(e))
+
+	def _load(self):
+		if not os.path.exists(self._cache_path):
+			return dict()
+		try:
+			with open(self._cache_path, "r") as f:
+				return json.load(f)
+		except (IOError, ValueError) as e:
+			self._logger.error("Failed to load the remembered RFID reader ports. Exception: {0}".format(e))
+			return dict()
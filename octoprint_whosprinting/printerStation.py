@@ -0,0 +1,39 @@
+from .longPoll import changeNotifier
+from .sessionState import sessionStateMachine, STATE_PRINTING
+
+DEFAULT_STATION_ID = "default"
+
+# A printer with (optionally) its own RFID reader, and the
+# "who's printing" session for that printer.
+class printerStation():
+	def __init__(self, station_id, name):
+		self.id = station_id
+		self.name = name
+		self.reader_type = None
+		self.port = None
+		self.reader = None
+		self.engine = None
+		# Id of the open session in the session journal, only changed
+		# by the session's transition effects.
+		self.session_id = None
+		# The idle/printing/finished/failed session, every new snapshot
+		# is passed to the long poll clients.
+		self.session = sessionStateMachine()
+		self.notifier = changeNotifier(self.session.snapshot)
+		self.session.add_listener(self.notifier.publish)
+
+	# The current (immutable) session snapshot, no lock needed.
+	@property
+	def snapshot(self):
+		return self.session.snapshot
+
+	# The username of the person that is printing, empty if nobody is.
+	@property
+	def whos_printing(self):
+		snapshot = self.session.snapshot
+		if snapshot.state == STATE_PRINTING:
+			return snapshot.username
+		return ""
+
+	def as_dict(self):
+		return dict(id=self.id, name=self.name, readerType=self.reader_type, port=self.port)
@@ -0,0 +1,97 @@
+import importlib
+
+# Reader types (as shown in the settings) to the class implementing them.
+# Drivers are only imported when a station selects them, so e.g. pyserial
+# isn't loaded when no reader is used.
+#
+# Other packages can add readers without changing the plugin by declaring
+# an entry point in the group below, e.g. in their setup.py:
+#     entry_points={"octoprint_whosprinting.readers": ["My Reader = my_package.reader:myReader"]}
+# A driver is constructed as driver(logger, metrics=metrics) and provides
+# open(port), close(), read_version(), tryTag() and get_stats() like
+# microRWDHiTag2Reader. tryTag makes a single read, the engine debounces them.
+ENTRY_POINT_GROUP = "octoprint_whosprinting.readers"
+
+NULL_READER = "None"
+
+BUILTIN_DRIVERS = {
+	"Micro RWD HiTag2": "octoprint_whosprinting.microRWDHiTag2Reader:microRWDHiTag2Reader",
+}
+
+# The built in reader types, without looking for others.
+def builtin_reader_names():
+	return [NULL_READER] + sorted(BUILTIN_DRIVERS.keys())
+
+class readerDriverRegistry():
+	def __init__(self, logger, group=ENTRY_POINT_GROUP):
+		self._logger = logger
+		self._group = group
+		# name -> entry point, None until discovered. Scanning the installed
+		# packages is slow on small boards so it's only done when a driver
+		# that isn't built in is needed.
+		self._entry_points = None
+		self._loaded = dict()
+
+	# Reader types that can be selected, "None" first.
+	def names(self):
+		names = set(BUILTIN_DRIVERS.keys())
+		names.update(self._discover().keys())
+		return [NULL_READER] + sorted(names)
+
+	# A new reader of the type given, None for "None" or if the driver
+	# can't be found or loaded. logger replaces the registry's logger for
+	# the reader, e.g. to quieten readers used to probe ports.
+	def create(self, name, logger=None, **options):
+		if not name or name == NULL_READER:
+			return None
+
+		driver = self.load(name)
+		if driver is None:
+			return None
+		return driver(logger or self._logger, **options)
+
+	# The driver class for the reader type, importing it on first use.
+	def load(self, name):
+		driver = self._loaded.get(name)
+		if driver is not None:
+			return driver
+
+		try:
+			if name in BUILTIN_DRIVERS:
+				module_name, class_name = BUILTIN_DRIVERS[name].split(":")
+				driver = getattr(importlib.import_module(module_name), class_name)
+			else:
+				entry_point = self._discover().get(name)
+				if entry_point is None:
+					self._logger.error("No RFID reader driver installed for '{0}'".format(name))
+					return None
+				driver = entry_point.load()
+		except Exception as e:
+			self._logger.exception("Failed to load RFID reader driver '{0}'. Exception: {1}".format(name, e))
+			return None
+
+		self._loaded[name] = driver
+		return driver
+
+	def _discover(self):
+		if self._entry_points is None:
+			entry_points = dict()
+			try:
+				for entry_point in _iter_entry_points(self._group):
+					entry_points[entry_point.name] = entry_point
+			except Exception as e:
+				self._logger.exception("Failed to find RFID reader drivers. Exception: {0}".format(e))
+			self._entry_points = entry_points
+		return self._entry_points
+
+def _iter_entry_points(group):
+	try:
+		from importlib import metadata
+	except ImportError:
+		import pkg_resources
+		return list(pkg_resources.iter_entry_points(group))
+
+	entry_points = metadata.entry_points()
+	if hasattr(entry_points, "select"):
+		return list(entry_points.select(group=group))
+	return list(entry_points.get(group, []))
@@ -0,0 +1,118 @@
+import heapq
+import itertools
+import threading
+import time
+
+# A bounded pool of threads servicing any number of tag reader engines.
+# Engines are stepped in order of when they are next due, each step is a
+# single timeout bounded transaction (or open attempt) and returns the
+# delay until the engine's next step. An engine is only ever stepped by one
+# worker at a time. Workers are started as engines are added, up to max_workers.
+class readerPool():
+	def __init__(self, logger, max_workers=4):
+		self._logger = logger
+		self._max_workers = max_workers
+		self._condition = threading.Condition()
+		# (due time, sequence, engine), entries whose sequence no longer
+		# matches _scheduled[engine] have been superseded and are skipped.
+		self._heap = []
+		self._sequence = itertools.count()
+		self._scheduled = dict()
+		# engine -> True if it was re-scheduled while being stepped.
+		self._running = dict()
+		self._engines = set()
+		self._workers = []
+		self._shutdown = False
+
+	# Schedule the engine to be stepped in delay seconds, replacing any
+	# existing schedule for it.
+	def schedule(self, engine, delay=0):
+		with self._condition:
+			if self._shutdown:
+				return
+			self._engines.add(engine)
+			if engine in self._running:
+				# The worker stepping it will re-schedule it straight away.
+				self._running[engine] = True
+				return
+			self._schedule_locked(engine, delay)
+			self._start_workers_locked()
+			self._condition.notify()
+
+	def engine_count(self):
+		with self._condition:
+			return len(self._engines)
+
+	def worker_count(self):
+		with self._condition:
+			return len(self._workers)
+
+	# Stop the workers. Engines should have been stopped first.
+	def shutdown(self, timeout=2.0):
+		with self._condition:
+			self._shutdown = True
+			workers = self._workers
+			self._workers = []
+			self._condition.notify_all()
+
+		for worker in workers:
+			if worker is not threading.current_thread():
+				worker.join(timeout)
+
+	def _schedule_locked(self, engine, delay):
+		sequence = next(self._sequence)
+		self._scheduled[engine] = sequence
+		heapq.heappush(self._heap, (time.time() + delay, sequence, engine))
+
+	def _start_workers_locked(self):
+		if len(self._workers) >= min(self._max_workers, len(self._engines)):
+			return
+
+		worker = threading.Thread(target=self._run, name="WhosPrintingTagReader-{0}".format(len(self._workers) + 1))
+		worker.daemon = True
+		self._workers.append(worker)
+		worker.start()
+
+	# Wait for the next engine that is due. Returns None on shutdown.
+	def _next_engine(self):
+		with self._condition:
+			while not self._shutdown:
+				if not self._heap:
+					self._condition.wait()
+					continue
+
+				due, sequence, engine = self._heap[0]
+				if self._scheduled.get(engine) != sequence:
+					heapq.heappop(self._heap)
+					continue
+
+				wait = due - time.time()
+				if wait > 0:
+					self._condition.wait(wait)
+					continue
+
+				heapq.heappop(self._heap)
+				del self._scheduled[engine]
+				self._running[engine] = False
+				return engine
+		return None
+
+	def _run(self):
+		while True:
+			engine = self._next_engine()
+			if engine is None:
+				return
+
+			try:
+				delay = engine.step()
+			except Exception as e:
+				self._logger.exception("Unhandled error in tag reader. Exception: {0}".format(e))
+				delay = 1.0
+
+			with self._condition:
+				woken = self._running.pop(engine, False)
+				if delay is None:
+					self._engines.discard(engine)
+					continue
+				self._schedule_locked(engine, 0 if woken else delay)
+				self._condition.notify()
@@ -0,0 +1,157 @@
+import sqlite3
+import sys
+import threading
+import time
+
+SOURCE_RFID = "rfid"
+SOURCE_UI = "ui"
+
+OUTCOME_FINISHED = "finished"
+OUTCOME_FAILED = "failed"
+# Another user was set as printing before the session was ended.
+OUTCOME_SUPERSEDED = "superseded"
+# OctoPrint was restarted while the session was open.
+OUTCOME_INTERRUPTED = "interrupted"
+
+# On disk journal of print sessions (who printed, when, on which station and
+# how it ended), kept in SQLite in the plugin data folder.
+# Rows are only appended and then ended, queries page through them by id
+# (newest first) using the indexes so months of history aren't loaded at once.
+class sessionJournal():
+	def __init__(self, logger, path):
+		self._logger = logger
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(path, check_same_thread=False)
+		self._connection.row_factory = sqlite3.Row
+		with self._lock, self._connection:
+			self._connection.execute("""CREATE TABLE IF NOT EXISTS sessions (
+				id INTEGER PRIMARY KEY AUTOINCREMENT,
+				station TEXT NOT NULL,
+				username TEXT NOT NULL,
+				source TEXT,
+				started REAL NOT NULL,
+				ended REAL,
+				outcome TEXT,
+				reason TEXT)""")
+			self._connection.execute("CREATE INDEX IF NOT EXISTS sessions_username ON sessions (username, id)")
+			self._connection.execute("CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started)")
+			self._connection.execute("CREATE INDEX IF NOT EXISTS sessions_ended ON sessions (ended, id)")
+
+	def close(self):
+		with self._lock:
+			self._connection.close()
+
+	# Record a session starting, returns the session id.
+	def session_started(self, station, username, source, started=None):
+		with self._lock, self._connection:
+			cursor = self._connection.execute(
+				"INSERT INTO sessions (station, username, source, started) VALUES (?, ?, ?, ?)",
+				(station, username, source, started or time.time()))
+			return cursor.lastrowid
+
+	# Record the end of a session. Returns the ended session or None if it
+	# wasn't found (or had already ended).
+	def session_ended(self, session_id, outcome, reason=None, ended=None):
+		with self._lock, self._connection:
+			cursor = self._connection.execute(
+				"UPDATE sessions SET ended = ?, outcome = ?, reason = ? WHERE id = ? AND ended IS NULL",
+				(ended or time.time(), outcome, reason, session_id))
+			if cursor.rowcount == 0:
+				return None
+			row = self._connection.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+			return self._to_dict(row)
+
+	# End any sessions left open, e.g. by a restart. Returns the count ended.
+	def end_open_sessions(self, outcome=OUTCOME_INTERRUPTED):
+		with self._lock, self._connection:
+			cursor = self._connection.execute(
+				"UPDATE sessions SET ended = ?, outcome = ? WHERE ended IS NULL",
+				(time.time(), outcome))
+			return cursor.rowcount
+
+	# Page through sessions, newest first.
+	# before is the id to continue from (the nextBefore of the previous page).
+	# since/until limit the start time (unix seconds).
+	# Returns (sessions, nextBefore), nextBefore is None on the last page.
+	def query(self, username=None, station=None, since=None, until=None, before=None, limit=50):
+		clauses = []
+		parameters = []
+		if username:
+			clauses.append("username = ?")
+			parameters.append(username)
+		if station:
+			clauses.append("station = ?")
+			parameters.append(station)
+		if since is not None:
+			clauses.append("started >= ?")
+			parameters.append(since)
+		if until is not None:
+			clauses.append("started < ?")
+			parameters.append(until)
+		if before is not None:
+			clauses.append("id < ?")
+			parameters.append(before)
+
+		sql = "SELECT * FROM sessions"
+		if clauses:
+			sql += " WHERE " + " AND ".join(clauses)
+		sql += " ORDER BY id DESC LIMIT ?"
+		parameters.append(limit + 1)
+
+		with self._lock:
+			rows = self._connection.execute(sql, parameters).fetchall()
+
+		sessions = [self._to_dict(row) for row in rows[:limit]]
+		next_before = sessions[-1]["id"] if len(rows) > limit else None
+		return sessions, next_before
+
+	# Iterate over the sessions that ended after (ended_after, after_id), in
+	# the order they ended, fetching page_size at a time. Without after_id
+	# sessions that ended at exactly ended_after are skipped.
+	def ended_since(self, ended_after=0, after_id=None, page_size=500):
+		last_ended, last_id = ended_after, after_id
+		if last_id is None:
+			last_id = sys.maxsize
+		while True:
+			with self._lock:
+				rows = self._connection.execute(
+					"SELECT * FROM sessions WHERE ended > ? OR (ended = ? AND id > ?) ORDER BY ended, id LIMIT ?",
+					(last_ended, last_ended, last_id, page_size)).fetchall()
+
+			for row in rows:
+				yield self._to_dict(row)
+
+			if len(rows) < page_size:
+				return
+			last_ended, last_id = rows[-1]["ended"], rows[-1]["id"]
+
+	# Drop sessions that started before retention_days ago, and the oldest
+	# beyond max_sessions, so the store stays bounded.
+	# Returns the number of sessions removed.
+	def compact(self, retention_days=None, max_sessions=None):
+		removed = 0
+		with self._lock, self._connection:
+			if retention_days:
+				cutoff = time.time() - retention_days * 86400
+				removed += self._connection.execute("DELETE FROM sessions WHERE started < ?", (cutoff,)).rowcount
+			if max_sessions:
+				removed += self._connection.execute(
+					"DELETE FROM sessions WHERE id <= (SELECT id FROM sessions ORDER BY id DESC LIMIT 1 OFFSET ?)",
+					(max_sessions,)).rowcount
+
+		if removed:
+			self._logger.info("Removed {0} old sessions from the history".format(removed))
+		return removed
+
+	@staticmethod
+	def _to_dict(row):
+		return dict(
+			id=row["id"],
+			station=row["station"],
+			username=row["username"],
+			source=row["source"],
+			started=row["started"],
+			ended=row["ended"],
+			outcome=row["outcome"],
+			reason=row["reason"],
+		)
@@ -0,0 +1,97 @@
+import collections
+import threading
+import time
+import uuid
+
+STATE_IDLE = "idle"
+STATE_PRINTING = "printing"
+STATE_FINISHED = "finished"
+STATE_FAILED = "failed"
+
+EVENT_START = "start"
+EVENT_FINISH = "finish"
+EVENT_FAIL = "fail"
+# The station was removed (or the session otherwise abandoned).
+EVENT_INTERRUPT = "interrupt"
+
+# Immutable view of a station's session as of version.
+# Versions count up from 0 each time a state machine is created (e.g. on
+# restart), epoch is unique to the machine so (epoch, version) never
+# repeats for a different state.
+# username is who is (or was last) printing, details the user details served
+# to the UI's (None unless printing), source/reason from the last transition.
+sessionSnapshot = collections.namedtuple("sessionSnapshot",
+										 ["epoch", "version", "state", "username", "details", "source", "reason", "changed"])
+
+class invalidTransitionError(Exception):
+	def __init__(self, state, event):
+		Exception.__init__(self, "Can't {0} a session that is {1}".format(event, state))
+		self.state = state
+		self.event = event
+
+# The idle/printing/finished/failed lifecycle of a station's print session.
+# Transitions are serialised by a lock and each one produces a new snapshot
+# with the next version, readers just take the current snapshot without
+# locking. Starting while printing replaces the current user.
+class sessionStateMachine():
+	# (state, event) -> new state
+	TRANSITIONS = {
+		(STATE_IDLE, EVENT_START): STATE_PRINTING,
+		(STATE_FINISHED, EVENT_START): STATE_PRINTING,
+		(STATE_FAILED, EVENT_START): STATE_PRINTING,
+		(STATE_PRINTING, EVENT_START): STATE_PRINTING,
+		(STATE_PRINTING, EVENT_FINISH): STATE_FINISHED,
+		(STATE_PRINTING, EVENT_FAIL): STATE_FAILED,
+		(STATE_IDLE, EVENT_INTERRUPT): STATE_IDLE,
+		(STATE_FINISHED, EVENT_INTERRUPT): STATE_IDLE,
+		(STATE_FAILED, EVENT_INTERRUPT): STATE_IDLE,
+		(STATE_PRINTING, EVENT_INTERRUPT): STATE_IDLE,
+	}
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._listeners = []
+		self._snapshot = sessionSnapshot(uuid.uuid4().hex[:8], 0, STATE_IDLE, "", None, None, None, None)
+
+	@property
+	def snapshot(self):
+		return self._snapshot
+
+	# listener(snapshot) is called (holding the lock) with every new snapshot.
+	def add_listener(self, listener):
+		self._listeners.append(listener)
+
+	# Apply event, raises invalidTransitionError if it isn't allowed from the
+	# current state. effect(previous, snapshot) is called holding the lock so
+	# side effects (history, events) happen in the same order as the
+	# transitions. Neither effect nor listeners may call back into the machine.
+	# Returns the new snapshot.
+	def transition(self, event, effect=None, username=None, details=None, source=None, reason=None):
+		with self._lock:
+			previous = self._snapshot
+			state = self.TRANSITIONS.get((previous.state, event))
+			if state is None:
+				raise invalidTransitionError(previous.state, event)
+
+			if username is None:
+				username = previous.username
+			snapshot = sessionSnapshot(previous.epoch, previous.version + 1, state, username, details, source, reason, time.time())
+			self._publish(snapshot)
+			if effect:
+				effect(previous, snapshot)
+			return snapshot
+
+	# New details for the user printing (e.g. settings changed) without a
+	# change of state. Ignored (returns None) if username is no longer printing.
+	def refresh(self, username, details):
+		with self._lock:
+			if self._snapshot.state != STATE_PRINTING or self._snapshot.username != username:
+				return None
+			snapshot = self._snapshot._replace(version=self._snapshot.version + 1, details=details)
+			self._publish(snapshot)
+			return snapshot
+
+	def _publish(self, snapshot):
+		self._snapshot = snapshot
+		for listener in self._listeners:
+			listener(snapshot)
@@ -0,0 +1,157 @@
+import sqlite3
+import threading
+import time
+
+class sessionConflictError(Exception):
+	def __init__(self, username, instance, station):
+		Exception.__init__(self, "{0} is already printing on {1} ({2})".format(username, station, instance))
+		self.username = username
+		self.instance = instance
+		self.station = station
+
+# Tag directory and active sessions shared by several OctoPrint instances
+# on the same host (e.g. one per printer), in a SQLite database in WAL mode
+# so the instances can read while one writes.
+#
+# Each instance publishes the keyfobs of its own users, so a keyfob
+# enrolled on one instance is known to all of them, and claims a user
+# while they are printing, so nobody can be printing on two printers at once.
+#
+# Every write also bumps a change counter. Reads are served from an in
+# process copy of the tables that's only reloaded when the counter has
+# moved, a lookup is a single row read when nothing has changed.
+class sharedStore():
+	def __init__(self, logger, path, instance, timeout=5.0):
+		self._logger = logger
+		self._instance = instance
+		self._lock = threading.Lock()
+		# Writes take the database lock up front (BEGIN IMMEDIATE) and wait
+		# up to timeout seconds for another instance to finish.
+		self._connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+		self._connection.execute("PRAGMA journal_mode=WAL")
+		self._connection.execute("PRAGMA synchronous=NORMAL")
+		with self._write():
+			self._connection.execute("""CREATE TABLE IF NOT EXISTS tags (
+				tag TEXT PRIMARY KEY,
+				username TEXT NOT NULL,
+				instance TEXT NOT NULL)""")
+			self._connection.execute("""CREATE TABLE IF NOT EXISTS active_sessions (
+				username TEXT PRIMARY KEY,
+				instance TEXT NOT NULL,
+				station TEXT NOT NULL,
+				started REAL NOT NULL)""")
+			self._connection.execute("CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY CHECK (id = 1), counter INTEGER NOT NULL)")
+			self._connection.execute("INSERT OR IGNORE INTO changes (id, counter) VALUES (1, 0)")
+
+		# Copy of the tables as of _counter.
+		self._counter = None
+		self._tags = dict()
+		self._sessions = dict()
+
+	def close(self):
+		with self._lock:
+			self._connection.close()
+
+	# Returns the username for the (normalised) tag, or None if no instance has it.
+	def find_username(self, tagId):
+		self._refresh()
+		return self._tags.get(tagId)
+
+	# username -> dict(instance, station, started) for everyone printing on any instance.
+	def get_active_sessions(self):
+		self._refresh()
+		return dict((username, dict(session)) for username, session in self._sessions.items())
+
+	# Replace this instance's keyfobs (normalised tag -> username) in the
+	# directory. Nothing is written if they haven't changed.
+	def publish_tags(self, tags):
+		with self._write() as changed:
+			published = dict(self._connection.execute("SELECT tag, username FROM tags WHERE instance = ?", (self._instance,)).fetchall())
+			if published == tags:
+				return
+
+			removed = [(tag, self._instance) for tag in published if tag not in tags]
+			updated = [(tag, username, self._instance) for tag, username in tags.items() if published.get(tag) != username]
+			self._connection.executemany("DELETE FROM tags WHERE tag = ? AND instance = ?", removed)
+			self._connection.executemany("INSERT OR REPLACE INTO tags (tag, username, instance) VALUES (?, ?, ?)", updated)
+			changed.append(True)
+
+		self._logger.info("Published {0} keyfobs to the shared directory".format(len(tags)))
+
+	# Mark username as printing on station of this instance. Raises
+	# sessionConflictError if they are printing on another station (here or
+	# on another instance), claiming the same station again is allowed.
+	def claim_session(self, username, station):
+		with self._write() as changed:
+			row = self._connection.execute("SELECT instance, station FROM active_sessions WHERE username = ?", (username,)).fetchone()
+			if row is not None:
+				if tuple(row) == (self._instance, station):
+					return
+				raise sessionConflictError(username, row[0], row[1])
+
+			self._connection.execute("INSERT INTO active_sessions (username, instance, station, started) VALUES (?, ?, ?, ?)",
+									 (username, self._instance, station, time.time()))
+			changed.append(True)
+
+	# username has stopped printing on station of this instance.
+	def release_session(self, username, station):
+		with self._write() as changed:
+			cursor = self._connection.execute("DELETE FROM active_sessions WHERE username = ? AND instance = ? AND station = ?",
+											  (username, self._instance, station))
+			if cursor.rowcount:
+				changed.append(True)
+
+	# Drop every claim made by this instance, e.g. left from before a restart.
+	def release_instance_sessions(self):
+		with self._write() as changed:
+			cursor = self._connection.execute("DELETE FROM active_sessions WHERE instance = ?", (self._instance,))
+			if cursor.rowcount:
+				changed.append(True)
+
+	# Reload the copy of the tables if another write has happened since.
+	def _refresh(self):
+		with self._lock:
+			counter = self._connection.execute("SELECT counter FROM changes WHERE id = 1").fetchone()[0]
+			if counter == self._counter:
+				return
+
+			tags = dict(self._connection.execute("SELECT tag, username FROM tags").fetchall())
+			sessions = dict((row[0], dict(instance=row[1], station=row[2], started=row[3]))
+							for row in self._connection.execute("SELECT username, instance, station, started FROM active_sessions"))
+
+			# Swap in the new copies, readers either see the old or the new ones.
+			self._tags = tags
+			self._sessions = sessions
+			self._counter = counter
+
+	# A write transaction, the change counter is bumped on commit if anything
+	# is appended to the list it gives.
+	def _write(self):
+		return _writeTransaction(self._lock, self._connection)
+
+class _writeTransaction():
+	def __init__(self, lock, connection):
+		self._lock = lock
+		self._connection = connection
+		self._changed = []
+
+	def __enter__(self):
+		self._lock.acquire()
+		try:
+			self._connection.execute("BEGIN IMMEDIATE")
+		except Exception:
+			self._lock.release()
+			raise
+		return self._changed
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		try:
+			if exc_type is None:
+				if self._changed:
+					self._connection.execute("UPDATE changes SET counter = counter + 1 WHERE id = 1")
+				self._connection.execute("COMMIT")
+			else:
+				self._connection.execute("ROLLBACK")
+		finally:
+			self._lock.release()
+		return False
@@ -6,6 +6,46 @@
  */
 $(function() {
 
+    // Fixed size buffer of history entries, newest first. Adding a newer
+    // entry when full drops the oldest, so a tab left open for weeks holds
+    // at most capacity entries.
+    function HistoryRing(capacity) {
+        this.capacity = Math.max(capacity, 1);
+        this.items = new Array(this.capacity);
+        this.start = 0;
+        this.length = 0;
+    }
+
+    HistoryRing.prototype.get = function(index) {
+        return this.items[(this.start + index) % this.capacity];
+    };
+
+    HistoryRing.prototype.pushNewest = function(item) {
+        this.start = (this.start + this.capacity - 1) % this.capacity;
+        this.items[this.start] = item;
+        if (this.length < this.capacity) {
+            this.length++;
+        }
+    };
+
+    // Returns false (and doesn't add it) if the buffer is full.
+    HistoryRing.prototype.pushOldest = function(item) {
+        if (this.length == this.capacity) {
+            return false;
+        }
+        this.items[(this.start + this.length) % this.capacity] = item;
+        this.length++;
+        return true;
+    };
+
+    HistoryRing.prototype.slice = function(from, to) {
+        var result = [];
+        for (var i = Math.max(from, 0); i < Math.min(to, this.length); i++) {
+            result.push(this.get(i));
+        }
+        return result;
+    };
+
     function WhosPrintingViewModel(parameters) {
         var self = this;
 
@@ -33,14 +73,87 @@ $(function() {
             return !self.isPrinting();
         })
 
+        // The stations (printers) this OctoPrint monitors and the one
+        // this tab shows, remembered per browser for kiosks.
+        self.stations = ko.observableArray([]);
+        self.station = ko.observable(localStorage.getItem("whosprinting.station"));
+        self.hasMultipleStations = ko.computed(function() {
+            return self.stations().length > 1;
+        });
+        self.station.subscribe(function(station) {
+            localStorage.setItem("whosprinting.station", station);
+            self.whosPrintingEpoch = null;
+            self.whosPrintingVersion = null;
+            self.getWhosPrinting();
+            self.reloadHistory();
+        });
+
         // The user who is currently printing.
         self.whosPrinting = ko.observable();
-        self.whosPrintingHistory = ko.observableArray([]);
-        // The possible users who can be selected for Who's Printing
+        // Epoch and version of the who's printing state last applied, null
+        // until known. Versions start again from 0 with a new epoch when
+        // OctoPrint restarts so they are only compared within an epoch.
+        self.whosPrintingEpoch = null;
+        self.whosPrintingVersion = null;
+        // Recent sessions from the server's history, newest first. Only the
+        // rows scrolled into view are rendered, historyVersion changes when
+        // the ring does so just the visible rows are recomputed.
+        self.history = new HistoryRing(200);
+        self.historyVersion = ko.observable(0);
+        self.historyRowHeight = 24;
+        self.historyHeight = 240;
+        self.historyPageSize = 50;
+        self.historyScrollTop = ko.observable(0).extend({ rateLimit: 50 });
+        // id to load older sessions before, null when there are no more.
+        self.historyNextBefore = null;
+        self.historyLoading = false;
+        // Only the response for the current station is applied.
+        self.historyRequest = 0;
+        self.historyFirstVisible = ko.computed(function() {
+            return Math.floor(self.historyScrollTop() / self.historyRowHeight);
+        });
+        self.visibleHistory = ko.computed(function() {
+            self.historyVersion();
+            var first = self.historyFirstVisible();
+            var rows = Math.ceil(self.historyHeight / self.historyRowHeight) + 1;
+            return self.history.slice(first, first + rows);
+        });
+        self.historySpacerHeight = ko.computed(function() {
+            self.historyVersion();
+            return (self.history.length * self.historyRowHeight) + "px";
+        });
+        self.historyOffset = ko.computed(function() {
+            return (self.historyFirstVisible() * self.historyRowHeight) + "px";
+        });
+        self.historyCapacity = ko.computed(function() {
+            self.historyVersion();
+            return self.history.capacity;
+        });
+        self.historyFull = ko.computed(function() {
+            self.historyVersion();
+            return self.history.length == self.history.capacity;
+        });
+        // The possible users who can be selected for Who's Printing,
+        // one page of the users matching userSearch.
         self.whosPrintingList = ko.observableArray([]);
-        // The user who's been selected in the select/options list.
-        self.selectedWhosPrinting = ko.observable("");
+        self.whosPrintingListTotal = ko.observable(0);
+        self.userSearchPageSize = 20;
+        // Only the response to the latest search is applied.
+        self.userSearchRequest = 0;
+        // Type-ahead text for finding the user, searched once typing pauses.
+        self.userSearch = ko.observable("").extend({ rateLimit: { timeout: 250, method: "notifyWhenChangesStop" } });
+        self.userSearch.subscribe(function() {
+            self.populateUsers();
+        });
+        self.hasMoreUsers = ko.computed(function() {
+            return self.whosPrintingList().length < self.whosPrintingListTotal();
+        });
+        // The username of the user who's been selected in the list.
+        self.selectedWhosPrinting = ko.observable();
         self.unknownTagSeen = ko.observable(false);
+        // Set while the RFID reader has stopped responding.
+        self.readerFaulted = ko.observable(false);
+        self.readerError = ko.observable("");
 
         self.canIndicatePrinting = ko.computed(function() {
             if (self.selectedWhosPrinting() === undefined) {
@@ -53,6 +166,9 @@ $(function() {
         self.onBeforeBinding = function () {
             self.settings = self.settingsViewModel.settings.plugins.whosprinting;
 			console.log("Who's Printing Settings: " + self.settings );
+            if (self.settings.historyDisplayLimit) {
+                self.history = new HistoryRing(parseInt(self.settings.historyDisplayLimit(), 10) || 200);
+            }
         };
 
         self.onDataUpdaterPluginMessage = function(plugin, data) {
@@ -60,12 +176,27 @@ $(function() {
                 return;
             }
 
+            // Ignore messages for other stations.
+            var station = data.eventPayload ? data.eventPayload.station : undefined;
+            if (station !== undefined && self.station() && station != self.station()) {
+                return;
+            }
+
             // A known tag will set the WhosPrinting event
             if (data.eventEvent == "WhosPrinting") {
                 console.log("Who's Printing Event from onDataUpdater");
                 // If a known tag is see then the WhosPrinting event is fired
                 self.unknownTagSeen(false);
-                self.getWhosPrinting();
+
+                // The message carries the full state, only fetch it if
+                // we've missed a change (or don't know where we are).
+                var version = data.eventPayload.version;
+                var sameEpoch = data.eventPayload.epoch === self.whosPrintingEpoch;
+                if (sameEpoch && self.whosPrintingVersion !== null && version === self.whosPrintingVersion + 1) {
+                    self.getWhosPrintingResponseHandler(data.eventPayload);
+                } else if (!sameEpoch || version === undefined || version > self.whosPrintingVersion) {
+                    self.getWhosPrinting();
+                }
             }
 
             // If the tag was seen and it is unknown.
@@ -77,27 +208,80 @@ $(function() {
                 // This needs to be cleared if the tag was used for registering.
             }
 
-            // A known tag will set the WhosPrinting event
+            if (data.eventEvent == "RfidReaderFaulted") {
+                console.log("RFID reader faulted: " + data.eventPayload.lastError);
+                self.readerError(data.eventPayload.lastError);
+                self.readerFaulted(true);
+            }
+
+            if (data.eventEvent == "RfidReaderRecovered") {
+                console.log("RFID reader recovered");
+                self.readerFaulted(false);
+                self.readerError("");
+            }
         };
 
         self.onUserLoggedIn = function(user) {
             self.populateUsers();
-            self.getWhosPrinting();
+            self.getStations();
+        };
+
+        self.getStations = function() {
+            OctoPrint
+                .simpleApiGet(self.pluginId + "?command=stations", {})
+                .done(function(response) {
+                    self.stations(response.stations);
+                    var known = ko.utils.arrayFirst(response.stations, function(station) {
+                        return station.id == self.station();
+                    });
+                    if (!known && response.stations.length) {
+                        // Triggers getWhosPrinting.
+                        self.station(response.stations[0].id);
+                    } else {
+                        self.getWhosPrinting();
+                        self.reloadHistory();
+                    }
+                });
         };
 
-        // Get the list of users that can be shown in the populate users list.
+        // Get the first page of users matching the search to show in the users list.
         self.populateUsers = function() {
-            console.log("Getting users for who's printing selection.");
+            self.searchUsers(0);
+        };
+
+        // Get the next page of users for the current search.
+        self.loadMoreUsers = function() {
+            self.searchUsers(self.whosPrintingList().length);
+        };
+
+        self.searchUsers = function(offset) {
+            var request = ++self.userSearchRequest;
+            var url = self.pluginId + "?command=list"
+                + "&q=" + encodeURIComponent(self.userSearch())
+                + "&offset=" + offset
+                + "&limit=" + self.userSearchPageSize;
 
             OctoPrint
-                .simpleApiGet(self.pluginId + "?command=list", {})
-                .done(self.getUsersResponseHandler);
+                .simpleApiGet(url, {})
+                .done(function(response) {
+                    if (request === self.userSearchRequest) {
+                        self.getUsersResponseHandler(response);
+                    }
+                });
         };
 
-        // GET request to get the list of users to show in the who's printing dropdown.
+        // GET request to get the list of users to show in the who's printing list.
         self.getUsersResponseHandler = function(response) {
-            console.log("Populate users response: " + response);
-            self.whosPrintingList(response.users);
+            if (response.offset > 0) {
+                ko.utils.arrayPushAll(self.whosPrintingList, response.results);
+            } else {
+                self.whosPrintingList(response.results);
+            }
+            self.whosPrintingListTotal(response.total);
+        };
+
+        self.selectUser = function(user) {
+            self.selectedWhosPrinting(user.name);
         };
 
         // Get who is currentyl printing.
@@ -105,25 +289,132 @@ $(function() {
             console.log("Getting users for who's printing selection.");
 
             OctoPrint
-                .simpleApiGet(self.pluginId + "?command=get_whos_printing", {})
+                .simpleApiGet(self.pluginId + "?command=get_whos_printing&station=" + encodeURIComponent(self.station() || ""), {})
                 .done(self.getWhosPrintingResponseHandler );
         };
 
         self.getWhosPrintingResponseHandler = function(response){
+            if (response && response.version !== undefined) {
+                // Already showing this version, leave the bindings alone.
+                if (response.epoch === self.whosPrintingEpoch && response.version === self.whosPrintingVersion
+                        && self.whosPrinting() !== undefined) {
+                    return;
+                }
+                self.whosPrintingEpoch = response.epoch;
+                self.whosPrintingVersion = response.version;
+            }
+
             if (response && response.user) {
                 console.log("Somebodys printing: " + response.user);
                 self.whosPrinting(response.user);
                 self.isPrinting(true);
             } else {
-                // Nobody is printing.
+                // Nobody is printing, the session that ended is in the history.
                 if (self.whosPrinting() != null) {
-                    self.whosPrintingHistory.push(self.whosPrinting())
+                    self.loadNewHistory();
                 }
                 self.isPrinting(false);
                 self.whosPrinting(null);
             }
         };
 
+        self.historyUrl = function(limit, before) {
+            var url = self.pluginId + "?command=history&limit=" + limit;
+            if (self.station()) {
+                url += "&station=" + encodeURIComponent(self.station());
+            }
+            if (before) {
+                url += "&before=" + before;
+            }
+            return url;
+        };
+
+        // Start the history again from the newest sessions, e.g. for another station.
+        self.reloadHistory = function() {
+            var request = ++self.historyRequest;
+            self.history = new HistoryRing(self.history.capacity);
+            self.historyNextBefore = null;
+            self.historyLoading = true;
+            self.historyVersion(self.historyVersion() + 1);
+
+            OctoPrint
+                .simpleApiGet(self.historyUrl(self.historyPageSize), {})
+                .done(function(response) {
+                    if (request !== self.historyRequest) {
+                        return;
+                    }
+                    self.addOlderHistory(response);
+                })
+                .always(function() {
+                    if (request === self.historyRequest) {
+                        self.historyLoading = false;
+                    }
+                });
+        };
+
+        // Add the sessions that ended since the newest one shown.
+        self.loadNewHistory = function() {
+            var request = self.historyRequest;
+            OctoPrint
+                .simpleApiGet(self.historyUrl(5), {})
+                .done(function(response) {
+                    if (request !== self.historyRequest) {
+                        return;
+                    }
+                    var newest = self.history.length ? self.history.get(0).id : 0;
+                    var sessions = response.sessions.filter(function(session) {
+                        return session.id > newest;
+                    });
+                    for (var i = sessions.length - 1; i >= 0; i--) {
+                        self.history.pushNewest(sessions[i]);
+                    }
+                    if (sessions.length) {
+                        self.historyVersion(self.historyVersion() + 1);
+                    }
+                });
+        };
+
+        // Fetch the next page of older sessions when scrolled near the end.
+        self.loadOlderHistory = function() {
+            if (self.historyLoading || self.historyNextBefore === null || self.historyFull()) {
+                return;
+            }
+
+            var request = self.historyRequest;
+            self.historyLoading = true;
+            OctoPrint
+                .simpleApiGet(self.historyUrl(self.historyPageSize, self.historyNextBefore), {})
+                .done(function(response) {
+                    if (request === self.historyRequest) {
+                        self.addOlderHistory(response);
+                    }
+                })
+                .always(function() {
+                    if (request === self.historyRequest) {
+                        self.historyLoading = false;
+                    }
+                });
+        };
+
+        // Older sessions stop being added once the ring is full.
+        self.addOlderHistory = function(response) {
+            for (var i = 0; i < response.sessions.length; i++) {
+                if (!self.history.pushOldest(response.sessions[i])) {
+                    break;
+                }
+            }
+            self.historyNextBefore = response.nextBefore;
+            self.historyVersion(self.historyVersion() + 1);
+        };
+
+        self.onHistoryScroll = function(data, event) {
+            var element = event.target;
+            self.historyScrollTop(element.scrollTop);
+            if (element.scrollTop + element.clientHeight >= element.scrollHeight - (self.historyRowHeight * 5)) {
+                self.loadOlderHistory();
+            }
+        };
+
         // UI Indication that the person in the select list has started printing.
         self.startedPrinting = function() {
             self.isPrinting(true);
@@ -133,37 +424,45 @@ $(function() {
             var payload = {
                 username: self.selectedWhosPrinting()
             };
-            OctoPrint.simpleApiCommand(self.pluginId, "PrintStarted", payload, {});
+            self.sendCommand("PrintStarted", payload, {});
         };
 
         self.printFailedNozzleBlocked = function() {
             self.isPrinting(false);
             var payload = { reason:"Nozzle Blocked / No Filament" };
-            OctoPrint.simpleApiCommand(self.pluginId, "PrintFailed", payload, {});
+            self.sendCommand("PrintFailed", payload, {});
         };
 
         self.printFailedModelMoved = function() {
             self.isPrinting(false);
             var payload = { reason:"Model Moved" };
-            OctoPrint.simpleApiCommand(self.pluginId, "PrintFailed", payload, {});
+            self.sendCommand("PrintFailed", payload, {});
         };
 
         self.printFailed = function() {
             self.isPrinting(false);
             var payload = { reason:"Unknown" };
-            OctoPrint.simpleApiCommand(self.pluginId, "PrintFailed", payload, {});
+            self.sendCommand("PrintFailed", payload, {});
         };
 
         self.printFinished = function() {
             self.isPrinting(false);
             var payload = { };
-            OctoPrint.simpleApiCommand(self.pluginId, "PrintFinished", payload, {});
+            self.sendCommand("PrintFinished", payload, {});
+        };
+
+        // POST a command for the station this tab is showing.
+        self.sendCommand = function(command, payload, opts) {
+            if (self.station()) {
+                payload.station = self.station();
+            }
+            return OctoPrint.simpleApiCommand(self.pluginId, command, payload, opts);
         };
 
         self.testKeyFob = function() {
 
             var payload = { };
-            OctoPrint.simpleApiCommand(self.pluginId, "FakeTag", payload, {});
+            self.sendCommand("FakeTag", payload, {});
         };
     }
 
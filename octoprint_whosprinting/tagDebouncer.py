@@ -0,0 +1,57 @@
+# Debounces single tag reads taken one per poll into tag arrivals and
+# removals, so readers only need one serial transaction per poll.
+#
+# A tag arrives once it has been read arrival_reads times in a row, all
+# within arrival_window seconds of the first read. It's removed after
+# departure_reads polls in a row that don't read it, so a single missed
+# read while the tag is held doesn't raise it again.
+# Not thread safe, each engine owns its own.
+class tagDebouncer():
+	def __init__(self, arrival_reads=2, arrival_window=0.5, departure_reads=2):
+		self._arrival_reads = max(arrival_reads, 1)
+		self._arrival_window = arrival_window
+		self._departure_reads = max(departure_reads, 1)
+		# The tag that has arrived (None if there isn't one), and how many
+		# polls in a row it's been missing.
+		self.tag = None
+		self._missed = 0
+		# A tag read but not confirmed yet: id, reads in a row and first read time.
+		self._candidate = None
+		self._candidate_reads = 0
+		self._candidate_since = None
+
+	# Feed the result of one read (None if no tag was read) taken at now.
+	# Returns (removed, arrived, first_read): the tag removed and the tag that
+	# arrived (either may be None) and when the arrived tag was first read.
+	def update(self, tag, now):
+		removed = None
+		if self.tag is not None and tag != self.tag:
+			self._missed += 1
+			if self._missed >= self._departure_reads:
+				removed = self.tag
+				self.tag = None
+				self._missed = 0
+		elif self.tag is not None:
+			self._missed = 0
+
+		if tag is None or tag == self.tag:
+			self._candidate = None
+			return removed, None, None
+
+		if tag != self._candidate or now - self._candidate_since > self._arrival_window:
+			self._candidate = tag
+			self._candidate_reads = 0
+			self._candidate_since = now
+		self._candidate_reads += 1
+
+		if self._candidate_reads < self._arrival_reads:
+			return removed, None, None
+
+		# A new tag replaces the one that was there.
+		if self.tag is not None:
+			removed = self.tag
+		self.tag = tag
+		self._missed = 0
+		first_read = self._candidate_since
+		self._candidate = None
+		return removed, tag, first_read
@@ -0,0 +1,321 @@
+import threading
+import time
+
+from .circuitBreaker import circuitBreaker
+from .metrics import metricsRegistry
+from .tagDebouncer import tagDebouncer
+
+# Polls a tag reader, stepped by a readerPool worker thread.
+# Each step is a blocking, timeout bounded serial transaction so the worker
+# spends its time waiting on the port rather than on a timer. The poll rate
+# adapts, polling quickly while a tag is (or was recently) on the reader
+# and backing off to the idle interval when nobody is around.
+# Opening the reader is also done in a step. Failures go through a
+# circuit breaker, after too many in a row the reader is closed and only
+# re-opened on the breaker's backoff schedule (e.g. USB reader unplugged
+# and plugged back in) rather than hammering the port.
+# Each poll is one read, tags are confirmed across polls by a tagDebouncer
+# rather than by the reader reading each tag twice.
+class tagReaderEngine():
+	STATE_CONNECTING = "connecting"
+	STATE_READY = "ready"
+	STATE_FAULTED = "faulted"
+	STATE_STOPPED = "stopped"
+
+	def __init__(self, logger, reader, port, on_tag_seen, on_tag_removed=None,
+				 on_faulted=None, on_recovered=None,
+				 active_interval=0.02, idle_interval=0.5, active_period=5.0,
+				 retry_interval=1.0, failure_threshold=5, probe_initial=5.0, probe_max=300.0,
+				 arrival_reads=2, arrival_window=0.5, departure_reads=2, metrics=None,
+				 resolve_port=None):
+		self._logger = logger
+		self._reader = reader
+		self._port = port
+		# Called (on the pool thread) before each attempt to open the reader
+		# to find the port to use, e.g. to auto detect it. Raises if the
+		# reader can't be found.
+		self._resolve_port = resolve_port
+		# The port the reader was last opened on.
+		self._open_port = None
+		self._on_tag_seen = on_tag_seen
+		self._on_tag_removed = on_tag_removed
+		# Called once when the breaker trips and once when it closes again.
+		self._on_faulted = on_faulted
+		self._on_recovered = on_recovered
+		# Delay between polls (seconds) while a tag is present or was seen
+		# within the last active_period seconds.
+		self._active_interval = active_interval
+		# Maximum delay between polls when idle, the interval doubles from
+		# the active interval up to this. The reader was polled every 0.5s
+		# before the engine, idle polling is no more frequent than that.
+		self._idle_interval = idle_interval
+		self._active_period = active_period
+		# Delay before re-trying to open the reader while the breaker
+		# is closed (seconds).
+		self._retry_interval = retry_interval
+		self._breaker = circuitBreaker(failure_threshold, probe_initial, probe_max)
+
+		self._pool = None
+		self._stopping = False
+		# Set once the reader has been closed after stopping.
+		self._closed_event = threading.Event()
+		self._closed_event.set()
+		self._previous = None
+		self._state = self.STATE_STOPPED
+		self._last_error = None
+		self._reader_open = False
+		self._reader_version = None
+		self._debouncer = tagDebouncer(arrival_reads, arrival_window, departure_reads)
+		self._last_activity = 0
+		# The tag read by the last poll and when that poll finished, and when
+		# the last poll that didn't read the current tag finished, the tag
+		# was put on the reader after that.
+		self._last_tag = None
+		self._last_poll_finished = None
+		self._tag_absent_at = None
+		self._interval = active_interval
+
+		self._stats_lock = threading.Lock()
+		self._polls = 0
+		self._poll_time_total = 0.0
+		self._poll_time_max = 0.0
+		self._tags_seen = 0
+		self._last_latency = None
+		self._latency_total = 0.0
+		self._latency_max = 0.0
+		# Reads that found a tag, each used to cost a second read to confirm it.
+		self._transactions_saved = 0
+
+		metrics = metrics or metricsRegistry()
+		self._poll_seconds = metrics.histogram("reader_poll_seconds", "Time taken to check the reader for a tag.")
+		self._tag_latency_seconds = metrics.histogram("tag_seen_latency_seconds", "Time from the tag being put on the reader to RfidTagSeen being raised.")
+		self._reader_errors_total = metrics.counter("reader_errors_total", "Failed attempts to open or poll the reader.")
+		self._transactions_saved_total = metrics.counter("serial_transactions_saved_total", "Confirming reads saved by debouncing across polls.")
+
+	# Schedule the engine on the pool. If previous is given (the engine being
+	# replaced) the reader isn't opened until it has released the port.
+	def start(self, pool, previous=None):
+		self._pool = pool
+		self._previous = previous
+		self._state = self.STATE_CONNECTING
+		self._stopping = False
+		self._closed_event.clear()
+		self._logger.info("Tag reader for {0} started".format(self._port))
+		pool.schedule(self)
+
+	# Signal the engine to stop. If wait is set, wait (up to timeout seconds)
+	# for it to finish its current transaction and close the reader.
+	def stop(self, wait=True, timeout=2.0):
+		self._stopping = True
+		if self._pool:
+			self._pool.schedule(self)
+		if wait:
+			self.join(timeout)
+
+	def join(self, timeout=2.0):
+		if not self._closed_event.wait(timeout):
+			self._logger.warning("Tag reader for {0} did not stop within {1}s".format(self._port, timeout))
+
+	def is_running(self):
+		return not self._closed_event.is_set()
+
+	# Run one step, called by the pool.
+	# Returns the delay (seconds) until the next step, None once stopped.
+	def step(self):
+		if self._stopping:
+			self._close_reader()
+			self._state = self.STATE_STOPPED
+			self._closed_event.set()
+			self._logger.info("Tag reader for {0} stopped".format(self._port))
+			return None
+
+		if self._previous:
+			if self._previous.is_running():
+				return self._active_interval
+			self._previous = None
+
+		if self._reader_open:
+			if self.poll():
+				return self._interval
+			return self._idle_interval
+
+		if not self._breaker.allow_request():
+			return self._breaker.time_until_probe()
+
+		if self._open_reader():
+			return 0
+		if self._breaker.is_closed():
+			return self._retry_interval
+		return self._breaker.time_until_probe()
+
+	def get_status(self):
+		return dict(
+			state=self._state,
+			port=self._open_port or self._port,
+			readerVersion=self._reader_version,
+			lastError=self._last_error,
+			retryCount=self._breaker.consecutive_failures,
+			breaker=self._breaker.state,
+			nextProbeSeconds=self._breaker.time_until_probe(),
+			trips=self._breaker.trips,
+			stats=self.get_stats(),
+			readerStats=self._reader.get_stats(),
+		)
+
+	def get_stats(self):
+		with self._stats_lock:
+			polls = self._polls
+			tags_seen = self._tags_seen
+			return dict(
+				polls=polls,
+				pollTimeMeanMs=(self._poll_time_total / polls * 1000) if polls else None,
+				pollTimeMaxMs=self._poll_time_max * 1000,
+				tagsSeen=tags_seen,
+				lastLatencyMs=(self._last_latency * 1000) if self._last_latency is not None else None,
+				latencyMeanMs=(self._latency_total / tags_seen * 1000) if tags_seen else None,
+				latencyMaxMs=self._latency_max * 1000,
+				intervalMs=self._interval * 1000,
+				transactionsSaved=self._transactions_saved,
+			)
+
+	# Open the port and check the reader responds.
+	def _open_reader(self):
+		self._state = self.STATE_CONNECTING
+		try:
+			port = self._port
+			if self._resolve_port:
+				port = self._resolve_port()
+			if not port:
+				raise IOError("No COM port set for RFID reader")
+
+			self._logger.info("Opening port: {0} for RFID reader.".format(port))
+			self._open_port = port
+			self._reader.open(port)
+
+			readerVersion = self._reader.read_version()
+			if not readerVersion:
+				raise IOError("Failed to read version from RFID Reader.")
+		except Exception as e:
+			self._close_reader()
+			self._record_failure(e, "Failed to initialize RFID reader")
+			return False
+
+		self._logger.info("Reader version: {0}".format(readerVersion))
+		self._reader_version = readerVersion
+		self._reader_open = True
+		self._record_success()
+		return True
+
+	def _close_reader(self):
+		self._reader_open = False
+		self._last_tag = None
+		self._last_poll_finished = None
+		self._reader.close()
+
+	def _record_success(self):
+		self._state = self.STATE_READY
+		if self._breaker.record_success():
+			self._logger.info("RFID reader recovered")
+			if self._on_recovered:
+				self._on_recovered(self.get_status())
+		self._last_error = None
+
+	# Count the failure against the breaker. Only the first failure in a run
+	# is logged with a stack trace.
+	def _record_failure(self, e, message):
+		self._reader_errors_total.inc()
+		self._last_error = str(e)
+		was_closed = self._breaker.is_closed()
+		first_failure = self._breaker.consecutive_failures == 0
+
+		if self._breaker.record_failure():
+			self._close_reader()
+			self._state = self.STATE_FAULTED
+			self._logger.error("RFID reader faulted after {0} consecutive failures. Last error: {1}. Next attempt in {2:.1f}s".format(
+				self._breaker.consecutive_failures, e, self._breaker.time_until_probe()))
+			if self._on_faulted:
+				self._on_faulted(self.get_status())
+		elif not was_closed:
+			self._state = self.STATE_FAULTED
+			self._logger.info("RFID reader still faulted: {0}. Next attempt in {1:.1f}s".format(e, self._breaker.time_until_probe()))
+		elif first_failure:
+			self._logger.exception("{0}. Exception: {1}".format(message, e))
+		else:
+			self._logger.warning("{0} ({1} in a row). Exception: {2}".format(message, self._breaker.consecutive_failures, e))
+
+	# Perform a single poll of the reader.
+	# Returns False if the reader failed.
+	def poll(self):
+		poll_started = time.time()
+		try:
+			tag = self._reader.tryTag()
+		except Exception as e:
+			self._record_failure(e, "Error reading tag")
+			return False
+
+		self._record_success()
+
+		poll_finished = time.time()
+		self._record_poll(poll_finished - poll_started)
+		if tag != self._last_tag:
+			self._tag_absent_at = self._last_poll_finished
+		self._last_tag = tag
+		self._last_poll_finished = poll_finished
+
+		if tag:
+			# Poll quickly to confirm the tag (or to notice it going).
+			self._last_activity = poll_finished
+			self._interval = self._active_interval
+			self._record_transaction_saved()
+
+		removed, arrived, first_read = self._debouncer.update(tag, poll_started)
+		if removed:
+			self._logger.info("Tag removed")
+			if self._on_tag_removed:
+				self._on_tag_removed()
+
+		if arrived:
+			# Latency is measured from when the tag was put on the reader to
+			# the RfidTagSeen event being raised, so it includes the time the
+			# tag waited for the poll that first read it. That's some time
+			# between the last poll that didn't read the tag and the first
+			# that did, taken as half way (from the first read if the reader
+			# was only just opened).
+			self._on_tag_seen(arrived)
+			put_on = first_read
+			if self._tag_absent_at is not None:
+				put_on = (self._tag_absent_at + first_read) / 2
+			latency = time.time() - put_on
+			self._record_tag(latency)
+			self._logger.info("Tag {0} raised {1:.1f}ms after it was put on the reader".format(arrived, latency * 1000))
+		elif not removed:
+			self._update_interval(poll_finished)
+		return True
+
+	def _update_interval(self, now):
+		if now - self._last_activity < self._active_period:
+			self._interval = self._active_interval
+		else:
+			self._interval = min(self._interval * 2, self._idle_interval)
+
+	def _record_poll(self, duration):
+		self._poll_seconds.observe(duration)
+		with self._stats_lock:
+			self._polls += 1
+			self._poll_time_total += duration
+			if duration > self._poll_time_max:
+				self._poll_time_max = duration
+
+	def _record_transaction_saved(self):
+		self._transactions_saved_total.inc()
+		with self._stats_lock:
+			self._transactions_saved += 1
+
+	def _record_tag(self, latency):
+		self._tag_latency_seconds.observe(latency)
+		with self._stats_lock:
+			self._tags_seen += 1
+			self._last_latency = latency
+			self._latency_total += latency
+			if latency > self._latency_max:
+				self._latency_max = latency
@@ -0,0 +1,148 @@
+import collections
+import threading
+import time
+
+import requests
+
+try:
+	from urllib.parse import quote
+except ImportError:
+	from urllib import quote
+
+from .userIndex import userIndex
+
+# Resolves a keyfob tag to a username.
+# Each resolver returns the username, or None if it doesn't know the tag.
+
+# Tags assigned to users on this OctoPrint (their keyfobId setting).
+class localTagResolver():
+	def __init__(self, user_index):
+		self._user_index = user_index
+
+	def resolve(self, tagId):
+		return self._user_index.find_username(tagId)
+
+# Tags assigned to users on the other OctoPrint instances sharing a sharedStore.
+class sharedTagResolver():
+	def __init__(self, shared_store):
+		self._shared_store = shared_store
+
+	def resolve(self, tagId):
+		return self._shared_store.find_username(userIndex.normalise_tag(tagId))
+
+# Tags looked up from an external member directory over HTTP.
+# url may contain {tagId}, which is replaced with the (normalised, url
+# quoted) tag, otherwise ?tagId=<tag> is added. Any other braces in the url
+# are left as they are. The directory should answer 200 with
+# {"username": "..."} for a known tag and 404 for an unknown one.
+# Answers are kept in a bounded LRU cache for ttl seconds (negative_ttl for
+# unknown tags), concurrent lookups of the same tag share one request and
+# no lookup waits longer than timeout seconds in total, however slowly the
+# directory answers. Errors aren't cached.
+class httpTagResolver():
+	def __init__(self, logger, url, timeout=1.0, ttl=300, negative_ttl=60, cache_size=1000):
+		self._logger = logger
+		self._url = url
+		self._timeout = timeout
+		self._ttl = ttl
+		self._negative_ttl = negative_ttl
+		self._cache_size = cache_size
+		self._lock = threading.Lock()
+		# tagId -> (username or None, expires)
+		self._cache = collections.OrderedDict()
+		# tagId -> [Event, result] for lookups in progress.
+		self._in_flight = dict()
+		self._session = requests.Session()
+
+	def resolve(self, tagId):
+		tagId = userIndex.normalise_tag(tagId)
+		if not tagId:
+			return None
+
+		with self._lock:
+			cached = self._cache.get(tagId)
+			if cached is not None:
+				if cached[1] > time.time():
+					# Move to the most recently used end.
+					del self._cache[tagId]
+					self._cache[tagId] = cached
+					return cached[0]
+				del self._cache[tagId]
+
+			lookup = self._in_flight.get(tagId)
+			owner = lookup is None
+			if owner:
+				lookup = [threading.Event(), None]
+				self._in_flight[tagId] = lookup
+
+		if owner:
+			# The request's own timeout only limits each connect and read, a
+			# directory that trickles its answer could hold the caller (the
+			# dispatcher thread) for much longer. Ask from another thread and
+			# wait no longer than timeout, a late answer is still cached.
+			thread = threading.Thread(target=self._lookup, args=(tagId, lookup), name="WhosPrintingTagLookup")
+			thread.daemon = True
+			thread.start()
+
+		if not lookup[0].wait(self._timeout):
+			if owner:
+				self._logger.warning("Tag directory lookup for {0} took longer than {1}s, treating the tag as unknown".format(tagId, self._timeout))
+			return None
+		return lookup[1]
+
+	def clear(self):
+		with self._lock:
+			self._cache.clear()
+
+	# Fetch tagId for the callers waiting on lookup, [Event, result].
+	def _lookup(self, tagId, lookup):
+		try:
+			username, found = self._fetch(tagId)
+			if found is not None:
+				self._store(tagId, username, self._ttl if found else self._negative_ttl)
+			lookup[1] = username
+		finally:
+			with self._lock:
+				del self._in_flight[tagId]
+			lookup[0].set()
+
+	# Returns (username, found). found is None if the directory couldn't be asked.
+	def _fetch(self, tagId):
+		if "{tagId}" in self._url:
+			url = self._url.replace("{tagId}", quote(tagId, safe=""))
+			params = None
+		else:
+			url = self._url
+			params = dict(tagId=tagId)
+
+		try:
+			response = self._session.get(url, params=params, timeout=self._timeout)
+			if response.status_code == 404:
+				return None, False
+			response.raise_for_status()
+			data = response.json()
+			if not isinstance(data, dict):
+				raise ValueError("expected a JSON object, got {0}".format(type(data).__name__))
+			username = data.get("username")
+			return username, bool(username)
+		except (requests.RequestException, ValueError) as e:
+			self._logger.warning("Tag directory lookup failed for {0}: {1}".format(tagId, e))
+			return None, None
+
+	def _store(self, tagId, username, ttl):
+		with self._lock:
+			self._cache[tagId] = (username, time.time() + ttl)
+			while len(self._cache) > self._cache_size:
+				self._cache.popitem(last=False)
+
+# Asks each resolver in turn until one knows the tag.
+class tagResolverChain():
+	def __init__(self, resolvers):
+		self._resolvers = resolvers
+
+	def resolve(self, tagId):
+		for resolver in self._resolvers:
+			username = resolver.resolve(tagId)
+			if username:
+				return username
+		return None
@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+
+from octoprint.util import atomic_write
+
+from .sessionJournal import OUTCOME_FINISHED, OUTCOME_FAILED, OUTCOME_INTERRUPTED
+
+# Running per user totals of print sessions, updated as each session ends
+# so statistics and leaderboards never need to rescan the history.
+# Checkpointed to a JSON file, on load any sessions that ended after the
+# checkpoint are replayed from the session journal.
+class usageStatistics():
+	LEADERBOARD_METRICS = ["sessions", "successes", "failures", "totalDuration", "meanDuration", "failureRate"]
+
+	def __init__(self, logger, path):
+		self._logger = logger
+		self._path = path
+		self._lock = threading.Lock()
+		self._users = dict()
+		# End time and id of the last session counted, sessions are replayed
+		# from after these.
+		self._last_ended = 0
+		self._last_id = None
+		self._dirty = False
+
+	# Load the checkpoint and catch up with the journal.
+	def load(self, journal):
+		if os.path.exists(self._path):
+			try:
+				with open(self._path, "r") as f:
+					checkpoint = json.load(f)
+				self._users = checkpoint.get("users", dict())
+				self._last_ended = checkpoint.get("lastEnded", 0)
+				self._last_id = checkpoint.get("lastId")
+			except (IOError, ValueError) as e:
+				self._logger.error("Failed to load usage statistics, rebuilding from history. Exception: {0}".format(e))
+				self._users = dict()
+				self._last_ended = 0
+				self._last_id = None
+
+		replayed = 0
+		for session in journal.ended_since(self._last_ended, self._last_id):
+			self.record_session(session)
+			replayed += 1
+		if replayed:
+			self._logger.info("Replayed {0} sessions into the usage statistics".format(replayed))
+			self.checkpoint()
+
+	# Write the totals to disk if they have changed.
+	def checkpoint(self):
+		with self._lock:
+			if not self._dirty:
+				return
+			data = json.dumps(dict(users=self._users, lastEnded=self._last_ended, lastId=self._last_id))
+			self._dirty = False
+
+		try:
+			with atomic_write(self._path, "w") as f:
+				f.write(data)
+		except (IOError, OSError) as e:
+			self._logger.error("Failed to save usage statistics. Exception: {0}".format(e))
+			self._dirty = True
+
+	# Add an ended session (as returned by the session journal) to the totals.
+	def record_session(self, session):
+		if session is None or session["ended"] is None:
+			return
+
+		# An interrupted session wasn't ended by the user but by OctoPrint
+		# stopping (it's closed on the next start) or its station being
+		# removed, so its end time isn't when printing stopped. It's counted
+		# but its duration isn't, else downtime would count as printing.
+		interrupted = session["outcome"] == OUTCOME_INTERRUPTED
+		duration = 0.0 if interrupted else max(session["ended"] - session["started"], 0)
+		with self._lock:
+			stats = self._users.get(session["username"])
+			if stats is None:
+				stats = dict(sessions=0, successes=0, failures=0, interrupted=0, failureReasons=dict(), totalDuration=0.0, lastPrinted=None)
+				self._users[session["username"]] = stats
+
+			stats["sessions"] += 1
+			stats["totalDuration"] += duration
+			if interrupted:
+				stats["interrupted"] = stats.get("interrupted", 0) + 1
+			if session["outcome"] == OUTCOME_FINISHED:
+				stats["successes"] += 1
+			elif session["outcome"] == OUTCOME_FAILED:
+				stats["failures"] += 1
+				reason = session["reason"] or "Unknown"
+				stats["failureReasons"][reason] = stats["failureReasons"].get(reason, 0) + 1
+			if stats["lastPrinted"] is None or session["started"] > stats["lastPrinted"]:
+				stats["lastPrinted"] = session["started"]
+
+			if self._last_id is None or (session["ended"], session["id"]) > (self._last_ended, self._last_id):
+				self._last_ended = session["ended"]
+				self._last_id = session["id"]
+			self._dirty = True
+
+	# Statistics for the user, None if they've never printed.
+	def get_user(self, username):
+		with self._lock:
+			stats = self._users.get(username)
+			if stats is None:
+				return None
+			return self._with_derived(username, stats)
+
+	def get_all(self):
+		with self._lock:
+			return [self._with_derived(username, stats) for username, stats in self._users.items()]
+
+	# Top limit users by the metric (one of LEADERBOARD_METRICS), highest first.
+	def leaderboard(self, metric="sessions", limit=10):
+		if metric not in self.LEADERBOARD_METRICS:
+			raise ValueError("Unknown metric: {0}".format(metric))
+		users = self.get_all()
+		users.sort(key=lambda stats: (stats[metric], stats["sessions"]), reverse=True)
+		return users[:limit]
+
+	@staticmethod
+	def _with_derived(username, stats):
+		sessions = stats["sessions"]
+		result = dict(stats)
+		result["failureReasons"] = dict(stats["failureReasons"])
+		result["username"] = username
+		# Checkpoints from before interrupted sessions were counted apart.
+		result["interrupted"] = stats.get("interrupted", 0)
+		timed = sessions - result["interrupted"]
+		result["meanDuration"] = stats["totalDuration"] / timed if timed else 0.0
+		result["failureRate"] = float(stats["failures"]) / sessions if sessions else 0.0
+		return result
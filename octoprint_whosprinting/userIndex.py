@@ -0,0 +1,239 @@
+import bisect
+import os
+import threading
+import time
+
+try:
+	from octoprint.access.users import LoginStatusListener
+except ImportError:
+	try:
+		from octoprint.users import LoginStatusListener
+	except ImportError:
+		LoginStatusListener = object
+
+# In memory index of keyfob id -> username and a sorted list of users.
+# Built from the user manager once and then swapped in as a whole so
+# lookups on the RFID path are a single dictionary access rather than
+# a walk over every user, and user searches don't need to fetch every user.
+# Lookups never rebuild, that would be a full scan of the users on every
+# unknown swipe or on an API request. The index is rebuilt in the background
+# after invalidate(): when the plugin changes keyfobs, its settings are saved
+# or OctoPrint reports a user modified (see watch_user_manager). Changes made
+# outside the plugin are picked up by rebuild_if_older, when the users file
+# changes or at the latest after max_age.
+class userIndex():
+	def __init__(self, logger, user_manager, submit=None, max_age=3600, on_rebuilt=None, first_build_timeout=10.0, users_file=None):
+		self._logger = logger
+		self._user_manager = user_manager
+		# Runs the rebuild off the calling thread, e.g. on the plugin's
+		# dispatcher. Without it rebuilds are run by the caller.
+		self._submit = submit
+		# Called with the keyfob id -> username map after each rebuild.
+		self._on_rebuilt = on_rebuilt
+		# rebuild_if_older rebuilds once the index is older than this
+		# (seconds), for changes nobody was told about.
+		self._max_age = max_age
+		# The file the user manager keeps the users in, if known, and its
+		# modification time and size when the index was last built.
+		self._users_file = users_file
+		self._users_file_signature = None
+		# Longest a lookup waits for the first build (seconds).
+		self._first_build_timeout = first_build_timeout
+		self._built = threading.Event()
+		self._listener = None
+		self._rebuild_lock = threading.Lock()
+		self._tags = dict()
+		self._duplicates = dict()
+		# (users sorted by display name, sorted (lower case name, position) search keys)
+		self._users = ([], [])
+		self._display_names = dict()
+		self._built_at = 0
+		self._stale = True
+
+	@staticmethod
+	def normalise_tag(tagId):
+		if tagId is None:
+			return None
+		tagId = str(tagId).strip().lower()
+		if not tagId:
+			return None
+		return tagId
+
+	# Mark the index as out of date and rebuild it in the background.
+	# Lookups use the current index until the new one is swapped in.
+	def invalidate(self):
+		self._stale = True
+		if self._submit is None:
+			self.rebuild()
+		elif self._submit(self.rebuild) is False:
+			# Not queued, rebuild_if_older will pick it up.
+			self._logger.warning("Couldn't queue a user index rebuild, it will be rebuilt later")
+
+	# Rebuild if the index is out of date, the users file has changed or the
+	# index is older than max_age. Called periodically off the swipe path and
+	# the API, it's only a stat of the users file when nothing has changed.
+	def rebuild_if_older(self):
+		if self._stale or time.time() - self._built_at >= self._max_age or self._read_users_file_signature() != self._users_file_signature:
+			self.rebuild()
+
+	# Have OctoPrint's user manager invalidate the index when a user is
+	# modified or removed, if it can. OctoPrint only reports changes to
+	# users that are logged in, rebuild_if_older covers the rest.
+	# Returns whether the user manager takes the listener.
+	def watch_user_manager(self):
+		register = getattr(self._user_manager, "register_login_status_listener", None)
+		if register is None or LoginStatusListener is object:
+			return False
+		self._listener = userIndexListener(self)
+		register(self._listener)
+		return True
+
+	def unwatch_user_manager(self):
+		unregister = getattr(self._user_manager, "unregister_login_status_listener", None)
+		if self._listener is not None and unregister is not None:
+			unregister(self._listener)
+		self._listener = None
+
+	def rebuild(self):
+		with self._rebuild_lock:
+			started = time.time()
+			# Cleared before reading the users so a change made while
+			# building marks the new index out of date again.
+			self._stale = False
+			self._users_file_signature = self._read_users_file_signature()
+			tags = dict()
+			duplicates = dict()
+			users = []
+			display_names = dict()
+
+			for user in self._user_manager.getAllUsers():
+				user_settings = user.get("settings") or dict()
+				username = user["name"]
+				displayName = user_settings.get("displayName") or username
+				users.append(dict(name=username, displayName=displayName))
+				display_names[username] = displayName
+
+				keyfob = self.normalise_tag(user_settings.get("keyfobId"))
+				if not keyfob:
+					continue
+
+				if keyfob in tags:
+					duplicates.setdefault(keyfob, [tags[keyfob]]).append(username)
+					continue
+				tags[keyfob] = username
+
+			users.sort(key=lambda u: (u["displayName"].lower(), u["name"]))
+			keys = []
+			for position, user in enumerate(users):
+				keys.append((user["name"].lower(), position))
+				if user["displayName"] != user["name"]:
+					keys.append((user["displayName"].lower(), position))
+			keys.sort()
+
+			# Swap in the new maps, readers either see the old or the new index.
+			self._tags = tags
+			self._duplicates = duplicates
+			self._users = (users, keys)
+			self._display_names = display_names
+			self._built_at = time.time()
+			self._built.set()
+
+			self._logger.info("Built user index of {0} users, {1} tags in {2:.1f}ms".format(len(users), len(tags), (self._built_at - started) * 1000))
+			for keyfob, usernames in duplicates.items():
+				self._logger.warning("Keyfob {0} is assigned to multiple users: {1}. Using {2}".format(keyfob, ", ".join(usernames), usernames[0]))
+
+			if self._on_rebuilt:
+				try:
+					self._on_rebuilt(dict(tags))
+				except Exception as e:
+					self._logger.exception("Failed to handle the rebuilt user index. Exception: {0}".format(e))
+
+	# Returns the username for the tag, or None if the tag isn't assigned.
+	def find_username(self, tagId):
+		tagId = self.normalise_tag(tagId)
+		if not tagId:
+			return None
+
+		self._wait_until_built()
+		username = self._tags.get(tagId)
+		if username is None or self._is_current(username, tagId):
+			return username
+
+		# The user has changed their keyfob since the index was built, it's
+		# rebuilt in the background for the next swipe.
+		self.invalidate()
+		return None
+
+	# Map of keyfob id -> list of usernames that share that keyfob.
+	def get_duplicates(self):
+		self._wait_until_built()
+		return dict((keyfob, list(usernames)) for keyfob, usernames in self._duplicates.items())
+
+	# The user's display name, their username if they aren't known.
+	def get_display_name(self, username):
+		self._wait_until_built()
+		return self._display_names.get(username, username)
+
+	# Search users by name or display name (case insensitive).
+	# match is "prefix" (of the name or display name) or "substring".
+	# Returns (total matches, list of dict(name, displayName)) for the
+	# page given by offset and limit, ordered by display name.
+	def search(self, query=None, match="prefix", offset=0, limit=None):
+		self._wait_until_built()
+		users, keys = self._users
+		query = (query or "").strip().lower()
+
+		if not query:
+			matched = users
+		elif match == "substring":
+			matched = [user for user in users if query in user["name"].lower() or query in user["displayName"].lower()]
+		else:
+			positions = set()
+			start = bisect.bisect_left(keys, (query, -1))
+			for key, position in keys[start:]:
+				if not key.startswith(query):
+					break
+				positions.add(position)
+			matched = [users[position] for position in sorted(positions)]
+
+		end = None if limit is None else offset + limit
+		return len(matched), [dict(user) for user in matched[offset:end]]
+
+	# Lookups just after starting wait for the first build (started in the
+	# background) rather than build the index themselves.
+	def _wait_until_built(self):
+		if self._built.is_set():
+			return
+		if self._submit is None:
+			self.rebuild()
+			return
+		if not self._built.wait(self._first_build_timeout) and self._first_build_timeout:
+			# Only hold up the first lookups.
+			self._first_build_timeout = 0
+			self._logger.warning("The user index isn't built yet, lookups will find nobody until it is")
+
+	def _read_users_file_signature(self):
+		if not self._users_file:
+			return None
+		try:
+			stat = os.stat(self._users_file)
+		except OSError:
+			return None
+		return (stat.st_mtime, stat.st_size)
+
+	def _is_current(self, username, tagId):
+		user = self._user_manager.findUser(username)
+		if user is None:
+			return False
+		return self.normalise_tag(user.get_all_settings().get("keyfobId")) == tagId
+
+# Invalidates the index when OctoPrint reports a user modified or removed.
+class userIndexListener(LoginStatusListener):
+	def __init__(self, index):
+		self._index = index
+
+	def on_user_modified(self, user):
+		self._index.invalidate()
+
+	def on_user_removed(self, userid):
+		self._index.invalidate()
@@ -0,0 +1,24 @@
+# Shared fixtures of the plugin's tests.
+#
+# Run from the OctoPrint virtualenv, in the top folder of the plugin:
+#     python -m pytest tests
+import logging
+import threading
+
+import pytest
+
+@pytest.fixture
+def logger():
+	return logging.getLogger("octoprint.plugins.whosprinting.tests")
+
+# Runs each of the targets on its own thread, all at the same time, and
+# waits for them to finish.
+@pytest.fixture
+def run_threads():
+	def run(targets):
+		threads = [threading.Thread(target=target) for target in targets]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+	return run
@@ -0,0 +1,114 @@
+# Stress test of a station's session state machine: many threads start,
+# refresh, finish and fail sessions for their own user at the same time
+# while others read the current snapshot.
+import random
+import sys
+import threading
+
+import pytest
+
+from octoprint_whosprinting.sessionState import (sessionStateMachine, invalidTransitionError,
+												 STATE_PRINTING, STATE_FINISHED, STATE_FAILED,
+												 EVENT_START, EVENT_FINISH, EVENT_FAIL)
+
+THREADS = 32
+TRANSITIONS = 2000
+READERS = 4
+SEED = 1
+
+def worker(machine, username, transitions, seed, failures):
+	generator = random.Random(seed)
+	try:
+		for i in range(transitions):
+			choice = generator.random()
+			if choice < 0.4:
+				machine.transition(EVENT_START, username=username, details=dict(username=username), source="test")
+				continue
+			if choice < 0.5:
+				machine.refresh(username, dict(username=username, refreshed=i))
+				continue
+			try:
+				machine.transition(EVENT_FINISH if choice < 0.75 else EVENT_FAIL, source="test")
+			except invalidTransitionError:
+				# Nobody was printing, expected when racing the other threads.
+				pass
+	except Exception as e:
+		failures.append("{0}: {1!r}".format(username, e))
+
+def reader(machine, stop, failures):
+	last = -1
+	while not stop.is_set():
+		version = machine.snapshot.version
+		if version < last:
+			failures.append("reader saw version {0} after {1}".format(version, last))
+			return
+		last = version
+
+# Thread switches as often as possible to shake out races.
+@pytest.fixture
+def switch_often():
+	if hasattr(sys, "setswitchinterval"):
+		interval = sys.getswitchinterval()
+		sys.setswitchinterval(1e-6)
+		yield
+		sys.setswitchinterval(interval)
+	else:
+		interval = sys.getcheckinterval()
+		sys.setcheckinterval(1)
+		yield
+		sys.setcheckinterval(interval)
+
+# Runs the workers and readers, returns the snapshots the listeners were
+# given and the (previous, snapshot) every transition's effect saw.
+@pytest.fixture
+def stressed(switch_often, run_threads):
+	machine = sessionStateMachine()
+	published = [machine.snapshot]
+	effects = []
+	machine.add_listener(published.append)
+
+	# Every transition records what its effect saw, wrapped around transition()
+	# so the workers don't need to know about it.
+	transition = machine.transition
+	def recording_transition(event, effect=None, **kwargs):
+		return transition(event, effect=lambda previous, snapshot: effects.append((previous, snapshot)), **kwargs)
+	machine.transition = recording_transition
+
+	failures = []
+	stop = threading.Event()
+	readers = [threading.Thread(target=reader, args=(machine, stop, failures)) for i in range(READERS)]
+	for thread in readers:
+		thread.start()
+	run_threads([lambda i=i: worker(machine, "user{0}".format(i), TRANSITIONS, SEED + i, failures) for i in range(THREADS)])
+	stop.set()
+	for thread in readers:
+		thread.join()
+
+	assert failures == []
+	return published, effects
+
+def test_versions_contiguous(stressed):
+	published, effects = stressed
+	for previous, snapshot in zip(published, published[1:]):
+		assert snapshot.version == previous.version + 1
+		assert snapshot.epoch == previous.epoch
+
+def test_finish_and_fail_follow_a_start_of_the_same_user(stressed):
+	published, effects = stressed
+	for previous, snapshot in zip(published, published[1:]):
+		if snapshot.state in (STATE_FINISHED, STATE_FAILED):
+			assert (previous.state, previous.username) == (STATE_PRINTING, snapshot.username), \
+				"{0} at version {1}".format(snapshot.state, snapshot.version)
+		if snapshot.state == STATE_PRINTING:
+			assert snapshot.details.get("username") == snapshot.username
+
+# Effects only run for transitions (not refreshes), each must have seen the
+# snapshot published just before its own.
+def test_effects_see_the_published_previous_snapshot(stressed):
+	published, effects = stressed
+	by_version = dict((snapshot.version, snapshot) for snapshot in published)
+	for previous, snapshot in effects:
+		assert by_version.get(snapshot.version) is snapshot
+		assert by_version.get(snapshot.version - 1) is previous
+	versions = [snapshot.version for previous, snapshot in effects]
+	assert versions == sorted(versions)
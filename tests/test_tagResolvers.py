@@ -0,0 +1,136 @@
+# The HTTP tag resolver against a stub member directory on localhost.
+import json
+import threading
+import time
+
+import pytest
+
+try:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+	from socketserver import ThreadingMixIn
+except ImportError:
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+	from SocketServer import ThreadingMixIn
+
+from octoprint_whosprinting.tagResolvers import httpTagResolver
+
+TIMEOUT = 0.5
+
+USERS = {"0a1b2c3d": "alice", "slowfob1": "bob", "shared01": "carol"}
+
+class threadingServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+class directoryHandler(BaseHTTPRequestHandler):
+	requests = dict()
+	lock = threading.Lock()
+
+	def do_GET(self):
+		tagId = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+		with self.lock:
+			self.requests[tagId] = self.requests.get(tagId, 0) + 1
+
+		if tagId == "broken01":
+			self.send_error(500)
+			return
+		if tagId == "listfob1":
+			body = b"[1, 2]"
+			self.send_response(200)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+			return
+		if tagId not in USERS:
+			self.send_error(404)
+			return
+
+		body = json.dumps(dict(username=USERS[tagId])).encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		if tagId == "slowfob1":
+			# A byte at a time, each well inside the read timeout.
+			for i in range(len(body)):
+				self.wfile.write(body[i:i + 1])
+				self.wfile.flush()
+				time.sleep(TIMEOUT / 4)
+			return
+		if tagId == "shared01":
+			time.sleep(TIMEOUT / 2)
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+# The url of a directory started for the test, with no requests made yet.
+@pytest.fixture
+def directory():
+	directoryHandler.requests = dict()
+	server = threadingServer(("127.0.0.1", 0), directoryHandler)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	yield "http://127.0.0.1:{0}/tags/{{tagId}}".format(server.server_address[1])
+	server.shutdown()
+	server.server_close()
+
+@pytest.fixture
+def resolver(logger, directory):
+	return httpTagResolver(logger, directory, timeout=TIMEOUT)
+
+def requests_for(tagId):
+	return directoryHandler.requests.get(tagId, 0)
+
+def test_known_tag_is_cached(resolver):
+	assert resolver.resolve("0a1b2c3d") == "alice"
+	assert resolver.resolve("0a1b2c3d") == "alice"
+	assert requests_for("0a1b2c3d") == 1
+
+def test_unknown_tag_is_cached(resolver):
+	assert resolver.resolve("ffffffff") is None
+	assert resolver.resolve("ffffffff") is None
+	assert requests_for("ffffffff") == 1
+
+def test_directory_error_is_not_cached(resolver):
+	assert resolver.resolve("broken01") is None
+	assert resolver.resolve("broken01") is None
+	assert requests_for("broken01") == 2
+
+def test_answer_that_isnt_an_object_is_not_cached(resolver):
+	assert resolver.resolve("listfob1") is None
+	assert resolver.resolve("listfob1") is None
+	assert requests_for("listfob1") == 2
+
+def test_tag_is_normalised(resolver):
+	assert resolver.resolve("0a1b2c3d") == "alice"
+	assert resolver.resolve(" 0A1B2C3D ") == "alice"
+	assert requests_for("0a1b2c3d") == 1
+
+def test_url_with_other_braces(logger, directory):
+	resolver = httpTagResolver(logger, directory + "?format={json}", timeout=TIMEOUT)
+	assert resolver.resolve("0a1b2c3d") == "alice"
+
+def test_concurrent_lookups_share_one_request(resolver, run_threads):
+	results = []
+	run_threads([lambda: results.append(resolver.resolve("shared01"))] * 8)
+	assert results == ["carol"] * 8
+	assert requests_for("shared01") == 1
+
+# The directory trickles its answer slower than the timeout, which must not
+# hold the caller for longer than the timeout in total (the per read
+# timeout of requests alone doesn't do that).
+def test_slow_directory_gives_up_within_the_timeout(resolver):
+	started = time.time()
+	assert resolver.resolve("slowfob1") is None
+	assert time.time() - started < TIMEOUT * 1.5
+
+	# The late answer is still cached for the next swipe. Asking again
+	# while it's on its way waits on the same request.
+	deadline = time.time() + 10
+	username = None
+	while username is None and time.time() < deadline:
+		username = resolver.resolve("slowfob1")
+	assert username == "bob"
+	assert requests_for("slowfob1") == 1
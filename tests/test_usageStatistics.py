@@ -0,0 +1,77 @@
+# The usage statistics survive restarts without counting any session twice.
+# Each restart reloads them from their checkpoint and the session journal,
+# as OctoPrint starting again does.
+import os
+
+import pytest
+
+from octoprint_whosprinting.sessionJournal import sessionJournal, SOURCE_UI, OUTCOME_FINISHED, OUTCOME_FAILED
+from octoprint_whosprinting.usageStatistics import usageStatistics
+
+RESTARTS = 3
+
+# Returns a function that closes the journal of the previous start, if
+# any, and starts the journal and statistics again on the same folder.
+@pytest.fixture
+def restart(logger, tmpdir):
+	journals = []
+
+	def restart():
+		if journals:
+			journals.pop().close()
+		journal = sessionJournal(logger, os.path.join(str(tmpdir), "sessions.db"))
+		journals.append(journal)
+		journal.end_open_sessions()
+		statistics = usageStatistics(logger, os.path.join(str(tmpdir), "statistics.json"))
+		statistics.load(journal)
+		return journal, statistics
+
+	yield restart
+	for journal in journals:
+		journal.close()
+
+def totals(statistics):
+	return sorted((stats["username"], stats["sessions"], stats["successes"], stats["failures"]) for stats in statistics.get_all())
+
+def record(journal, statistics, username, outcome, ended):
+	session_id = journal.session_started("default", username, SOURCE_UI, started=ended - 60)
+	statistics.record_session(journal.session_ended(session_id, outcome, ended=ended))
+
+def test_checkpointed_session_counted_once(restart):
+	journal, statistics = restart()
+	record(journal, statistics, "alice", OUTCOME_FINISHED, ended=1000.0)
+	statistics.checkpoint()
+	expected = totals(statistics)
+
+	for i in range(RESTARTS):
+		journal, statistics = restart()
+		assert totals(statistics) == expected
+
+# Sessions ending at the same time as the checkpointed one, recorded after
+# the checkpoint (e.g. lost in a crash) are replayed once.
+def test_sessions_after_the_checkpoint_replayed_once(restart):
+	journal, statistics = restart()
+	record(journal, statistics, "alice", OUTCOME_FINISHED, ended=1000.0)
+	statistics.checkpoint()
+
+	journal, statistics = restart()
+	record(journal, statistics, "bob", OUTCOME_FAILED, ended=1000.0)
+	record(journal, statistics, "alice", OUTCOME_FINISHED, ended=2000.0)
+	expected = totals(statistics)
+
+	for i in range(RESTARTS):
+		journal, statistics = restart()
+		assert totals(statistics) == expected
+
+# A session left open by a restart is counted without adding the downtime
+# to its user's printing time.
+def test_interrupted_session_adds_no_duration(restart):
+	journal, statistics = restart()
+	assert statistics.get_user("carol") is None
+	journal.session_started("default", "carol", SOURCE_UI, started=3000.0)
+	statistics.checkpoint()
+
+	journal, statistics = restart()
+	carol = statistics.get_user("carol")
+	assert (carol["sessions"], carol["interrupted"]) == (1, 1)
+	assert (carol["totalDuration"], carol["meanDuration"]) == (0.0, 0.0)